@@ -8,13 +8,14 @@ from flask_login import LoginManager
 from flask_pagedown import PageDown
 from flask_redis import FlaskRedis
 from config import config
+from .metrics import TimedRedis
 
 bootstrap = Bootstrap()
 mail = Mail()
 moment = Moment()
 db = SQLAlchemy()
 pagedown = PageDown()
-redis_store = FlaskRedis()
+redis_store = FlaskRedis.from_custom_provider(TimedRedis)
 
 login_manager = LoginManager()
 login_manager.session_protection = 'strong'
@@ -37,6 +38,27 @@ def create_app(config_name):
     pagedown.init_app(app)
     redis_store.init_app(app)
 
+    from .metrics import metrics
+    metrics.init_app(app)
+
+    from .profiler import profiler
+    profiler.init_app(app)
+
+    from .email import mail_dispatcher
+    mail_dispatcher.init_app(app)
+
+    from .tokens import token_signers
+    token_signers.init_app(app)
+
+    from .fragment_cache import fragment_cache
+    fragment_cache.init_app(app)
+
+    from .storage import storage
+    storage.init_app(app)
+
+    from .game_data_cache import game_data_cache
+    game_data_cache.init_app(app)
+
     if not app.debug and not app.testing and not app.config['SSL_DISABLE']:
         from flask_sslify import SSLify
         sslify = SSLify(app)
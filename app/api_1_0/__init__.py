@@ -2,4 +2,5 @@ from flask import Blueprint
 
 api = Blueprint('api', __name__)
 
-from . import authentication, users, errors, schools, scores, lessons, screens
+from . import authentication, users, errors, schools, scores, lessons, screens, \
+    game_data, assets
@@ -0,0 +1,25 @@
+from flask import jsonify, redirect, request
+
+from . import api
+from .decorators import permission_required
+from ..models import Asset, Permission
+
+
+@api.route('/assets/<int:id>')
+@permission_required(Permission.EXIST)
+def get_asset(id):
+    asset = Asset.query.get_or_404(id)
+    return jsonify(asset.to_json(request.accept_mimetypes,
+                                 request.accept_encodings))
+
+
+@api.route('/assets/<int:id>/content')
+@permission_required(Permission.EXIST)
+def get_asset_content(id):
+    """Redirect to the smallest copy of the asset the client can use, or
+    to its thumbnail with ?thumbnail=1."""
+    asset = Asset.query.get_or_404(id)
+    thumbnail = request.args.get('thumbnail', 0, type=int) == 1
+    best = asset.best_variant(request.accept_mimetypes,
+                              request.accept_encodings, thumbnail=thumbnail)
+    return redirect(best.url if best else asset.url)
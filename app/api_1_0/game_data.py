@@ -0,0 +1,117 @@
+from flask import abort, g, jsonify, make_response, redirect, request, url_for, \
+    current_app
+
+from .. import db
+from . import api
+from .decorators import permission_required
+from .errors import conflict
+from ..models import GameData, GameDataUpload, Permission
+
+
+@api.route('/game-data/')
+def get_game_data_manifest():
+    """List the game data files with the hash, size and immutable URLs of
+    their current versions, so clients only download what changed."""
+    files = GameData.query.order_by(GameData.file_name).all()
+    response = jsonify({'files': [f.to_manifest_json() for f in files],
+                        'bundle': GameData.bundle_manifest()})
+    response.add_etag()
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['GAME_DATA_MANIFEST_MAX_AGE']
+    return response.make_conditional(request)
+
+
+@api.route('/game-data/bundle')
+def get_game_data_bundle():
+    """Redirect to the gzipped tar of every game data file, with its
+    manifest.json, for clients starting from nothing."""
+    bundle = GameData.bundle_manifest()
+    if bundle is None:
+        abort(404)
+    response = redirect(bundle['url'])
+    response.headers['X-Content-Hash'] = bundle['hash']
+    return response
+
+
+@api.route('/game-data/<file_name>/patch')
+def get_game_data_patch(file_name):
+    """JSON patch from the version the client has (?from=<hash>) to the
+    current one, whose hash is sent in X-Content-Hash. When the patch
+    wouldn't be smaller than the file, or the version is unknown, the
+    client is sent to the whole file instead."""
+    game_data = GameData.query.filter_by(file_name=file_name).first_or_404()
+    patch = game_data.patch_from(request.args.get('from', ''))
+    if patch is None or len(patch) >= game_data.size:
+        return redirect(game_data.version_url() if game_data.content_hash
+                        else game_data.url)
+    response = make_response(patch)
+    response.mimetype = 'application/json-patch+json'
+    response.headers['X-Content-Hash'] = game_data.content_hash
+    response.add_etag()
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['GAME_DATA_MANIFEST_MAX_AGE']
+    return response.make_conditional(request)
+
+
+@api.route('/game-data/<file_name>/uploads/', methods=['POST'])
+@permission_required(Permission.ADMINISTER)
+def new_game_data_upload(file_name):
+    """Start a chunked upload of new content for a game data file. The
+    body gives the file's size and SHA-256, the chunk size and the SHA-256
+    of every chunk."""
+    game_data = GameData.query.filter_by(file_name=file_name).first_or_404()
+    upload = GameDataUpload.from_json(game_data, g.current_user, request.json or {})
+    db.session.add(upload)
+    db.session.commit()
+    return jsonify(upload.to_json()), 201, \
+        {'Location': url_for('api.get_game_data_upload', id=upload.id, _external=True)}
+
+
+@api.route('/game-data/uploads/<int:id>')
+@permission_required(Permission.ADMINISTER)
+def get_game_data_upload(id):
+    """State of an upload, including the chunks still missing so an
+    interrupted client knows where to resume."""
+    upload = GameDataUpload.query.get_or_404(id)
+    return jsonify(upload.to_json())
+
+
+@api.route('/game-data/uploads/<int:id>/chunks/<int:number>', methods=['PUT'])
+@permission_required(Permission.ADMINISTER)
+def put_game_data_upload_chunk(id, number):
+    upload = GameDataUpload.query.get_or_404(id)
+    upload.add_chunk(number, request.get_data(cache=False))
+    return jsonify({'number': number, 'missing': upload.missing()})
+
+
+@api.route('/game-data/uploads/<int:id>/complete', methods=['POST'])
+@permission_required(Permission.ADMINISTER)
+def complete_game_data_upload(id):
+    """Assemble the chunks and save them as the file's content in the
+    background. Poll the upload for the outcome."""
+    upload = GameDataUpload.query.get_or_404(id)
+    upload.complete()
+    db.session.commit()
+    from ..jobs import enqueue, game_data as game_data_jobs
+    job = enqueue(game_data_jobs.save_upload, upload.id,
+                  description='Save {}'.format(upload.game_data.file_name))
+    if job is not None:
+        upload.job_id = job.id
+        db.session.commit()
+    else:
+        db.session.refresh(upload)
+    return jsonify(upload.to_json()), 202, \
+        {'Location': url_for('api.get_game_data_upload', id=upload.id, _external=True)}
+
+
+@api.route('/game-data/uploads/<int:id>', methods=['DELETE'])
+@permission_required(Permission.ADMINISTER)
+def delete_game_data_upload(id):
+    upload = GameDataUpload.query.get_or_404(id)
+    if upload.state not in ('uploading', 'saved', 'failed'):
+        # save_upload is still working on it.
+        return conflict('the upload is {}'.format(upload.state))
+    upload.abort()
+    db.session.delete(upload)
+    db.session.commit()
+    return '', 204
@@ -1,17 +1,18 @@
 from flask import jsonify, request, url_for, current_app
 
 from .. import db
+from ..pagination import paginate
 from .decorators import permission_required
 from . import api
+from ..exceptions import ValidationError
 from ..models import School, Permission, User
 
 
 @api.route('/schools/')
 def get_schools():
     page = request.args.get('page', 1, type=int)
-    pagination = School.query.paginate(
-        page, per_page=current_app.config['BACKEND_POSTS_PER_PAGE'],
-        error_out=False)
+    pagination = paginate(School.query, page,
+                          current_app.config['BACKEND_POSTS_PER_PAGE'])
     schools = pagination.items
     prev = None
     if pagination.has_prev:
@@ -23,7 +24,8 @@ def get_schools():
         'schools': [school.to_json() for school in schools],
         'prev': prev,
         'next': next,
-        'count': pagination.total
+        'count': pagination.total,
+        'count_is_approximate': pagination.approximate
     })
 
 
@@ -57,9 +59,9 @@ def edit_school(id):
 def get_teachers(id):
     school = School.query.get_or_404(id)
     page = request.args.get('page', 1, type=int)
-    pagination = school.teachers.paginate(
-        page, per_page=current_app.config['BACKEND_POSTS_PER_PAGE'],
-        error_out=False)
+    pagination = paginate(school.teachers, page,
+                          current_app.config['BACKEND_POSTS_PER_PAGE'],
+                          total=school.teacher_count)
     teachers = pagination.items
     prev = None
     if pagination.has_prev:
@@ -71,7 +73,8 @@ def get_teachers(id):
         'teachers': [teacher.to_json() for teacher in teachers],
         'prev': prev,
         'next': next,
-        'count': pagination.total
+        'count': pagination.total,
+        'count_is_approximate': pagination.approximate
     })
 
 
@@ -80,9 +83,9 @@ def get_teachers(id):
 def get_students(id):
     school = School.query.get_or_404(id)
     page = request.args.get('page', 1, type=int)
-    pagination = school.students.paginate(
-        page, per_page=current_app.config['BACKEND_POSTS_PER_PAGE'],
-        error_out=False)
+    pagination = paginate(school.students, page,
+                          current_app.config['BACKEND_POSTS_PER_PAGE'],
+                          total=school.student_count)
     students = pagination.items
     prev = None
     if pagination.has_prev:
@@ -94,7 +97,8 @@ def get_students(id):
         'students': [student.to_json() for student in students],
         'prev': prev,
         'next': next,
-        'count': pagination.total
+        'count': pagination.total,
+        'count_is_approximate': pagination.approximate
     })
 
 
@@ -119,3 +123,35 @@ def add_teacher_to_school(id):
         'school': school.to_json()
     })
 
+
+
+def add_members(school, role_name):
+    ids = request.json.get('ids', [])
+    usernames = request.json.get('usernames', [])
+    if not isinstance(ids, list) or not all(isinstance(id, int) for id in ids):
+        raise ValidationError('ids must be a list of user ids')
+    if not isinstance(usernames, list) or \
+            not all(isinstance(username, str) for username in usernames):
+        raise ValidationError('usernames must be a list of usernames')
+    if len(ids) + len(usernames) > current_app.config['BACKEND_BULK_MEMBERS_MAX']:
+        raise ValidationError('too many users, the maximum is {}'.format(
+            current_app.config['BACKEND_BULK_MEMBERS_MAX']))
+    added, existing, rejected = school.add_members(role_name, ids, usernames)
+    return jsonify({
+        'school': school.to_json(),
+        'added': added,
+        'existing': existing,
+        'rejected': rejected
+    })
+
+
+@api.route('/schools/<int:id>/students/', methods=['POST'])
+@permission_required(Permission.CREATE_SCHOOLS)
+def add_students_to_school(id):
+    return add_members(School.query.get_or_404(id), 'Student')
+
+
+@api.route('/schools/<int:id>/teachers/', methods=['POST'])
+@permission_required(Permission.CREATE_SCHOOLS)
+def add_teachers_to_school(id):
+    return add_members(School.query.get_or_404(id), 'Teacher')
@@ -1,12 +1,134 @@
-from threading import Thread
+import os
+import queue
+import threading
 from flask import current_app, render_template
 from flask_mail import Message
 from . import mail
 
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+class MailDispatcher(object):
+    """Delivers outbound mail from a bounded queue.
+
+    A fixed pool of ``MAIL_WORKERS`` threads drains the queue, sending up to
+    ``MAIL_BATCH_SIZE`` messages per SMTP connection. When the queue is full
+    producers block for ``MAIL_QUEUE_TIMEOUT`` seconds before the message is
+    dropped, so a burst of mail can't spawn unbounded threads.
+
+    ``MAIL_SINK`` selects where messages go: ``'smtp'`` (the default),
+    ``'memory'`` (kept in ``outbox``, useful for tests) or ``'file'``
+    (appended to ``MAIL_SINK_PATH``). The memory and file sinks deliver
+    synchronously.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.queue = None
+        self.workers = []
+        self.outbox = []
+        self.lock = threading.Lock()
+        self.pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if app.config['MAIL_SINK'] not in ('smtp', 'memory', 'file'):
+            raise ValueError('Unknown MAIL_SINK {}'.format(app.config['MAIL_SINK']))
+        if app.config['MAIL_SINK'] == 'file' and not app.config['MAIL_SINK_PATH']:
+            raise ValueError('MAIL_SINK_PATH must be set for the file sink')
+        self.app = app
+        self.queue = queue.Queue(maxsize=app.config['MAIL_QUEUE_SIZE'])
+        self.workers = []
+        self.outbox = []
+        self.pid = None
+        app.extensions['mail_dispatcher'] = self
+
+    def submit(self, msg):
+        sink = self.app.config['MAIL_SINK']
+        if sink == 'memory':
+            self.outbox.append(msg)
+            return True
+        if sink == 'file':
+            with self.lock, open(self.app.config['MAIL_SINK_PATH'], 'a') as f:
+                f.write(msg.as_string() + '\n\n')
+            return True
+        self._start_workers()
+        try:
+            self.queue.put(msg, timeout=self.app.config['MAIL_QUEUE_TIMEOUT'])
+        except queue.Full:
+            self.app.logger.error('Mail queue full, dropping message to %s',
+                                  ', '.join(msg.recipients))
+            return False
+        return True
+
+    def flush(self):
+        """Block until every queued message has been handled."""
+        self.queue.join()
+
+    def _start_workers(self):
+        # Workers are started lazily, and again after a fork, since threads
+        # don't survive into gunicorn's worker processes.
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.workers = []
+            for i in range(self.app.config['MAIL_WORKERS']):
+                worker = threading.Thread(target=self._work, args=(self.queue,),
+                                          name='mail-worker-{}'.format(i))
+                worker.daemon = True
+                worker.start()
+                self.workers.append(worker)
+            self.pid = os.getpid()
+
+    def _next_batch(self, q):
+        batch = [q.get()]
+        while len(batch) < self.app.config['MAIL_BATCH_SIZE']:
+            try:
+                batch.append(q.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _send_batch(self, batch):
+        # A message that fails is logged and dropped on its own. The
+        # connection may not survive the error, so the rest of the batch
+        # goes out on a new one.
+        pending = list(batch)
+        while pending:
+            connected = False
+            try:
+                with mail.connect() as conn:
+                    connected = True
+                    while pending:
+                        msg = pending.pop(0)
+                        try:
+                            conn.send(msg)
+                        except Exception:
+                            self.app.logger.exception(
+                                'Failed to send message to %s',
+                                ', '.join(msg.recipients))
+                            break
+            except Exception:
+                if connected:
+                    # Closing a broken connection; carry on with a new one.
+                    continue
+                self.app.logger.exception('Failed to send %d message(s)',
+                                          len(pending))
+                return
+
+    def _work(self, q):
+        while True:
+            batch = self._next_batch(q)
+            try:
+                with self.app.app_context():
+                    self._send_batch(batch)
+            finally:
+                for _ in batch:
+                    q.task_done()
+
+
+mail_dispatcher = MailDispatcher()
 
 
 def send_email(to, subject, template, **kwargs):
@@ -15,6 +137,4 @@ def send_email(to, subject, template, **kwargs):
                   sender=app.config['BACKEND_MAIL_SENDER'], recipients=[to])
     msg.body = render_template(template + '.txt', **kwargs)
     msg.html = render_template(template + '.html', **kwargs)
-    thr = Thread(target=send_async_email, args=[app, msg])
-    thr.start()
-    return thr
+    return mail_dispatcher.submit(msg)
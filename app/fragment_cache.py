@@ -0,0 +1,132 @@
+from flask import current_app, has_app_context
+from flask_sqlalchemy import SignallingSession
+from jinja2 import Markup
+from redis.exceptions import RedisError
+from sqlalchemy import event, inspect, select
+
+from . import redis_store
+
+
+class FragmentCache(object):
+    """Caches rendered template fragments in Redis.
+
+    Templates wrap a fragment in ``{% call cached_fragment(name, *versions,
+    key=...) %}``. Each version is a model instance (``'users:5'``) or a
+    plain name (``'schools'``) whose counter is bumped whenever the data it
+    covers is written, so a fragment key changes as soon as anything it
+    shows does. ``key`` holds extra parts such as the page number.
+
+    When ``FRAGMENT_CACHE_ENABLED`` is off, or Redis is unavailable,
+    fragments are rendered every time.
+    """
+
+    def init_app(self, app):
+        app.jinja_env.globals['cached_fragment'] = self.fragment
+
+    @property
+    def enabled(self):
+        return has_app_context() and current_app.config['FRAGMENT_CACHE_ENABLED']
+
+    @staticmethod
+    def version_name(obj):
+        if isinstance(obj, str):
+            return obj
+        return '{}:{}'.format(obj.__tablename__, obj.id)
+
+    def fragment(self, name, *versions, **kwargs):
+        caller = kwargs['caller']
+        if not self.enabled:
+            return caller()
+        names = [self.version_name(v) for v in versions]
+        try:
+            numbers = redis_store.mget(['fragment-version:' + n for n in names]) \
+                if names else []
+            key = 'fragment:{}:{}:{}'.format(
+                name,
+                ','.join('{}={}'.format(n, (v or b'0').decode())
+                         for n, v in zip(names, numbers)),
+                ':'.join(str(k) for k in kwargs.get('key', ())))
+            html = redis_store.get(key)
+            if html is not None:
+                return Markup(html.decode('utf-8'))
+            html = caller()
+            redis_store.setex(key, current_app.config['FRAGMENT_CACHE_TIMEOUT'],
+                              html)
+            return html
+        except RedisError:
+            current_app.logger.exception('Fragment cache unavailable')
+            return caller()
+
+    def bump(self, *versions):
+        """Invalidate every fragment that depends on the given versions."""
+        if not self.enabled or not versions:
+            return
+        try:
+            pipe = redis_store.pipeline()
+            for v in versions:
+                pipe.incr('fragment-version:' + self.version_name(v))
+            pipe.execute()
+        except RedisError:
+            current_app.logger.exception('Fragment cache unavailable')
+
+
+fragment_cache = FragmentCache()
+
+# Columns whose changes don't show up in any cached fragment.
+IGNORED_COLUMNS = frozenset(['updated'])
+
+
+def _changed(obj):
+    state = inspect(obj)
+    return any(state.attrs[attr.key].history.has_changes()
+               for attr in state.mapper.column_attrs
+               if attr.key not in IGNORED_COLUMNS)
+
+
+@event.listens_for(SignallingSession, 'after_flush')
+def _collect_versions(session, flush_context):
+    from .models import User, School, Score, UserSchool
+
+    versions = session.info.setdefault('fragment_versions', set())
+    changed_users = set()
+    # Users whose role changed, which moves them between member counts.
+    recounted_users = set()
+    dirty = session.dirty
+    for obj in session.new | dirty | session.deleted:
+        if obj in dirty and not _changed(obj):
+            continue
+        if isinstance(obj, User):
+            versions.add('users:{}'.format(obj.id))
+            changed_users.add(obj.id)
+            if obj in dirty and inspect(obj).attrs.role_id.history.has_changes():
+                recounted_users.add(obj.id)
+        elif isinstance(obj, School):
+            versions.update(['schools:{}'.format(obj.id), 'schools'])
+        elif isinstance(obj, Score):
+            versions.add('users:{}'.format(obj.user_id))
+        elif isinstance(obj, UserSchool):
+            # The schools list shows member counts.
+            versions.update(['users:{}'.format(obj.user_id),
+                             'schools:{}'.format(obj.school_id), 'schools'])
+    if changed_users:
+        # School pages list their members.
+        table = UserSchool.__table__
+        rows = session.execute(select([table.c.user_id, table.c.school_id])
+                               .where(table.c.user_id.in_(list(changed_users))))
+        for user_id, school_id in rows:
+            versions.add('schools:{}'.format(school_id))
+            if user_id in recounted_users:
+                # The schools list shows member counts.
+                versions.add('schools')
+
+
+@event.listens_for(SignallingSession, 'after_commit')
+def _bump_versions(session):
+    versions = session.info.pop('fragment_versions', None)
+    if versions:
+        fragment_cache.bump(*versions)
+
+
+@event.listens_for(SignallingSession, 'after_soft_rollback')
+def _discard_versions(session, previous_transaction):
+    session.info.pop('fragment_versions', None)
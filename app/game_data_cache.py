@@ -0,0 +1,150 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+
+class _Entry(object):
+    __slots__ = ('etag', 'body', 'checked')
+
+    def __init__(self, etag, body, checked):
+        self.etag = etag
+        self.body = body
+        self.checked = checked
+
+
+class _State(object):
+    def __init__(self, max_bytes, ttl, directory):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+
+class GameDataCache(object):
+    """Read-through cache of game data files, keyed by file name and ETag.
+
+    Bodies are kept in an in-process LRU bounded by
+    ``GAME_DATA_CACHE_MAX_BYTES`` and, when ``GAME_DATA_CACHE_DIR`` is set,
+    copied to disk so other processes on the host and restarts start warm.
+    An entry is served as is for ``GAME_DATA_CACHE_TTL`` seconds after it
+    was last checked; after that the loader is asked for the file only if
+    its ETag changed.
+    """
+
+    def init_app(self, app):
+        directory = app.config['GAME_DATA_CACHE_DIR']
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        app.extensions['game_data_cache'] = _State(
+            app.config['GAME_DATA_CACHE_MAX_BYTES'],
+            app.config['GAME_DATA_CACHE_TTL'], directory)
+
+    @property
+    def _state(self):
+        return current_app.extensions['game_data_cache']
+
+    def get(self, key, load):
+        """Return the body cached for key.
+
+        ``load(etag)`` fetches it on a miss or once the entry is due for a
+        check: it returns ``(etag, body)``, or None when the file still has
+        the ETag it was given.
+        """
+        state = self._state
+        with state.lock:
+            entry = state.entries.get(key)
+            if entry is not None:
+                state.entries.move_to_end(key)
+        if entry is None:
+            entry = self._read_disk(state, key)
+        if entry is not None and time.time() - entry.checked < state.ttl:
+            return entry.body
+        loaded = load(entry.etag if entry is not None else None)
+        if loaded is None:
+            entry.checked = time.time()
+            self._remember(state, key, entry)
+            return entry.body
+        etag, body = loaded
+        self.put(key, etag, body)
+        return body
+
+    def put(self, key, etag, body):
+        """Store body as the current version of key, e.g. after writing it."""
+        state = self._state
+        entry = _Entry(etag, body, time.time())
+        self._remember(state, key, entry)
+        self._write_disk(state, key, entry)
+
+    def invalidate(self, key):
+        state = self._state
+        with state.lock:
+            entry = state.entries.pop(key, None)
+            if entry is not None:
+                state.size -= len(entry.body)
+        if state.directory:
+            for path in self._paths(state, key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def clear(self):
+        """Drop the in-process entries; copies on disk are kept."""
+        state = self._state
+        with state.lock:
+            state.entries.clear()
+            state.size = 0
+
+    @staticmethod
+    def _remember(state, key, entry):
+        with state.lock:
+            old = state.entries.pop(key, None)
+            if old is not None:
+                state.size -= len(old.body)
+            if len(entry.body) > state.max_bytes:
+                return
+            state.entries[key] = entry
+            state.size += len(entry.body)
+            while state.size > state.max_bytes:
+                _, evicted = state.entries.popitem(last=False)
+                state.size -= len(evicted.body)
+
+    @staticmethod
+    def _paths(state, key):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        path = os.path.join(state.directory, name)
+        return path, path + '.etag'
+
+    def _read_disk(self, state, key):
+        if not state.directory:
+            return None
+        body_path, etag_path = self._paths(state, key)
+        try:
+            with open(etag_path) as f:
+                etag = f.read()
+            with open(body_path, 'rb') as f:
+                body = f.read()
+        except (IOError, OSError):
+            return None
+        # Copies on disk are checked before being served.
+        return _Entry(etag, body, 0)
+
+    def _write_disk(self, state, key, entry):
+        if not state.directory:
+            return
+        for path, data in zip(self._paths(state, key),
+                              (entry.body, entry.etag.encode('utf-8'))):
+            fd, tmp = tempfile.mkstemp(dir=state.directory)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+
+
+game_data_cache = GameDataCache()
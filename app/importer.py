@@ -0,0 +1,124 @@
+import csv
+
+from . import db
+from .models import User, Role, insert_ignoring_duplicates
+from .passwords import hash_passwords
+
+
+class ImportReport(object):
+    """Outcome of a student import: the usernames created and skipped
+    (already taken), and a (line, message) pair per rejected row."""
+
+    def __init__(self):
+        self.created = []
+        self.skipped = []
+        self.errors = []
+
+    def to_json(self):
+        return {
+            'created': self.created,
+            'skipped': self.skipped,
+            'errors': [{'line': line, 'message': message}
+                       for line, message in self.errors],
+        }
+
+
+def parse_students(lines, delimiter=','):
+    """Yield (line number, [username, password, teacher]) for each row of
+    a students CSV. Malformed rows are yielded as (line number, None)."""
+    for line, row in enumerate(csv.reader(lines, delimiter=delimiter), 1):
+        if not row:
+            continue
+        if len(row) != 3 or not row[0].strip() or not row[1]:
+            yield line, None
+        else:
+            yield line, [row[0].strip(), row[1], row[2].strip()]
+
+
+def import_students(lines, delimiter=',', batch_size=500, progress=None):
+    """Create student accounts from an iterable of CSV lines.
+
+    Rows are read and inserted batch_size at a time, so the whole file is
+    never held in memory. Each batch resolves its teachers and existing
+    usernames with one query each and is written with a single
+    multi-row INSERT that ignores conflicting usernames.
+
+    progress, if given, is called with the number of lines read after
+    each batch.
+    """
+    report = ImportReport()
+    role = Role.get('Student')
+    teacher_ids = {}
+    batch = []
+    line = 0
+    for line, row in parse_students(lines, delimiter):
+        if row is None:
+            report.errors.append(
+                (line, 'expected username, password and teacher'))
+            continue
+        batch.append((line, row))
+        if len(batch) >= batch_size:
+            _import_batch(batch, role, teacher_ids, report)
+            batch = []
+            if progress is not None:
+                progress(line)
+    if batch:
+        _import_batch(batch, role, teacher_ids, report)
+    if progress is not None and line:
+        progress(line)
+    report.errors.sort()
+    return report
+
+
+def _import_batch(batch, role, teacher_ids, report):
+    usernames = [row[0] for _, row in batch]
+    existing = set(username for username, in db.session.query(User.username)
+                   .filter(User.username.in_(usernames)))
+
+    unresolved = set(row[2] for _, row in batch if row[2]) - set(teacher_ids)
+    if unresolved:
+        teacher_ids.update(dict.fromkeys(unresolved))
+        teacher_ids.update(
+            (username, id) for id, username in
+            db.session.query(User.id, User.username)
+            .filter(User.username.in_(unresolved)))
+
+    pending = []
+    for line, (username, password, teacher) in batch:
+        if username in existing:
+            report.skipped.append(username)
+            continue
+        if teacher and teacher_ids[teacher] is None:
+            report.errors.append((line, 'unknown teacher {}'.format(teacher)))
+            continue
+        existing.add(username)
+        pending.append((username, password, teacher))
+    if not pending:
+        return
+
+    password_hashes = hash_passwords(password for _, password, _ in pending)
+    rows = [{
+        'username': username,
+        'password_hash': password_hash,
+        'confirmed': True,
+        'enabled': True,
+        'name': username,
+        'gender': 'undefined',
+        'role_id': role.id,
+        'teacher_id': teacher_ids[teacher] if teacher else None,
+    } for (username, _, teacher), password_hash in zip(pending, password_hashes)]
+
+    result = db.session.execute(
+        insert_ignoring_duplicates(User.__table__).values(rows))
+    db.session.commit()
+
+    created = [row['username'] for row in rows]
+    if result.rowcount != len(rows):
+        # Some usernames were taken concurrently; the salted hashes tell
+        # which rows are ours.
+        ours = set(username for username, in db.session.query(User.username)
+                   .filter(User.username.in_(created))
+                   .filter(User.password_hash.in_(password_hashes)))
+        report.skipped.extend(u for u in created if u not in ours)
+        created = [u for u in created if u in ours]
+    report.created.extend(created)
@@ -1 +1,82 @@
-from . import game_stats
+from flask import current_app
+from flask_login import current_user
+from .. import redis_store
+
+
+def enqueue(f, *args, **kwargs):
+    """Run f on the RQ worker and return the job. When JOBS_SYNC is set
+    (as in testing) f runs inline instead and None is returned.
+
+    ``description`` names the job on its status page. The job's meta
+    records the user who started it, so only they (or an administrator)
+    can follow it, and the progress it reports with set_progress.
+    """
+    if current_app.config['JOBS_SYNC']:
+        kwargs.pop('timeout', None)
+        kwargs.pop('description', None)
+        f(*args, **kwargs)
+        return None
+    from rq import Queue
+    user_id = current_user.id \
+        if current_user and current_user.is_authenticated else None
+    kwargs.setdefault('result_ttl', current_app.config['JOBS_RESULT_TTL'])
+    q = Queue(connection=redis_store)
+    return q.enqueue(f, *args, meta={'user_id': user_id, 'progress': None},
+                     **kwargs)
+
+
+def set_progress(done, total=None):
+    """Report how much of the current job is done. Does nothing when not
+    running on a worker."""
+    from rq import get_current_job
+    job = get_current_job()
+    if job is None:
+        return
+    job.meta['progress'] = [done, total]
+    job.save_meta()
+
+
+def fetch(job_id):
+    """Return the job with the given id, or None if it doesn't exist or its
+    result has expired."""
+    from rq.job import Job
+    from rq.exceptions import NoSuchJobError
+    try:
+        return Job.fetch(job_id, connection=redis_store)
+    except NoSuchJobError:
+        return None
+
+
+def work(app, queues=('high', 'default', 'low')):
+    """Run an RQ worker on queues. Each job runs in an application context
+    of app, so it can use current_app, db and storage, and its database
+    session is removed when it ends."""
+    from rq import Queue, Worker
+
+    class AppWorker(Worker):
+        def perform_job(self, job, queue):
+            with app.app_context():
+                return super(AppWorker, self).perform_job(job, queue)
+
+    AppWorker([Queue(name, connection=redis_store) for name in queues],
+              connection=redis_store).work()
+
+
+def job_to_json(job):
+    status = job.get_status()
+    json_job = {
+        'id': job.id,
+        'description': job.description,
+        'status': status,
+        'progress': job.meta.get('progress'),
+        'enqueued_at': job.enqueued_at,
+        'ended_at': job.ended_at,
+    }
+    if status == 'finished':
+        json_job['result'] = job.result
+    elif status == 'failed' and job.exc_info:
+        json_job['error'] = job.exc_info.strip().splitlines()[-1]
+    return json_job
+
+
+from . import assets, game_data, game_stats, users
@@ -0,0 +1,172 @@
+import gzip
+import hashlib
+import io
+import json
+import mimetypes
+
+from flask import current_app
+from PIL import Image
+
+from . import enqueue, set_progress
+from .. import db
+from ..models import Asset, AssetVariant
+from ..storage import storage, IMMUTABLE_CACHE_CONTROL
+
+
+def sync_assets(batch_size=1000):
+    """Make the assets table match the objects under the assets prefix:
+    add a row for each object without one and delete rows, including
+    duplicates, whose object is gone. Nothing is deleted if listing fails.
+    Each added asset is then processed by its own process_asset job."""
+    rows = {}
+    for id, file_name in db.session.query(Asset.id, Asset.file_name).order_by(Asset.id):
+        rows.setdefault(file_name, []).append(id)
+
+    listed = 0
+    seen = set()
+    new = []
+    added = []
+    for key, _, last_modified in storage.list(Asset.PREFIX):
+        file_name = key[len(Asset.PREFIX):]
+        listed += 1
+        if not file_name or file_name.endswith('/') or file_name in seen:
+            continue
+        seen.add(file_name)
+        if file_name not in rows:
+            new.append({'file_name': file_name,
+                        'file_type': mimetypes.guess_type(file_name)[0],
+                        'created': last_modified})
+        if len(new) >= batch_size:
+            ids = _insert_rows(new)
+            db.session.commit()
+            _process_assets(ids)
+            added.extend(ids)
+            new = []
+            set_progress(listed)
+    ids = _insert_rows(new) if new else []
+
+    stale = []
+    for file_name, row_ids in rows.items():
+        stale.extend(row_ids[1:] if file_name in seen else row_ids)
+    for i in range(0, len(stale), batch_size):
+        _delete_rows(stale[i:i + batch_size])
+    db.session.commit()
+    _process_assets(ids)
+    added.extend(ids)
+    set_progress(listed, listed)
+    return {'listed': listed, 'added': len(added), 'removed': len(stale)}
+
+
+def _insert_rows(rows):
+    """Insert asset rows and return their ids. The file names weren't in
+    the table before, so every row with one of them is new."""
+    db.session.execute(Asset.__table__.insert().values(rows))
+    return [id for id, in db.session.query(Asset.id).filter(
+        Asset.file_name.in_([row['file_name'] for row in rows]))]
+
+
+def _process_assets(asset_ids):
+    for asset_id in asset_ids:
+        enqueue(process_asset, asset_id, description='Process asset {}'.format(asset_id))
+
+
+def _delete_rows(asset_ids):
+    """Delete assets' rows and their variants, rows and objects."""
+    variants = AssetVariant.query.filter(AssetVariant.asset_id.in_(asset_ids))
+    storage.delete_many(key for key, in variants.with_entities(AssetVariant.key))
+    variants.delete(synchronize_session=False)
+    Asset.query.filter(Asset.id.in_(asset_ids)).delete(synchronize_session=False)
+
+
+def delete_assets(asset_ids, batch_size=1000):
+    """Delete the given assets' objects with batched multi-object deletes,
+    and the rows of those that were deleted."""
+    failed = []
+    deleted = 0
+    for i in range(0, len(asset_ids), batch_size):
+        assets = db.session.query(Asset.id, Asset.file_name) \
+            .filter(Asset.id.in_(asset_ids[i:i + batch_size])).all()
+        failed_keys = set(storage.delete_many(
+            Asset.PREFIX + file_name for _, file_name in assets))
+        ids = [id for id, file_name in assets
+               if Asset.PREFIX + file_name not in failed_keys]
+        if ids:
+            _delete_rows(ids)
+        db.session.commit()
+        deleted += len(ids)
+        failed.extend(file_name for _, file_name in assets
+                      if Asset.PREFIX + file_name in failed_keys)
+        set_progress(min(i + batch_size, len(asset_ids)), len(asset_ids))
+    return {'deleted': deleted, 'failed': failed}
+
+
+def _image_variants(body, file_name):
+    try:
+        image = Image.open(io.BytesIO(body))
+        image.load()
+    except IOError:
+        current_app.logger.warning('%s is not a readable image, skipping '
+                                   'its variants', file_name)
+        return []
+    quality = current_app.config['ASSET_WEBP_QUALITY']
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+    variants = []
+    out = io.BytesIO()
+    image.save(out, 'WEBP', quality=quality)
+    variants.append(('webp', 'image/webp', None, out.getvalue()))
+    size = current_app.config['ASSET_THUMBNAIL_SIZE']
+    image.thumbnail((size, size))
+    out = io.BytesIO()
+    image.save(out, 'WEBP', quality=quality)
+    variants.append(('thumbnail', 'image/webp', None, out.getvalue()))
+    return variants
+
+
+def _json_variants(body, file_name):
+    minified = json.dumps(json.loads(body.decode('utf-8')), ensure_ascii=False,
+                          separators=(',', ':')).encode('utf-8')
+    return [('minified', 'application/json', None, minified),
+            ('gzip', 'application/json', 'gzip', gzip.compress(minified, 9))]
+
+
+# Content type -> function making (kind, content type, encoding, body)
+# variants of an asset with that type.
+VARIANT_MAKERS = {
+    'image/png': _image_variants,
+    'image/jpeg': _image_variants,
+    'application/json': _json_variants,
+}
+
+
+def process_asset(asset_id):
+    """Record an uploaded asset's size and hash and store its variants:
+    WebP copies and thumbnails of images, minified and gzipped JSON.
+    Variants that come out larger than the original are dropped, except
+    thumbnails."""
+    asset = Asset.query.get(asset_id)
+    _, body = storage.get(asset.key)
+    asset.size = len(body)
+    asset.content_hash = hashlib.sha256(body).hexdigest()
+
+    file_type = asset.file_type or mimetypes.guess_type(asset.file_name)[0]
+    make_variants = VARIANT_MAKERS.get(file_type)
+    old_keys = [v.key for v in asset.variants]
+    asset.variants = []
+    for kind, content_type, encoding, variant in \
+            (make_variants(body, asset.file_name) if make_variants else []):
+        if kind != 'thumbnail' and len(variant) >= len(body):
+            continue
+        key = '{}{}/{}/{}'.format(AssetVariant.PREFIX, asset.content_hash, kind,
+                                  asset.file_name)
+        storage.put(key, variant, content_type=content_type,
+                    content_encoding=encoding,
+                    cache_control=IMMUTABLE_CACHE_CONTROL)
+        asset.variants.append(AssetVariant(
+            kind=kind, content_type=content_type, encoding=encoding,
+            size=len(variant), content_hash=hashlib.sha256(variant).hexdigest(),
+            key=key))
+    db.session.commit()
+    new_keys = set(v.key for v in asset.variants)
+    storage.delete_many(key for key in old_keys if key not in new_keys)
+    return {'size': asset.size, 'variants': [v.kind for v in asset.variants]}
@@ -0,0 +1,114 @@
+import hashlib
+import io
+import json
+import tarfile
+import time
+
+import ijson
+
+from .. import db
+from ..models import GameData, GameDataUpload
+from ..game_data_cache import game_data_cache
+from ..storage import storage, IMMUTABLE_CACHE_CONTROL
+from . import set_progress
+
+# How much of an assembled upload is read from storage at a time.
+READ_SIZE = 1024 * 1024
+
+
+def save_content(game_data_id, content):
+    GameData.query.get(game_data_id).content = content
+    db.session.commit()
+    build_bundle()
+
+
+def build_bundle():
+    """Pack the current version of every game data file into one gzipped
+    tar with a manifest.json, so clients can start up with a single
+    download. Does nothing when the latest bundle is already current."""
+    files = GameData.query.filter(GameData.content_hash.isnot(None)) \
+        .order_by(GameData.file_name).all()
+    if not files:
+        return None
+    bundle_hash = GameData.bundle_hash(files)
+    current = GameData.bundle_manifest()
+    if current is not None and current['hash'] == bundle_hash:
+        return current
+
+    manifest = {
+        'hash': bundle_hash,
+        'files': [{'file_name': f.file_name, 'hash': f.content_hash, 'size': f.size}
+                  for f in files],
+    }
+    members = [('manifest.json', json.dumps(manifest, indent=2).encode('utf-8'))]
+    for f in files:
+        members.append((f.file_name, storage.get(f.version_key())[1]))
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode='w:gz') as tar:
+        for name, body in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(body)
+            info.mtime = time.time()
+            tar.addfile(info, io.BytesIO(body))
+    archive = archive.getvalue()
+
+    key = GameData.bundle_key(bundle_hash)
+    storage.put(key, archive, content_type='application/gzip',
+                cache_control=IMMUTABLE_CACHE_CONTROL)
+    manifest.update({'url': GameData.public_url(key), 'size': len(archive)})
+    storage.put(GameData.BUNDLE_MANIFEST_KEY, json.dumps(manifest),
+                content_type='application/json')
+    game_data_cache.invalidate(GameData.BUNDLE_MANIFEST_KEY)
+    return manifest
+
+
+def _read(upload):
+    """Read the assembled file, checking it against the size and hash the
+    client declared."""
+    digest = hashlib.sha256()
+    body = bytearray()
+    stream = storage.open(upload.key)
+    try:
+        while True:
+            data = stream.read(READ_SIZE)
+            if not data:
+                break
+            digest.update(data)
+            body.extend(data)
+            set_progress(len(body), upload.size)
+    finally:
+        stream.close()
+    if len(body) != upload.size or digest.hexdigest() != upload.content_hash:
+        raise ValueError('the assembled file does not match its size and hash')
+    return bytes(body)
+
+
+def _validate_json(body):
+    """Raise ValueError unless body is one JSON document. It is parsed as
+    a stream of events, so checking a large file doesn't build it in
+    memory as Python objects."""
+    try:
+        for _ in ijson.parse(io.BytesIO(body)):
+            pass
+    except ijson.JSONError as e:
+        raise ValueError(str(e).splitlines()[0])
+
+
+def save_upload(upload_id):
+    """Check an assembled game data upload and save it as the file's
+    content."""
+    upload = GameDataUpload.query.get(upload_id)
+    try:
+        body = _read(upload)
+        _validate_json(body)
+    except ValueError as e:
+        upload.state = 'failed'
+        upload.error = 'Invalid upload: {}'.format(e)[:255]
+    else:
+        upload.game_data.content = body
+        upload.state = 'saved'
+    storage.delete(upload.key)
+    db.session.commit()
+    if upload.state == 'saved':
+        build_bundle()
+    return {'state': upload.state, 'error': upload.error}
@@ -1,8 +1,8 @@
 import json
 from tempfile import NamedTemporaryFile
 import csv
-import boto3
 from .. import db
+from ..storage import storage
 from rq import get_current_job
 from collections import defaultdict
 
@@ -336,7 +336,7 @@ def _get_username(user_id):
     ret = result.fetchone()
     return ret[0] if ret[0] else ""
 
-def game_stats(aws_region, s3_bucket, user_id, user_role):
+def game_stats(user_id, user_role, key=None):
     users = []
 
     if user_role == 'teacher':
@@ -389,10 +389,9 @@ def game_stats(aws_region, s3_bucket, user_id, user_role):
 
     tempfile.seek(0)
 
-    job_id = get_current_job().id
+    if key is None:
+        key = 'jobs/{}.csv'.format(get_current_job().id)
 
-    s3 = boto3.resource('s3', aws_region)
-    s3_object = s3.Object(s3_bucket, 'jobs/{}.csv'.format(job_id))
-    s3_object.put(Body=tempfile.read(), ContentType='text/csv')
+    storage.put(key, tempfile.read(), content_type='text/csv')
 
     tempfile.close()
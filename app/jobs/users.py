@@ -0,0 +1,19 @@
+from . import set_progress
+from ..models import User
+
+
+def import_students_from_data(csv_data, delimiter):
+    total = len(csv_data.splitlines())
+    return User.import_students_from_data(
+        csv_data, delimiter,
+        progress=lambda done: set_progress(done, total)).to_json()
+
+
+def import_students():
+    return User.import_students(progress=set_progress).to_json()
+
+
+def delete_users(user_ids, batch_size=500):
+    for i in range(0, len(user_ids), batch_size):
+        User.delete_users(user_ids[i:i + batch_size])
+        set_progress(min(i + batch_size, len(user_ids)), len(user_ids))
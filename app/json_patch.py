@@ -0,0 +1,84 @@
+"""JSON Patch (RFC 6902) documents between two JSON values."""
+import copy
+
+
+def _pointer(path):
+    return ''.join('/' + str(p).replace('~', '~0').replace('/', '~1') for p in path)
+
+
+def _same(a, b):
+    # 1 == 1.0 == True in Python, but not in JSON. Only for scalars: on
+    # containers == would compare what they hold the Python way.
+    return type(a) is type(b) and a == b
+
+
+def _diff(a, b, path, ops):
+    if isinstance(a, dict) and isinstance(b, dict):
+        for key in a:
+            if key not in b:
+                ops.append({'op': 'remove', 'path': _pointer(path + [key])})
+        for key in b:
+            if key in a:
+                _diff(a[key], b[key], path + [key], ops)
+            else:
+                ops.append({'op': 'add', 'path': _pointer(path + [key]),
+                            'value': b[key]})
+    elif isinstance(a, list) and isinstance(b, list):
+        common = min(len(a), len(b))
+        for i in range(common):
+            _diff(a[i], b[i], path + [i], ops)
+        # Removed from the end first, so earlier indexes stay valid.
+        for i in range(len(a) - 1, common - 1, -1):
+            ops.append({'op': 'remove', 'path': _pointer(path + [i])})
+        for i in range(common, len(b)):
+            ops.append({'op': 'add', 'path': _pointer(path + ['-']),
+                        'value': b[i]})
+    elif not _same(a, b):
+        ops.append({'op': 'replace', 'path': _pointer(path), 'value': b})
+
+
+def diff(a, b):
+    """Return the list of operations that turns a into b.
+
+    Objects are compared key by key and arrays index by index, which keeps
+    patches small for edits in place such as changed translations. An item
+    inserted in the middle of an array shows up as every later item being
+    replaced.
+    """
+    ops = []
+    _diff(a, b, [], ops)
+    return ops
+
+
+def _parse(pointer):
+    if pointer == '':
+        return []
+    return [p.replace('~1', '/').replace('~0', '~') for p in pointer.split('/')[1:]]
+
+
+def apply(doc, patch):
+    """Return a copy of doc with the add, remove and replace operations in
+    patch applied, as a client would."""
+    doc = copy.deepcopy(doc)
+    for op in patch:
+        path = _parse(op['path'])
+        if not path:
+            doc = copy.deepcopy(op.get('value'))
+            continue
+        parent = doc
+        for p in path[:-1]:
+            parent = parent[int(p)] if isinstance(parent, list) else parent[p]
+        last = path[-1]
+        if isinstance(parent, list):
+            if op['op'] == 'add':
+                index = len(parent) if last == '-' else int(last)
+                parent.insert(index, copy.deepcopy(op['value']))
+            elif op['op'] == 'remove':
+                del parent[int(last)]
+            else:
+                parent[int(last)] = copy.deepcopy(op['value'])
+        elif op['op'] == 'remove':
+            del parent[last]
+        else:
+            parent[last] = copy.deepcopy(op['value'])
+    return doc
@@ -55,6 +55,29 @@ class DeleteSchoolForm(FlaskForm):
             raise ValidationError('Wrong school name')
 
 
+class SearchSelectField(SelectField):
+    """A select whose options are fetched from a search endpoint. Only
+    the current choice is rendered, and the submitted id is checked by the
+    form's own validator instead of against a full list of choices. An
+    empty submission leaves the field's data None."""
+
+    def process_formdata(self, valuelist):
+        if valuelist and valuelist[0] == '':
+            self.data = None
+        else:
+            super(SearchSelectField, self).process_formdata(valuelist)
+
+    def pre_validate(self, form):
+        pass
+
+
+class SearchSelectMultipleField(SelectMultipleField):
+    """Multiple-choice counterpart of SearchSelectField."""
+
+    def pre_validate(self, form):
+        pass
+
+
 class EditProfileAdminForm(FlaskForm):
     email = StringField('Email')
     username = StringField('Username', validators=[
@@ -65,22 +88,20 @@ class EditProfileAdminForm(FlaskForm):
     enabled = BooleanField('Enabled')
     role = SelectField('Role', coerce=int)
     name = StringField('Real name', validators=[Length(0, 64)])
-    teacher = SelectField('Teacher', coerce=int)
-    schools = SelectMultipleField('School', coerce=int)
+    teacher = SearchSelectField('Teacher', coerce=int)
+    schools = SearchSelectMultipleField('School', coerce=int)
     submit = SubmitField('Submit')
 
     def __init__(self, user, *args, **kwargs):
-        r = Role.get('Teacher')
         super(EditProfileAdminForm, self).__init__(*args, **kwargs)
         self.role.choices = [(role.id, role.name)
                              for role in Role.query.order_by(Role.name).all()]
         if user.is_student():
-            self.teacher.choices = [(teacher.id, teacher.name)
-                                    for teacher in User.query.filter(User.role_id == r.id).order_by(User.name).all()]
+            self.teacher.choices = [(user.teacher.id, user.teacher.name)] \
+                if user.teacher else []
         else:
             del(self.teacher)
-        self.schools.choices = [(school.id, school.name)
-                               for school in School.query.order_by(School.name).all()]
+        self.schools.choices = [(school.id, school.name) for school in user.schools]
         self.user = user
 
     def validate_email(self, field):
@@ -94,6 +115,16 @@ class EditProfileAdminForm(FlaskForm):
                 User.query.filter_by(username=field.data).first():
             raise ValidationError('Username already in use.')
 
+    def validate_teacher(self, field):
+        if field.data is not None and \
+                User.teachers().filter(User.id == field.data).first() is None:
+            raise ValidationError('Unknown teacher.')
+
+    def validate_schools(self, field):
+        ids = set(field.data or [])
+        if ids and School.query.filter(School.id.in_(ids)).count() != len(ids):
+            raise ValidationError('Unknown school.')
+
 
 class UserForm(FlaskForm):
     username = StringField('Username', validators=[
@@ -114,13 +145,12 @@ class BatchUsersForm(FlaskForm):
     submit = SubmitField('Submit')
 
     def validate_csv_data(self, field):
-        import csv
-        try:
-            csvreader = csv.reader(field.data.splitlines(), delimiter='\t')
-            for username, password, teacher in csvreader:
-                pass
-        except:
-            raise ValidationError('Invalid CSV format')
+        from ..importer import parse_students
+        lines = [str(line) for line, row in
+                 parse_students(field.data.splitlines(), delimiter='\t')
+                 if row is None]
+        if lines:
+            raise ValidationError('Invalid CSV format on line(s) {}'.format(', '.join(lines)))
 
 
 class SchoolForm(FlaskForm):
@@ -171,6 +201,19 @@ class DeleteAssetForm(FlaskForm):
     submit = SubmitField('Delete asset')
 
 
+class DeleteAssetsForm(FlaskForm):
+    ids = SearchSelectMultipleField('Assets', coerce=int, choices=[])
+    submit = SubmitField('Delete selected')
+
+    def validate_ids(self, field):
+        if not field.data:
+            raise ValidationError('No assets selected.')
+
+
+class SyncAssetsForm(FlaskForm):
+    submit = SubmitField('Sync with storage')
+
+
 class GameDataForm(FlaskForm):
     file_content = TextAreaField('Game Data content', validators=[DataRequired()])
     submit = SubmitField('Submit')
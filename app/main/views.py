@@ -1,32 +1,24 @@
-import boto3
+import uuid
+
 from flask import json
 from flask import render_template, redirect, url_for, abort, flash, request, \
-    current_app, make_response
+    current_app, make_response, jsonify
 from flask_login import login_required, current_user
-from flask_sqlalchemy import get_debug_queries
 from sqlalchemy import text
+from sqlalchemy.orm import joinedload
 
 from . import main
 from .forms import EditProfileForm, EditProfileAdminForm, SchoolForm, \
         UserForm, EditSchoolForm, AssetForm, DeleteUserForm, DeleteSchoolForm, \
         ChangePasswordAdminForm, GameDataForm, DeleteAssetForm, DeleteUserStudentsForm, \
-        BatchUsersForm
-from .. import db, redis_store
+        BatchUsersForm, DeleteAssetsForm, SyncAssetsForm
+from .. import db
 from ..decorators import admin_required
+from ..pagination import paginate
+from ..storage import storage
 from ..models import Role, User, School, Permission, Score, Asset, GameData, UserSchool
 
 
-@main.after_app_request
-def after_request(response):
-    for query in get_debug_queries():
-        if query.duration >= current_app.config['BACKEND_SLOW_DB_QUERY_TIME']:
-            current_app.logger.warning(
-                'Slow query: %s\nParameters: %s\nDuration: %fs\nContext: %s\n'
-                % (query.statement, query.parameters, query.duration,
-                   query.context))
-    return response
-
-
 @main.route('/', methods=['GET', 'POST'])
 def index():
     return render_template('index.html')
@@ -46,6 +38,14 @@ def school(id):
     return render_template('school.html', school=school)
 
 
+SCHOOL_SORT_ORDERS = {
+    'created': School.created.desc(),
+    'name': School.name,
+    'teachers': School.teacher_count.desc(),
+    'students': School.student_count.desc(),
+}
+
+
 @main.route('/schools', methods=['GET', 'POST'])
 @login_required
 def schools():
@@ -60,20 +60,23 @@ def schools():
             .filter(UserSchool.user_id == current_user.id)
     else:
         query = School.query
-    pagination = query.order_by(School.created.desc()).paginate(
-        page, per_page=current_app.config['BACKEND_POSTS_PER_PAGE'],
-        error_out=False)
+    sort = request.args.get('sort', 'created', type=str)
+    order = SCHOOL_SORT_ORDERS.get(sort)
+    if order is None:
+        sort, order = 'created', SCHOOL_SORT_ORDERS['created']
+    pagination = paginate(query.order_by(order, School.id.desc()), page,
+                          current_app.config['BACKEND_POSTS_PER_PAGE'])
     schools = pagination.items
-    return render_template('schools.html', form=form, schools=schools, pagination=pagination)
+    return render_template('schools.html', form=form, schools=schools,
+                           pagination=pagination, sort=sort)
 
 @main.route('/scores', methods=['GET'])
 @login_required
 def scores():
     page = request.args.get('page', 1, type=int)
-    query = Score.query
-    pagination = query.order_by(Score.created.desc()).paginate(
-        page, per_page=current_app.config['BACKEND_POSTS_PER_PAGE'],
-        error_out=False)
+    query = Score.query.options(joinedload(Score.user))
+    pagination = paginate(query.order_by(Score.created.desc()), page,
+                          current_app.config['BACKEND_POSTS_PER_PAGE'])
     scores = pagination.items
     return render_template('scores.html', scores=scores, pagination=pagination)
 
@@ -93,9 +96,9 @@ def users():
         query = User.query.filter(User.teacher_id == current_user.id)
     else:
         query = User.query
-    pagination = query.order_by(User.created.desc()).paginate(
-        page, per_page=current_app.config['BACKEND_POSTS_PER_PAGE'],
-        error_out=False)
+    query = query.options(joinedload(User.role))
+    pagination = paginate(query.order_by(User.created.desc()), page,
+                          current_app.config['BACKEND_POSTS_PER_PAGE'])
     users = pagination.items
     return render_template('users.html', form=form, users=users, pagination=pagination)
 
@@ -123,7 +126,11 @@ def add_user():
 def batch_add_users():
     form = BatchUsersForm()
     if current_user.can(Permission.CREATE_USERS) and form.validate_on_submit():
-        User.import_students_from_data(form.csv_data.data, delimiter='\t')
+        from ..jobs import enqueue, users as users_jobs
+        job = enqueue(users_jobs.import_students_from_data, form.csv_data.data, '\t',
+                      timeout=30*60, description='Import students')
+        if job is not None:
+            return redirect(url_for('.job', id=job.id))
         return redirect(url_for('.users'))
     return render_template('batch_add_users.html', form=form)
 
@@ -161,16 +168,11 @@ def delete_user(id):
         delete_students = False
     else:
         delete_students = True
-    if delete_students and user.is_teacher() and len(user.my_students().all()) > 0:
+    if delete_students and user.is_teacher() and user.my_students().first() is not None:
         return redirect(url_for('.delete_user_students', id=id))
     form = DeleteUserForm(user=user)
     if form.validate_on_submit():
-        if not delete_students:
-            for student in user.my_students():
-                student.teacher_id = None
-                db.session.add(student)
-            db.session.commit()
-        db.session.delete(user)
+        User.delete_users([user.id])
         return redirect(url_for('.users'))
     return render_template('delete_user.html', user=user, form=form)
 
@@ -179,14 +181,20 @@ def delete_user(id):
 @admin_required
 def delete_user_students(id):
     user = User.query.get_or_404(id)
-    if not user.is_teacher() or not len(user.my_students().all()) > 0:
+    if not user.is_teacher() or user.my_students().first() is None:
         return redirect(url_for('.users'))
     form = DeleteUserStudentsForm(user=user)
     if form.validate_on_submit():
         if form.delete_students.data:
-            for student in user.my_students():
-                db.session.delete(student)
-            db.session.commit()
+            student_ids = user.student_ids()
+            if len(student_ids) > current_app.config['BACKEND_BACKGROUND_DELETE_THRESHOLD']:
+                from ..jobs import enqueue, users as users_jobs
+                job = enqueue(users_jobs.delete_users, student_ids, timeout=30*60,
+                              description='Delete the students of {}'.format(user.username))
+                if job is not None:
+                    return redirect(url_for('.job', id=job.id))
+            else:
+                User.delete_users(student_ids)
         return redirect(url_for('.delete_user', id=id) + '?delete_students=false')
     return render_template('delete_user_students.html', user=user, form=form)
 
@@ -221,7 +229,8 @@ def edit_profile_admin(id):
         user.name = form.name.data
         user.add_to_schools(form.schools.data)
         if user.is_student():
-            user.teacher = User.query.get(form.teacher.data)
+            user.teacher = User.query.get(form.teacher.data) \
+                if form.teacher.data is not None else None
         db.session.add(user)
         flash('The profile has been updated.')
         return redirect(url_for('.user', username=user.username))
@@ -237,6 +246,24 @@ def edit_profile_admin(id):
     return render_template('edit_profile.html', form=form, user=user)
 
 
+@main.route('/search/teachers')
+@login_required
+@admin_required
+def search_teachers():
+    q = request.args.get('q', '', type=str)
+    teachers = User.search_teachers(q, current_app.config['BACKEND_SEARCH_RESULTS'])
+    return jsonify({'results': [{'id': t.id, 'text': t.name or t.username} for t in teachers]})
+
+
+@main.route('/search/schools')
+@login_required
+@admin_required
+def search_schools():
+    q = request.args.get('q', '', type=str)
+    schools = School.search(q, current_app.config['BACKEND_SEARCH_RESULTS'])
+    return jsonify({'results': [{'id': s.id, 'text': s.name} for s in schools]})
+
+
 @main.route('/edit-school/<int:id>', methods=['GET', 'POST'])
 @login_required
 @admin_required
@@ -263,13 +290,7 @@ def edit_school(id):
 @main.route('/user-stats')
 @login_required
 def user_stats():
-    from rq import Queue
-    from ..jobs import game_stats
-
-    s3_bucket = current_app.config['S3_BUCKET']
-    aws_region = current_app.config['AWS_REGION']
-
-    q = Queue(connection=redis_store)
+    from ..jobs import enqueue, game_stats
 
     user_role = ''
     if current_user.is_student():
@@ -279,9 +300,11 @@ def user_stats():
     if current_user.is_administrator():
         user_role = 'administrator'
 
-    result = q.enqueue(game_stats.game_stats, aws_region, s3_bucket, current_user.id, user_role, timeout=59*30)
+    key = 'jobs/{}.csv'.format(uuid.uuid4().hex)
+    enqueue(game_stats.game_stats, current_user.id, user_role, key,
+            timeout=59*30, description='Game stats')
 
-    job_url = 'https://s3.amazonaws.com/{}/jobs/{}.csv'.format(s3_bucket, result.id)
+    job_url = storage.url(key)
 
     return render_template('game_stats.html', job_url=job_url)
 
@@ -291,9 +314,8 @@ def user_stats():
 def game_data():
     page = request.args.get('page', 1, type=int)
     query = GameData.query
-    pagination = query.order_by(GameData.file_name.desc()).paginate(
-        page, per_page=current_app.config['BACKEND_POSTS_PER_PAGE'],
-        error_out=False)
+    pagination = paginate(query.order_by(GameData.file_name.desc()), page,
+                          current_app.config['BACKEND_POSTS_PER_PAGE'])
     game_data = pagination.items
     return render_template('game_data.html', game_data=game_data, pagination=pagination)
 
@@ -305,7 +327,11 @@ def edit_game_data(id):
     game_data = GameData.query.get(id)
     form = GameDataForm(game_data=game_data)
     if form.validate_on_submit():
-        game_data.content = form.file_content.data
+        from ..jobs import enqueue, game_data as game_data_jobs
+        job = enqueue(game_data_jobs.save_content, game_data.id, form.file_content.data,
+                      description='Save {}'.format(game_data.file_name))
+        if job is not None:
+            return redirect(url_for('.job', id=job.id))
         return redirect(url_for('.game_data'))
     return render_template('edit_game_data.html', form=form, game_data=game_data)
 
@@ -316,11 +342,41 @@ def edit_game_data(id):
 def assets():
     page = request.args.get('page', 1, type=int)
     query = Asset.query
-    pagination = query.order_by(Asset.file_name.asc()).paginate(
-        page, per_page=current_app.config['BACKEND_POSTS_PER_PAGE'],
-        error_out=False)
+    pagination = paginate(query.order_by(Asset.file_name.asc()), page,
+                          current_app.config['BACKEND_POSTS_PER_PAGE'])
     assets = pagination.items
-    return render_template('assets.html', assets=assets, pagination=pagination)
+    return render_template('assets.html', assets=assets, pagination=pagination,
+                           delete_form=DeleteAssetsForm(), sync_form=SyncAssetsForm())
+
+
+@main.route('/sync-assets', methods=['POST'])
+@login_required
+@admin_required
+def sync_assets():
+    form = SyncAssetsForm()
+    if form.validate_on_submit():
+        from ..jobs import enqueue, assets as assets_jobs
+        job = enqueue(assets_jobs.sync_assets, timeout=30*60,
+                      description='Sync assets with storage')
+        if job is not None:
+            return redirect(url_for('.job', id=job.id))
+    return redirect(url_for('.assets'))
+
+
+@main.route('/delete-assets', methods=['POST'])
+@login_required
+@admin_required
+def delete_assets():
+    form = DeleteAssetsForm()
+    if form.validate_on_submit():
+        from ..jobs import enqueue, assets as assets_jobs
+        job = enqueue(assets_jobs.delete_assets, form.ids.data, timeout=30*60,
+                      description='Delete {} assets'.format(len(form.ids.data)))
+        if job is not None:
+            return redirect(url_for('.job', id=job.id))
+    for error in form.ids.errors:
+        flash(error)
+    return redirect(url_for('.assets'))
 
 
 @main.route('/upload-asset', methods=['GET', 'POST'])
@@ -333,6 +389,12 @@ def upload_asset():
         asset.file_name = form.file_name.data
         asset.file_type = form.file_type.data
         db.session.add(asset)
+        db.session.commit()
+        from ..jobs import enqueue, assets as assets_jobs
+        job = enqueue(assets_jobs.process_asset, asset.id,
+                      description='Process {}'.format(asset.file_name))
+        if job is not None:
+            return redirect(url_for('.job', id=job.id))
         return redirect(url_for('.assets'))
     return render_template('upload_asset.html', form=form)
 
@@ -344,8 +406,7 @@ def delete_asset(id):
     asset = Asset.query.filter_by(id=id).first_or_404()
     form = DeleteAssetForm()
     if form.validate_on_submit():
-        s3 = boto3.client('s3', current_app.config['AWS_REGION'])
-        s3.delete_object(Bucket=current_app.config['S3_BUCKET'], Key='assets/{}'.format(asset.file_name))
+        storage.delete_many([asset.key] + [v.key for v in asset.variants])
         db.session.delete(asset)
         return redirect(url_for('.assets'))
     return render_template('delete_asset.html', form=form, asset=asset)
@@ -354,28 +415,49 @@ def delete_asset(id):
 @login_required
 @admin_required
 def sign_s3():
-    S3_BUCKET = current_app.config['S3_BUCKET']
-    AWS_REGION = current_app.config['AWS_REGION']
-
     file_name = request.args.get('file-name')
     file_type = request.args.get('file-type')
+    asset = Asset(file_name=file_name, file_type=file_type)
 
-    s3 = boto3.client('s3', AWS_REGION)
-
-    presigned_post = s3.generate_presigned_post(
-        Bucket = S3_BUCKET,
-        Key = 'assets/{}'.format(file_name),
-        Fields = {"acl": "public-read", "Content-Type": file_type},
-        Conditions = [
+    presigned_post = storage.presigned_post(
+        asset.key,
+        fields={"acl": "public-read", "Content-Type": file_type},
+        conditions=[
             {"acl": "public-read"},
             {"Content-Type": file_type}
         ],
-        ExpiresIn = 3600
+        expires_in=3600
     )
 
     return json.dumps({
         'data': presigned_post,
         'file_name': file_name,
         'file_type': file_type,
-        'url': 'https://s3.amazonaws.com/{}/assets/{}'.format(S3_BUCKET, file_name)
+        'url': asset.url
     })
+
+
+def _get_job_or_404(id):
+    from ..jobs import fetch
+    job = fetch(id)
+    if job is None:
+        abort(404)
+    if job.meta.get('user_id') != current_user.id and \
+            not current_user.is_administrator():
+        abort(403)
+    return job
+
+
+@main.route('/jobs/<id>')
+@login_required
+def job(id):
+    from ..jobs import job_to_json
+    job = job_to_json(_get_job_or_404(id))
+    return render_template('job.html', job=job)
+
+
+@main.route('/jobs/<id>/status')
+@login_required
+def job_status(id):
+    from ..jobs import job_to_json
+    return jsonify(job_to_json(_get_job_or_404(id)))
@@ -0,0 +1,304 @@
+import json
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+import redis
+from flask import Response, abort, current_app, g, has_app_context, \
+    has_request_context, request, request_finished, request_started, \
+    request_tearing_down
+from redis.exceptions import RedisError
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+REQUEST_DURATION = 'backend_http_request_duration_seconds'
+DB_QUERIES = 'backend_db_queries_total'
+DB_QUERY_SECONDS = 'backend_db_query_seconds_total'
+CALL_DURATION = 'backend_external_call_duration_seconds'
+
+HELP = {
+    REQUEST_DURATION: 'Time to handle a request, by endpoint.',
+    DB_QUERIES: 'Database queries run by requests, by endpoint.',
+    DB_QUERY_SECONDS: 'Time requests spent in database queries, by endpoint.',
+    CALL_DURATION: 'Time spent in calls to Redis and object storage.',
+}
+
+WORKERS_KEY = 'metrics:workers'
+
+
+class _Flusher(threading.Thread):
+    """Flushes a worker's numbers every ``flush_interval`` seconds, whether
+    or not it is serving requests, so its copy in Redis never expires
+    while the worker lives. Stops once the state has another flusher."""
+
+    def __init__(self, metrics, app, state):
+        super(_Flusher, self).__init__(name='metrics-flusher')
+        self.daemon = True
+        self.metrics = metrics
+        self.app = app
+        self.state = state
+        self.pid = os.getpid()
+
+    def run(self):
+        while True:
+            time.sleep(self.state.flush_interval)
+            if self.state.flusher is not self:
+                return
+            with self.app.app_context():
+                try:
+                    self.metrics.flush()
+                except Exception:
+                    self.app.logger.exception('Metrics could not be flushed')
+
+
+class _State(object):
+    def __init__(self, buckets, flush_interval, token):
+        self.buckets = buckets
+        self.flush_interval = flush_interval
+        self.token = token
+        self.worker = '{}:{}'.format(socket.gethostname(), os.getpid())
+        self.pid = os.getpid()
+        # (name, labels) -> [count per bucket..., count above them, sum]
+        self.histograms = {}
+        # (name, labels) -> value
+        self.counters = {}
+        self.flusher = None
+        self.lock = threading.Lock()
+
+
+class Metrics(object):
+    """Request, database and external call metrics in Prometheus format.
+
+    Every worker process aggregates its own numbers in memory: a request
+    costs a few dictionary updates under a lock. A thread in each worker
+    copies them to Redis every ``METRICS_FLUSH_INTERVAL`` seconds, even
+    while the worker is idle, and ``/metrics`` adds up
+    the copies of all live workers, so a scrape sees every gunicorn worker
+    whichever one answers it. When ``METRICS_TOKEN`` is set, scrapers must
+    send it as a bearer token.
+
+    Database queries are timed with SQLAlchemy engine events, Redis
+    commands by the client class of ``redis_store``, and object storage
+    calls by the storage service. Queries slower than
+    ``BACKEND_SLOW_DB_QUERY_TIME`` are logged.
+    """
+
+    def init_app(self, app):
+        if not app.config['METRICS_ENABLED']:
+            return
+        app.extensions['metrics'] = _State(app.config['METRICS_BUCKETS'],
+                                           app.config['METRICS_FLUSH_INTERVAL'],
+                                           app.config['METRICS_TOKEN'])
+        request_started.connect(self._request_started, app, weak=False)
+        request_finished.connect(self._request_finished, app, weak=False)
+        request_tearing_down.connect(self._request_tearing_down, app, weak=False)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+
+    @property
+    def _state(self):
+        if not has_app_context():
+            return None
+        return current_app.extensions.get('metrics')
+
+    @staticmethod
+    def _observe(state, name, labels, value):
+        with state.lock:
+            histogram = state.histograms.get((name, labels))
+            if histogram is None:
+                histogram = state.histograms[(name, labels)] = \
+                    [0] * (len(state.buckets) + 2)
+            histogram[bisect_left(state.buckets, value)] += 1
+            histogram[-1] += value
+
+    @staticmethod
+    def _inc(state, name, labels, value):
+        with state.lock:
+            state.counters[(name, labels)] = state.counters.get((name, labels), 0) + value
+
+    @contextmanager
+    def timer(self, service, operation):
+        """Time the call made inside the block as one to service."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            state = self._state
+            if state is not None:
+                self._observe(state, CALL_DURATION,
+                              (('service', service), ('operation', operation)),
+                              time.perf_counter() - start)
+
+    def _request_started(self, app, **extra):
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_query_time = 0.0
+        g.metrics_status = 500
+
+    def _request_finished(self, app, response, **extra):
+        g.metrics_status = response.status_code
+
+    def _request_tearing_down(self, app, **extra):
+        state = self._state
+        start = getattr(g, 'metrics_start', None)
+        if state is None or start is None:
+            return
+        endpoint = request.endpoint or 'none'
+        self._observe(state, REQUEST_DURATION,
+                      (('endpoint', endpoint), ('method', request.method),
+                       ('status', str(g.metrics_status))),
+                      time.perf_counter() - start)
+        self._inc(state, DB_QUERIES, (('endpoint', endpoint),), g.metrics_queries)
+        self._inc(state, DB_QUERY_SECONDS, (('endpoint', endpoint),),
+                  g.metrics_query_time)
+        if state.flush_interval:
+            self._start_flusher(state, app)
+
+    def _start_flusher(self, state, app):
+        # Started by the first request, and again after a fork, since
+        # threads don't survive into gunicorn's worker processes.
+        if state.flusher is None or state.flusher.pid != os.getpid():
+            with state.lock:
+                if state.flusher is None or state.flusher.pid != os.getpid():
+                    state.flusher = _Flusher(self, app, state)
+                    state.flusher.start()
+
+    @staticmethod
+    def _snapshot(state):
+        with state.lock:
+            return {
+                'histograms': [[name, labels, values]
+                               for (name, labels), values in state.histograms.items()],
+                'counters': [[name, labels, value]
+                             for (name, labels), value in state.counters.items()],
+            }
+
+    def flush(self):
+        """Copy this worker's numbers to Redis for /metrics to add up."""
+        from . import redis_store
+        state = self._state
+        if state.pid != os.getpid():
+            # A forked worker starts from nothing rather than repeating
+            # what its parent counted.
+            with state.lock:
+                state.histograms.clear()
+                state.counters.clear()
+                state.worker = '{}:{}'.format(socket.gethostname(), os.getpid())
+                state.pid = os.getpid()
+        try:
+            pipe = redis_store.pipeline()
+            pipe.setex('metrics:worker:' + state.worker, state.flush_interval * 4,
+                       json.dumps(self._snapshot(state)))
+            pipe.sadd(WORKERS_KEY, state.worker)
+            pipe.execute()
+        except RedisError:
+            current_app.logger.exception('Metrics could not be shared')
+
+    def _other_workers(self, state):
+        from . import redis_store
+        if not state.flush_interval:
+            return []
+        try:
+            workers = [w.decode() for w in redis_store.smembers(WORKERS_KEY)
+                       if w.decode() != state.worker]
+            if not workers:
+                return []
+            snapshots = redis_store.mget(['metrics:worker:' + w for w in workers])
+            gone = [w for w, s in zip(workers, snapshots) if s is None]
+            if gone:
+                redis_store.srem(WORKERS_KEY, *gone)
+            return [json.loads(s.decode()) for s in snapshots if s is not None]
+        except RedisError:
+            current_app.logger.exception('Metrics of other workers unavailable')
+            return []
+
+    def render(self):
+        """Return the metrics of all workers in Prometheus text format."""
+        state = self._state
+        histograms = {}
+        counters = {}
+        for snapshot in [self._snapshot(state)] + self._other_workers(state):
+            for name, labels, values in snapshot['histograms']:
+                key = (name, tuple(tuple(label) for label in labels))
+                total = histograms.setdefault(key, [0] * len(values))
+                for i, value in enumerate(values):
+                    total[i] += value
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(tuple(label) for label in labels))
+                counters[key] = counters.get(key, 0) + value
+
+        lines = []
+        for name in sorted(set(n for n, _ in histograms)):
+            lines += ['# HELP {} {}'.format(name, HELP[name]),
+                      '# TYPE {} histogram'.format(name)]
+            for (n, labels), values in sorted(histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(state.buckets) + ['+Inf'], values[:-1]):
+                    cumulative += count
+                    lines.append('{}_bucket{} {}'.format(
+                        name, _labels(labels + (('le', str(bound)),)), cumulative))
+                lines.append('{}_sum{} {}'.format(name, _labels(labels), values[-1]))
+                lines.append('{}_count{} {}'.format(name, _labels(labels), cumulative))
+        for name in sorted(set(n for n, _ in counters)):
+            lines += ['# HELP {} {}'.format(name, HELP[name]),
+                      '# TYPE {} counter'.format(name)]
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append('{}{} {}'.format(name, _labels(labels), value))
+        return '\n'.join(lines) + '\n'
+
+    def view(self):
+        token = self._state.token
+        if token and request.headers.get('Authorization') != 'Bearer ' + token:
+            abort(403)
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+
+def _labels(labels):
+    return '{' + ','.join('{}="{}"'.format(k, v.replace('\\', '\\\\').replace('"', '\\"'))
+                          for k, v in labels) + '}'
+
+
+metrics = Metrics()
+
+
+class TimedRedis(redis.StrictRedis):
+    """Redis client that reports how long each command takes."""
+
+    def execute_command(self, *args, **options):
+        with metrics.timer('redis', str(args[0]).upper()):
+            return super(TimedRedis, self).execute_command(*args, **options)
+
+    def pipeline(self, *args, **kwargs):
+        pipe = super(TimedRedis, self).pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        def timed_execute(*args, **kwargs):
+            with metrics.timer('redis', 'PIPELINE'):
+                return execute(*args, **kwargs)
+        pipe.execute = timed_execute
+        return pipe
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info['metrics_query_start'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info.pop('metrics_query_start')
+    if not has_app_context():
+        return
+    if duration >= current_app.config['BACKEND_SLOW_DB_QUERY_TIME']:
+        current_app.logger.warning(
+            'Slow query: %s\nParameters: %s\nDuration: %fs\nEndpoint: %s\n'
+            % (statement, parameters, duration,
+               request.endpoint if has_request_context() else None))
+    if has_request_context() and hasattr(g, 'metrics_queries'):
+        g.metrics_queries += 1
+        g.metrics_query_time += duration
@@ -1,24 +1,48 @@
 import hashlib
+from collections import OrderedDict
 from datetime import datetime
 
-import boto3
-from flask import current_app, request, url_for
+from flask import current_app, request, url_for, g, has_app_context
 from flask_login import UserMixin, AnonymousUserMixin
-from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from sqlalchemy import Index
+from sqlalchemy import event
+from sqlalchemy import select
 from sqlalchemy import func
 from sqlalchemy import inspect
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.util import identity_key
 import json
 import string
 import random
+import uuid
 from werkzeug.security import generate_password_hash, check_password_hash
 from .email import send_email
+from .passwords import hash_passwords
+from .storage import storage, IMMUTABLE_CACHE_CONTROL
+from .tokens import token_signers
 
 from app.exceptions import ValidationError
 from . import db, login_manager
 
 
+def contains_pattern(q):
+    """LIKE pattern matching q anywhere, with q's wildcards escaped."""
+    q = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return '%{}%'.format(q)
+
+
+def insert_ignoring_duplicates(table):
+    """INSERT into table that skips rows conflicting with existing ones,
+    where the database supports it."""
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        return pg_insert(table).on_conflict_do_nothing()
+    if dialect == 'sqlite':
+        return table.insert().prefix_with('OR IGNORE')
+    return table.insert()
+
+
 class Permission:
     EXIST = 0x01
     CREATE_USERS = 0x02
@@ -32,7 +56,7 @@ class Role(db.Model):
     name = db.Column(db.String(64), unique=True)
     default = db.Column(db.Boolean, default=False, index=True)
     permissions = db.Column(db.Integer)
-    users = db.relationship('User', backref='role', lazy='dynamic')
+    users = db.relationship('User', back_populates='role', lazy='dynamic')
 
     @staticmethod
     def insert_roles():
@@ -78,6 +102,13 @@ class UserSchool(db.Model):
     def __repr__(self):
         return '<UserSchool {%r} {%r}>' % (self.user.name, self.school.name)
 
+# Device usernames are three letters followed by three digits. The multiplier
+# is coprime with the size of that space, so the id -> username mapping is
+# a permutation.
+USERNAME_SPACE = 26 ** 3 * 10 ** 3
+USERNAME_MULTIPLIER = 1000003
+
+
 class IosDeviceInfo(db.Model):
     __tablename__ = "ios_device_info"
     id = db.Column(db.String(64), primary_key=True)
@@ -92,41 +123,42 @@ class IosDeviceInfo(db.Model):
         pass
 
     def get_user(self):
-        return User.query.get(self.user_id)
+        return User.get_cached(self.user_id)
 
     @staticmethod
     def create_or_retrieve(data):
-        ios_device_info = IosDeviceInfo.query.get(data['duid'])
-
-        user = None
-
-        if not ios_device_info:
-            user_id, password = IosDeviceInfo.create_user_for_duid()
-
-            ios_device_info = IosDeviceInfo(
-                id=data['duid'],
-                user_id=user_id,
-                app_store_validated=False,
-                payload=json.dumps(
-                    {
-                        'deviceModel': data['deviceModel'],
-                        'deviceType': data['deviceType'],
-                        'deviceName': data['deviceName'],
-                        'platform': data['platform'],
-                        'operatingSystem': data['operatingSystem'],
-                        'systemMemorySize': data['systemMemorySize'],
-                        'graphics': data['graphics']
-                    }
-                )
-            )
-
-            db.session.add(ios_device_info)
+        password = IosDeviceInfo.generate_password()
+        user = IosDeviceInfo.user_for_duid(data['duid'])
 
+        if user is not None:
+            user.password = password
+            db.session.add(user)
             db.session.commit()
+            return (user, password)
+
+        user = IosDeviceInfo.create_user_for_duid(password)
+
+        ios_device_info = IosDeviceInfo(
+            id=data['duid'],
+            user_id=user.id,
+            app_store_validated=False,
+            payload=json.dumps(
+                {
+                    'deviceModel': data['deviceModel'],
+                    'deviceType': data['deviceType'],
+                    'deviceName': data['deviceName'],
+                    'platform': data['platform'],
+                    'operatingSystem': data['operatingSystem'],
+                    'systemMemorySize': data['systemMemorySize'],
+                    'graphics': data['graphics']
+                }
+            )
+        )
+        db.session.add(ios_device_info)
+        db.session.commit()
 
-            user = ios_device_info.get_user()
-
-            for receiver in current_app.config['MAIL_RECEIVERS']:
+        for receiver in current_app.config['MAIL_RECEIVERS']:
+            if receiver:
                 send_email(
                     receiver,
                     'New iOS user created',
@@ -134,39 +166,50 @@ class IosDeviceInfo(db.Model):
                     username=user.username
                 )
 
-        else:
-            password = \
-                ''.join(random.SystemRandom().choice(string.ascii_lowercase + string.digits) for _ in range(8))
-
-            user = ios_device_info.get_user()
-            user.password = password
-            db.session.add(user)
-            db.session.commit()
-
         return (user, password)
 
+    @staticmethod
+    def user_for_duid(duid):
+        """Return the user provisioned for a device, or None."""
+        return User.query.join(IosDeviceInfo, IosDeviceInfo.user_id == User.id) \
+            .filter(IosDeviceInfo.id == duid).first()
 
     @staticmethod
-    def create_user_for_duid():
-        username = \
-            ''.join(random.SystemRandom().choice(string.ascii_lowercase) for _ in range(3)) + \
-            ''.join(random.SystemRandom().choice(string.digits) for _ in range(3))
+    def generate_password():
+        return ''.join(random.SystemRandom().choice(string.ascii_lowercase + string.digits) for _ in range(8))
 
-        password = \
-            ''.join(random.SystemRandom().choice(string.ascii_lowercase + string.digits) for _ in range(8))
+    @staticmethod
+    def username_for_sequence(n):
+        """Map n onto the ``abc123`` username space. The mapping is a
+        bijection, so distinct user ids never produce the same username."""
+        x = (n * USERNAME_MULTIPLIER) % USERNAME_SPACE
+        letters, digits = divmod(x, 1000)
+        chars = []
+        for _ in range(3):
+            letters, i = divmod(letters, 26)
+            chars.append(string.ascii_lowercase[i])
+        return ''.join(chars) + '{:03d}'.format(digits)
 
-        user = User(email='',
-                    username=username,
-                    password=password,
+    @staticmethod
+    def create_user_for_duid(password):
+        """Add a student for a new device to the session, without committing.
+        The username is derived from the user id, only falling back to a
+        random one if it was already taken by an older account."""
+        user = User(password=password,
                     confirmed=True,
-                    name=username,
-                    role=Role.get('student'))
+                    role=Role.get('Student'))
         db.session.add(user)
-        db.session.commit()
-
-        return (user.id, password)
+        db.session.flush()
 
+        username = IosDeviceInfo.username_for_sequence(user.id)
+        while User.query.filter_by(username=username).first() is not None:
+            username = \
+                ''.join(random.SystemRandom().choice(string.ascii_lowercase) for _ in range(3)) + \
+                ''.join(random.SystemRandom().choice(string.digits) for _ in range(3))
+        user.username = username
+        user.name = username
 
+        return user
 
 
 class User(UserMixin, db.Model):
@@ -187,65 +230,82 @@ class User(UserMixin, db.Model):
     created = db.Column(db.DateTime, default=func.now())
     updated = db.Column(db.DateTime, default=func.now(), onupdate=func.now())
 
+    Index('ix_users_name_trgm', name, postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    Index('ix_users_username_trgm', username, postgresql_using='gin', postgresql_ops={'username': 'gin_trgm_ops'})
+
+    role = db.relationship('Role', back_populates='users')
     schools = db.relationship('School', secondary="users_schools", viewonly=True)
 
     scores = db.relationship('Score', backref='user', lazy='dynamic', order_by="Score.created")
     lessons = db.relationship('Lesson', backref='user', lazy='dynamic', order_by="Lesson.created")
     login_info = db.relationship('LoginInfo', backref='user', lazy='dynamic', order_by="LoginInfo.created", cascade='save-update')
-    teacher = db.relationship('User', backref='user', lazy='dynamic', cascade='all')
+    teacher = db.relationship('User', remote_side=[id], backref=db.backref('assigned_students', lazy='dynamic'))
     schools = db.relationship('School', backref='user', secondary='users_schools', lazy='dynamic', cascade='all')
     screens = db.relationship('Screen', backref='user', lazy='dynamic', order_by="Screen.created", cascade='save-update')
 
     @staticmethod
-    def import_students():
+    def import_students(progress=None):
         import requests
+        from .importer import import_students
         with requests.Session() as s:
-            download = s.get('https://s3.amazonaws.com/gamegen/import/students.csv')
-            csvfile = download.content.decode('utf-8')
-            User.import_students_from_data(csvfile, ',')
-
-            
-    @staticmethod
-    def import_students_from_data(csv_data, delimiter=','):
-        import csv
-        from sqlalchemy.exc import IntegrityError
-        csvreader = csv.reader(csv_data.splitlines(), delimiter=delimiter)
-        for username, password, teacher in csvreader:
-            teacher = User.query.filter_by(username=teacher).first()
-            u = User(username=username,
-                     password=password,
-                     confirmed=True,
-                     name=username,
-                     role=Role.get('Student'),
-                     teacher=teacher)
-            db.session.add(u)
+            download = s.get('https://s3.amazonaws.com/gamegen/import/students.csv', stream=True)
+            download.encoding = 'utf-8'
+            return import_students(download.iter_lines(decode_unicode=True), ',',
+                                   progress=progress)
+
+    @staticmethod
+    def import_students_from_data(csv_data, delimiter=',', progress=None):
+        import io
+        from .importer import import_students
+        return import_students(io.StringIO(csv_data), delimiter, progress=progress)
+
+    @staticmethod
+    def insert_in_batches(users, batch_size=500):
+        """Insert user row dicts, committing every batch_size rows. A batch
+        that violates a unique constraint is retried row by row, skipping
+        the duplicates. Returns the number of users inserted."""
+        inserted = 0
+        for i in range(0, len(users), batch_size):
+            batch = users[i:i + batch_size]
             try:
+                db.session.bulk_insert_mappings(User, batch)
                 db.session.commit()
+                inserted += len(batch)
             except IntegrityError:
                 db.session.rollback()
-
+                for row in batch:
+                    try:
+                        db.session.bulk_insert_mappings(User, [row])
+                        db.session.commit()
+                        inserted += 1
+                    except IntegrityError:
+                        db.session.rollback()
+        return inserted
 
     @staticmethod
     def generate_fake(count=100):
-        from sqlalchemy.exc import IntegrityError
         from random import seed
         import forgery_py
 
         seed()
+        users = []
         for role in [Role.get('Student'), Role.get('Teacher')]:
             for i in range(count):
-                u = User(email=forgery_py.internet.email_address(),
-                         username=forgery_py.internet.user_name(True),
-                         password=forgery_py.lorem_ipsum.word(),
-                         confirmed=True,
-                         name=forgery_py.name.full_name(),
-                         created=forgery_py.date.date(True),
-                         role=role)
-                db.session.add(u)
-                try:
-                    db.session.commit()
-                except IntegrityError:
-                    db.session.rollback()
+                email = forgery_py.internet.email_address()
+                users.append({
+                    'email': email,
+                    'username': forgery_py.internet.user_name(True),
+                    'password': forgery_py.lorem_ipsum.word(),
+                    'confirmed': True,
+                    'name': forgery_py.name.full_name(),
+                    'created': forgery_py.date.date(True),
+                    'role_id': role.id,
+                    'avatar_hash': hashlib.md5(email.encode('utf-8')).hexdigest(),
+                })
+        password_hashes = hash_passwords(u.pop('password') for u in users)
+        for u, password_hash in zip(users, password_hashes):
+            u['password_hash'] = password_hash
+        return User.insert_in_batches(users)
 
     def __init__(self, **kwargs):
         super(User, self).__init__(**kwargs)
@@ -261,16 +321,6 @@ class User(UserMixin, db.Model):
 
         self.schools = []
 
-    @property
-    def teacher(self):
-        if not self.teacher_id:
-            return None
-        return User.query.get(self.teacher_id)
-
-    @teacher.setter
-    def teacher(self, teacher):
-        self.teacher_id = teacher.id
-
     @property
     def password(self):
         raise AttributeError('password is not a readable attribute')
@@ -290,48 +340,35 @@ class User(UserMixin, db.Model):
         db.session.add(login_info)
 
     def generate_confirmation_token(self, expiration=3600):
-        s = Serializer(current_app.config['SECRET_KEY'], expiration)
-        return s.dumps({'confirm': self.id})
+        return token_signers.dumps('confirm', {'confirm': self.id}, expiration)
 
     def confirm(self, token):
-        s = Serializer(current_app.config['SECRET_KEY'])
-        try:
-            data = s.loads(token)
-        except:
-            return False
-        if data.get('confirm') != self.id:
+        data = token_signers.loads('confirm', token)
+        if data is None or data.get('confirm') != self.id:
             return False
         self.confirmed = True
         db.session.add(self)
         return True
 
     def generate_reset_token(self, expiration=3600):
-        s = Serializer(current_app.config['SECRET_KEY'], expiration)
-        return s.dumps({'reset': self.id})
+        return token_signers.dumps('reset', {'reset': self.id}, expiration)
 
     def reset_password(self, token, new_password):
-        s = Serializer(current_app.config['SECRET_KEY'])
-        try:
-            data = s.loads(token)
-        except:
-            return False
-        if data.get('reset') != self.id:
+        data = token_signers.loads('reset', token)
+        if data is None or data.get('reset') != self.id:
             return False
         self.password = new_password
         db.session.add(self)
         return True
 
     def generate_email_change_token(self, new_email, expiration=3600):
-        s = Serializer(current_app.config['SECRET_KEY'], expiration)
-        return s.dumps({'change_email': self.id, 'new_email': new_email})
+        return token_signers.dumps(
+            'change_email', {'change_email': self.id, 'new_email': new_email},
+            expiration)
 
     def change_email(self, token):
-        s = Serializer(current_app.config['SECRET_KEY'])
-        try:
-            data = s.loads(token)
-        except:
-            return False
-        if data.get('change_email') != self.id:
+        data = token_signers.loads('change_email', token)
+        if data is None or data.get('change_email') != self.id:
             return False
         new_email = data.get('new_email')
         if new_email is None:
@@ -375,15 +412,20 @@ class User(UserMixin, db.Model):
             url=url, hash=hash, size=size, default=default, rating=rating)
 
     def add_to_schools(self, schools):
+        old_ids = set(us.school_id for us in self.users_schools)
         self.users_schools = []
         for s in schools:
             school = School.query.get(s)
             self.users_schools.append(UserSchool(user=self, school=school))
+        new_ids = set(us.school.id for us in self.users_schools)
+        School.count_members(old_ids - new_ids, self.role, -1)
+        School.count_members(new_ids - old_ids, self.role, 1)
 
     def remove_from_school(self, school):
-        f = self.schools.filter_by(school_id=school.id).first()
+        f = UserSchool.query.get((self.id, school.id))
         if f:
             db.session.delete(f)
+            School.count_members([school.id], self.role, -1)
 
     def member_of_school(self, school):
         return self.schools.filter_by(
@@ -410,24 +452,49 @@ class User(UserMixin, db.Model):
             setattr(self, k, v)
 
     def generate_auth_token(self, expiration):
-        s = Serializer(current_app.config['SECRET_KEY'],
-                       expires_in=expiration)
-        return s.dumps({'id': self.id}).decode('ascii')
+        return token_signers.dumps('auth', {'id': self.id},
+                                   expiration).decode('ascii')
 
     @staticmethod
     def verify_auth_token(token):
-        s = Serializer(current_app.config['SECRET_KEY'])
-        try:
-            data = s.loads(token)
-        except:
+        data = token_signers.loads('auth', token)
+        if data is None:
             return None
-        return User.query.get(data['id'])
+        return User.get_cached(data.get('id'))
+
+    @staticmethod
+    def get_cached(user_id):
+        """Return the user with the given id, memoized for the current
+        request so repeated lookups (login loader, token auth, device
+        info) only hit the database once."""
+        if user_id is None:
+            return None
+        user_id = int(user_id)
+        if not has_app_context():
+            return User.query.get(user_id)
+        users = g.setdefault('_cached_users', {})
+        user = users.get(user_id)
+        if user is None or user not in db.session:
+            user = User.query.get(user_id)
+            users[user_id] = user
+        return user
 
     @staticmethod
     def teachers():
         role = Role.get('Teacher')
         return User.query.filter(User.role_id == role.id)
 
+    @staticmethod
+    def search_teachers(q, limit=20):
+        """Teachers whose name or username contains q, for typeahead
+        pickers. Backed by trigram indexes on Postgres."""
+        pattern = contains_pattern(q)
+        return User.teachers() \
+            .filter(db.or_(User.name.ilike(pattern, escape='\\'),
+                           User.username.ilike(pattern, escape='\\'))) \
+            .order_by(User.name) \
+            .limit(limit)
+
     @staticmethod
     def students():
         role = Role.get('Student')
@@ -437,20 +504,78 @@ class User(UserMixin, db.Model):
         role = Role.get('Student')
         return User.query.filter(User.teacher_id == self.id)
 
+    def student_ids(self):
+        return [id for id, in db.session.query(User.id).filter(User.teacher_id == self.id)]
+
+    def detach_students(self):
+        User.query.filter(User.teacher_id == self.id) \
+            .update({'teacher_id': None}, synchronize_session=False)
+
+    @staticmethod
+    def delete_users(user_ids):
+        """Delete the given users with one statement per dependent table,
+        in a single transaction. Their scores, lessons, screens, logins,
+        school memberships and devices are deleted, and their own students
+        and the game data uploads they started are detached."""
+        if not user_ids:
+            return
+        from .fragment_cache import fragment_cache
+        memberships = db.session.query(UserSchool.school_id, User.role_id,
+                                       func.count()) \
+            .join(User, User.id == UserSchool.user_id) \
+            .filter(UserSchool.user_id.in_(user_ids)) \
+            .group_by(UserSchool.school_id, User.role_id).all()
+        for school_id, role_id, count in memberships:
+            School.count_members([school_id], Role.query.get(role_id), -count)
+        school_ids = set(school_id for school_id, _, _ in memberships)
+        for model in (Score, Lesson, Screen, LoginInfo, UserSchool, IosDeviceInfo):
+            model.query.filter(model.user_id.in_(user_ids)) \
+                .delete(synchronize_session=False)
+        User.query.filter(User.teacher_id.in_(user_ids)) \
+            .update({'teacher_id': None}, synchronize_session=False)
+        GameDataUpload.query.filter(GameDataUpload.user_id.in_(user_ids)) \
+            .update({'user_id': None}, synchronize_session=False)
+        User.query.filter(User.id.in_(user_ids)) \
+            .delete(synchronize_session=False)
+        db.session.commit()
+        fragment_cache.bump(*(['schools:{}'.format(id) for id in school_ids] +
+                              ['users:{}'.format(id) for id in user_ids] +
+                              (['schools'] if school_ids else [])))
+
     def have_scores(self):
-        return Score.query.join(User, self.id == Score.user_id).count() > 0
+        return db.session.query(
+            Score.query.filter(Score.user_id == self.id).exists()).scalar()
 
     @property
     def max_score_by_game(self):
         return db.session.query(Score.game, func.max(Score.score).label('score')) \
-            .select_from(Score) \
-            .join(User, self.id == Score.user_id) \
-            .group_by(Score.game)
+            .filter(Score.user_id == self.id) \
+            .group_by(Score.game) \
+            .order_by(Score.game)
+
+    def max_score(self, game):
+        return Score.max_score_by_user_and_game(self.id, game)
 
     def __repr__(self):
         return '<User %r>' % self.username
 
 
+@event.listens_for(User.role, 'set')
+def _move_member_counts(user, role, old_role, initiator):
+    """Move a user's school memberships to the counter of their new role."""
+    if user.id is None:
+        return
+    with db.session.no_autoflush:
+        if not isinstance(old_role, Role):
+            old_role = Role.query.get(user.role_id) if user.role_id else None
+        if old_role is role:
+            return
+        school_ids = [id for id, in db.session.query(UserSchool.school_id)
+                      .filter(UserSchool.user_id == user.id)]
+    School.count_members(school_ids, old_role, -1)
+    School.count_members(school_ids, role, 1)
+
+
 class AnonymousUser(AnonymousUserMixin):
     def can(self, permissions):
         return False
@@ -464,7 +589,7 @@ login_manager.anonymous_user = AnonymousUser
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return User.get_cached(user_id)
 
 
 class School(db.Model):
@@ -477,9 +602,75 @@ class School(db.Model):
     description = db.Column(db.Text())
     created = db.Column(db.DateTime, default=func.now())
     updated = db.Column(db.DateTime, default=func.now(), onupdate=func.now())
+    teacher_count = db.Column(db.Integer, default=0, server_default='0', nullable=False, index=True)
+    student_count = db.Column(db.Integer, default=0, server_default='0', nullable=False, index=True)
+
+    Index('ix_schools_name_trgm', name, postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
 
     users = db.relationship('User', secondary='users_schools', viewonly=True)
 
+    # Role name -> column counting the school's members with that role.
+    MEMBER_COUNTERS = {'Teacher': 'teacher_count', 'Student': 'student_count'}
+
+    @staticmethod
+    def count_members(school_ids, role, delta):
+        """Add delta to the given schools' counter for role, in the current
+        transaction. Roles without a counter are ignored."""
+        name = School.MEMBER_COUNTERS.get(role.name if role else None)
+        school_ids = [id for id in school_ids if id is not None]
+        if name is None or not school_ids:
+            return
+        column = School.__table__.c[name]
+        db.session.execute(School.__table__.update()
+                           .where(School.id.in_(school_ids))
+                           .values({name: column + delta}))
+        for id in school_ids:
+            school = db.session.identity_map.get(identity_key(School, id))
+            if school is not None:
+                db.session.expire(school, [name])
+
+    def count_member(self, role, delta):
+        if self.id is not None:
+            School.count_members([self.id], role, delta)
+            return
+        name = School.MEMBER_COUNTERS.get(role.name if role else None)
+        if name is not None:
+            setattr(self, name, (getattr(self, name) or 0) + delta)
+
+    @staticmethod
+    def reconcile_member_counts():
+        """Recompute every school's member counters from the memberships
+        and return how many schools were off."""
+        from .fragment_cache import fragment_cache
+        table = School.__table__
+        actual = {}
+        for role_name, name in School.MEMBER_COUNTERS.items():
+            actual[name] = select([func.count()]) \
+                .select_from(UserSchool.__table__.join(
+                    User.__table__, User.id == UserSchool.user_id)) \
+                .where(UserSchool.school_id == table.c.id) \
+                .where(User.role_id == Role.get(role_name).id) \
+                .as_scalar()
+        school_ids = [id for id, in db.session.execute(
+            select([table.c.id])
+            .where(db.or_(*[table.c[name] != count for name, count in actual.items()])))]
+        if school_ids:
+            db.session.execute(table.update()
+                               .where(table.c.id.in_(school_ids))
+                               .values(actual))
+        db.session.commit()
+        fragment_cache.bump(*(['schools:{}'.format(id) for id in school_ids] +
+                              (['schools'] if school_ids else [])))
+        return len(school_ids)
+
+    @staticmethod
+    def search(q, limit=20):
+        """Schools whose name contains q, for typeahead pickers."""
+        return School.query \
+            .filter(School.name.ilike(contains_pattern(q), escape='\\')) \
+            .order_by(School.name) \
+            .limit(limit)
+
     @staticmethod
     def generate_fake(count=10):
         from random import seed, randint, sample
@@ -510,17 +701,66 @@ class School(db.Model):
         if not user.is_teacher():
             raise ValidationError('User is not a teacher')
         self.users_schools.append(UserSchool(user=user, school=self))
+        self.count_member(user.role, 1)
 
     def add_student(self, user):
         if not user.is_student():
             raise ValidationError('User is not a student')
         self.users_schools.append(UserSchool(user=user, school=self))
+        self.count_member(user.role, 1)
+
+    def add_members(self, role_name, user_ids=(), usernames=(), batch_size=500):
+        """Add the users with the given ids or usernames, who must have the
+        given role, to the school in bulk.
+
+        Each batch looks its users up, roles included, with one query, and
+        inserts their memberships with one multi-row INSERT that skips
+        existing ones. Returns the ids of the users added, the ids of those
+        already members, and the ids and usernames rejected because they
+        don't name a user with the role.
+        """
+        from .fragment_cache import fragment_cache
+        role = Role.get(role_name)
+        added, existing, rejected = [], [], []
+        seen = set()
+        for column, values in ((User.id, list(user_ids)),
+                               (User.username, list(usernames))):
+            for i in range(0, len(values), batch_size):
+                batch = values[i:i + batch_size]
+                found = dict((key, id) for key, id, role_id in
+                             db.session.query(column, User.id, User.role_id)
+                             .filter(column.in_(batch))
+                             if role_id == role.id)
+                rejected.extend(v for v in batch if v not in found)
+                ids = [id for id in set(found.values()) if id not in seen]
+                seen.update(ids)
+                if not ids:
+                    continue
+                members = set(id for id, in db.session.query(UserSchool.user_id)
+                              .filter(UserSchool.school_id == self.id)
+                              .filter(UserSchool.user_id.in_(ids)))
+                existing.extend(id for id in ids if id in members)
+                new_ids = [id for id in ids if id not in members]
+                if not new_ids:
+                    continue
+                result = db.session.execute(
+                    insert_ignoring_duplicates(UserSchool.__table__).values(
+                        [{'user_id': id, 'school_id': self.id} for id in new_ids]))
+                self.count_member(role, result.rowcount)
+                added.extend(new_ids)
+        db.session.commit()
+        if added:
+            fragment_cache.bump(*(['schools:{}'.format(self.id), 'schools'] +
+                                  ['users:{}'.format(id) for id in added]))
+        return added, existing, rejected
 
     def to_json(self):
         json_school = {
             'id': self.id,
             'name': self.name,
             'description': self.description,
+            'teacher_count': self.teacher_count,
+            'student_count': self.student_count,
             'created': self.created,
             'updated': self.updated,
         }
@@ -546,11 +786,8 @@ class Score(db.Model):
     duration = db.Column(db.Integer)
     created = db.Column(db.DateTime, default=func.now())
 
-    Index('idx_user_game', user_id, game)
-
-    @property
-    def user(self):
-        return User.query.get(self.user_id)
+    # Covers the per-user, per-game aggregates without touching the table.
+    Index('idx_user_game_score', user_id, game, score)
 
     @staticmethod
     def from_json(json_score):
@@ -583,8 +820,7 @@ class Score(db.Model):
 
     @staticmethod
     def scores_by_user_and_game(user_id, game_id):
-        return Score.query.join(User, User.id == Score.user_id) \
-            .filter(User.id == user_id) \
+        return Score.query.filter(Score.user_id == user_id) \
             .filter(Score.game == game_id)
 
     @staticmethod
@@ -666,24 +902,190 @@ class Asset(db.Model):
     file_name = db.Column(db.String(128), index=True)
     file_type = db.Column(db.String(64))
     created = db.Column(db.DateTime, default=func.now())
+    size = db.Column(db.Integer)
+    content_hash = db.Column(db.String(64))
+
+    variants = db.relationship('AssetVariant', backref='asset',
+                               cascade='all, delete-orphan')
+
+    PREFIX = 'assets/'
+
+    @property
+    def key(self):
+        return Asset.PREFIX + self.file_name
 
     @property
     def url(self):
-        S3_BUCKET = current_app.config['S3_BUCKET']
-        AWS_REGION = current_app.config['AWS_REGION']
-        return 'https://s3.amazonaws.com/{}/assets/{}'.format(S3_BUCKET, self.file_name)
+        return storage.url(self.key)
+
+    def best_variant(self, accept_mimetypes, accept_encodings, thumbnail=False):
+        """Return the smallest variant the client can use, or None when
+        the original is the best choice.
+
+        A variant with another content type than the original is used only
+        if the client's Accept header names that type; an encoded one only
+        if Accept-Encoding allows the encoding.
+        """
+        accepted = set(mimetype for mimetype, quality in accept_mimetypes if quality)
+        usable = [v for v in self.variants
+                  if (v.kind == 'thumbnail') == thumbnail and
+                  (v.content_type == self.file_type or v.content_type in accepted) and
+                  (v.encoding is None or accept_encodings[v.encoding])]
+        if not usable:
+            return None
+        best = min(usable, key=lambda v: v.size)
+        if not thumbnail and self.size is not None and best.size >= self.size:
+            return None
+        return best
+
+    def to_json(self, accept_mimetypes, accept_encodings):
+        best = self.best_variant(accept_mimetypes, accept_encodings)
+        thumbnail = self.best_variant(accept_mimetypes, accept_encodings, thumbnail=True)
+        json_asset = {
+            'id': self.id,
+            'file_name': self.file_name,
+            'file_type': self.file_type,
+            'size': self.size,
+            'hash': self.content_hash,
+            'url': best.url if best else self.url,
+            'thumbnail_url': thumbnail.url if thumbnail else None,
+            'variants': [v.to_json() for v in self.variants],
+        }
+        return json_asset
+
+
+class AssetVariant(db.Model):
+    """A compressed or resized copy of an asset, made by the asset
+    pipeline job."""
+    __tablename__ = 'asset_variants'
+    id = db.Column(db.Integer, primary_key=True)
+    asset_id = db.Column(db.Integer, db.ForeignKey('assets.id'), index=True)
+    kind = db.Column(db.String(32))
+    content_type = db.Column(db.String(64))
+    encoding = db.Column(db.String(16))
+    size = db.Column(db.Integer)
+    content_hash = db.Column(db.String(64))
+    key = db.Column(db.String(255))
+
+    PREFIX = 'asset_variants/'
+
+    @property
+    def url(self):
+        return storage.url(self.key)
+
+    def to_json(self):
+        json_variant = {
+            'kind': self.kind,
+            'content_type': self.content_type,
+            'encoding': self.encoding,
+            'size': self.size,
+            'hash': self.content_hash,
+            'url': self.url,
+        }
+        return json_variant
+
 
 class GameData(db.Model):
     __tablename__ = 'game_data'
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     file_name = db.Column(db.String(128), index=True)
     created = db.Column(db.DateTime, default=func.now())
+    content_hash = db.Column(db.String(64))
+    size = db.Column(db.Integer)
+    encodings = db.Column(db.String(32))
+
+    # Encoding -> suffix of the pre-compressed copies written next to each
+    # version.
+    VARIANTS = OrderedDict([('br', '.br'), ('gzip', '.gz')])
+
+    BUNDLE_PREFIX = 'game_data_bundles/'
+    # Manifest of the latest bundle, written once the bundle itself is.
+    BUNDLE_MANIFEST_KEY = BUNDLE_PREFIX + 'current.json'
+
+    @property
+    def key(self):
+        return 'game_data/{}'.format(self.file_name)
 
     @property
     def url(self):
-        S3_BUCKET = current_app.config['S3_BUCKET']
-        AWS_REGION = current_app.config['AWS_REGION']
-        return 'https://s3.amazonaws.com/{}/game_data/{}'.format(S3_BUCKET, self.file_name)
+        return storage.url(self.key)
+
+    versions = db.relationship('GameDataVersion', backref='game_data',
+                               lazy='dynamic', cascade='all, delete-orphan')
+
+    def version_key(self, encoding=None, content_hash=None):
+        """Key of the content-addressed copy of the current version, or of
+        the one with the given hash."""
+        suffix = GameData.VARIANTS[encoding] if encoding else ''
+        return 'game_data/{}/{}{}'.format(content_hash or self.content_hash,
+                                          self.file_name, suffix)
+
+    @staticmethod
+    def public_url(key):
+        """URL clients download an immutable game data object from."""
+        base_url = current_app.config['GAME_DATA_BASE_URL']
+        if base_url is None:
+            return storage.url(key)
+        return '{}/{}'.format(base_url, key)
+
+    def version_url(self, encoding=None):
+        return GameData.public_url(self.version_key(encoding))
+
+    @staticmethod
+    def compress(content):
+        """Return {encoding: body} for the variants that come out smaller
+        than content. Brotli is used only when the brotli package is
+        installed."""
+        import gzip
+        variants = OrderedDict()
+        try:
+            import brotli
+            variants['br'] = brotli.compress(content)
+        except ImportError:
+            pass
+        variants['gzip'] = gzip.compress(content, 9)
+        return OrderedDict((encoding, body) for encoding, body in variants.items()
+                           if len(body) < len(content))
+
+    def to_manifest_json(self):
+        json_game_data = {
+            'file_name': self.file_name,
+            'hash': self.content_hash,
+            'size': self.size,
+            'url': self.version_url() if self.content_hash else self.url,
+        }
+        if self.content_hash:
+            json_game_data['patch_url'] = url_for(
+                'api.get_game_data_patch', file_name=self.file_name, _external=True)
+        if self.content_hash and self.encodings:
+            json_game_data['variants'] = dict(
+                (encoding, self.version_url(encoding))
+                for encoding in self.encodings.split(','))
+        return json_game_data
+
+    @staticmethod
+    def bundle_hash(files):
+        """Hash identifying the bundle of the given files' current versions."""
+        lines = ''.join('{}:{}\n'.format(f.file_name, f.content_hash)
+                        for f in sorted(files, key=lambda f: f.file_name))
+        return hashlib.sha256(lines.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def bundle_key(bundle_hash):
+        return '{}{}/game_data.tar.gz'.format(GameData.BUNDLE_PREFIX, bundle_hash)
+
+    @staticmethod
+    def bundle_manifest():
+        """Return the manifest of the latest bundle of all game data files,
+        or None until one has been built."""
+        from .game_data_cache import game_data_cache
+
+        def load(etag):
+            if not etag and not storage.exists(GameData.BUNDLE_MANIFEST_KEY):
+                return '', b'null'
+            return storage.get(GameData.BUNDLE_MANIFEST_KEY, etag)
+        body = game_data_cache.get(GameData.BUNDLE_MANIFEST_KEY, load)
+        return json.loads(body.decode('utf-8'))
 
     @staticmethod
     def insert_game_data():
@@ -707,18 +1109,238 @@ class GameData(db.Model):
         if game_data and game_data.file_name == item:
             return game_data
 
+    def _load_content(self, etag):
+        return storage.get(self.key, etag)
+
     @property
     def content(self):
-       s3 = boto3.resource('s3', current_app.config['AWS_REGION'])
-       object = s3.Object(current_app.config['S3_BUCKET'], 'game_data/{}'.format(self.file_name))
-       content = object.get()['Body'].read()
-       return content
+        from .game_data_cache import game_data_cache
+        return game_data_cache.get(self.file_name, self._load_content)
 
     @content.setter
     def content(self, content):
-        s3 = boto3.resource('s3', current_app.config['AWS_REGION'])
-        object = s3.Object(current_app.config['S3_BUCKET'], 'game_data/{}'.format(self.file_name))
-        object.put(Body=content)
+        from .game_data_cache import game_data_cache
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        game_data_cache.invalidate(self.file_name)
+        self.content_hash = hashlib.sha256(content).hexdigest()
+        self.size = len(content)
+        variants = GameData.compress(content)
+        self.encodings = ','.join(variants)
+
+        # The versioned copies are written before the row is committed, so
+        # the manifest never lists a version that isn't there yet.
+        storage.put(self.version_key(), content, content_type='application/json',
+                    cache_control=IMMUTABLE_CACHE_CONTROL)
+        for encoding, body in variants.items():
+            storage.put(self.version_key(encoding), body,
+                        content_type='application/json', content_encoding=encoding,
+                        cache_control=IMMUTABLE_CACHE_CONTROL)
+        etag = storage.put(self.key, content)
+        game_data_cache.put(self.file_name, etag, content)
+        if self.id is None or \
+                self.versions.filter_by(content_hash=self.content_hash).first() is None:
+            self.versions.append(GameDataVersion(content_hash=self.content_hash,
+                                                 size=self.size))
+
+    def publish(self):
+        """Write the content-addressed copies of the current content."""
+        self.content = self.content
+
+    def patch_key(self, from_hash):
+        return 'game_data_patches/{}/{}/{}'.format(from_hash, self.content_hash,
+                                                   self.file_name)
+
+    def patch_from(self, from_hash):
+        """Return the JSON patch that turns the version with from_hash into
+        the current content, as JSON bytes, or None when that version isn't
+        one this file has had.
+
+        A patch is computed once per pair of versions and stored next to
+        them; processes then keep it in the game data cache.
+        """
+        from .game_data_cache import game_data_cache
+        from . import json_patch
+        if self.content_hash is None or \
+                self.versions.filter_by(content_hash=from_hash).first() is None:
+            return None
+        if from_hash == self.content_hash:
+            return b'[]'
+        key = self.patch_key(from_hash)
+
+        def load(etag):
+            if etag is None and not storage.exists(key):
+                old = json.loads(storage.get(self.version_key(content_hash=from_hash))[1]
+                                 .decode('utf-8'))
+                new = json.loads(self.content.decode('utf-8'))
+                patch = json.dumps(json_patch.diff(old, new), ensure_ascii=False,
+                                   separators=(',', ':')).encode('utf-8')
+                etag = storage.put(key, patch, content_type='application/json-patch+json',
+                                   cache_control=IMMUTABLE_CACHE_CONTROL)
+                return etag, patch
+            return storage.get(key, etag)
+        return game_data_cache.get(key, load)
+
+
+class GameDataVersion(db.Model):
+    """A content version a game data file has had. The content of each is
+    kept in storage under its hash, so clients on an old version can be
+    sent a patch instead of the whole file."""
+    __tablename__ = 'game_data_versions'
+    __table_args__ = (db.UniqueConstraint('game_data_id', 'content_hash'),)
+    id = db.Column(db.Integer, primary_key=True)
+    game_data_id = db.Column(db.Integer, db.ForeignKey('game_data.id'), index=True)
+    content_hash = db.Column(db.String(64))
+    size = db.Column(db.Integer)
+    created = db.Column(db.DateTime, default=func.now())
+
+
+class GameDataUpload(db.Model):
+    """A resumable upload of new content for a game data file.
+
+    The client splits the file into chunks of ``chunk_size`` bytes and
+    declares the SHA-256 of the whole file and of every chunk up front.
+    Chunks are stored as parts of a multipart upload as they arrive, in any
+    order and as often as needed, so an interrupted transfer resumes with
+    the chunks that are still missing. Once all are in, the parts are
+    assembled into ``key`` and a job checks the result and saves it as the
+    file's content.
+
+    ``state`` goes from ``uploading`` to ``saving`` once the chunks are
+    assembled, then to ``saved``, or to ``failed`` with the reason in
+    ``error``.
+    """
+    __tablename__ = 'game_data_uploads'
+    id = db.Column(db.Integer, primary_key=True)
+    game_data_id = db.Column(db.Integer, db.ForeignKey('game_data.id'), index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    key = db.Column(db.String(255))
+    storage_upload_id = db.Column(db.String(255))
+    size = db.Column(db.Integer)
+    content_hash = db.Column(db.String(64))
+    chunk_size = db.Column(db.Integer)
+    chunk_hashes = db.Column(db.Text)
+    state = db.Column(db.String(16), default='uploading')
+    error = db.Column(db.String(255))
+    job_id = db.Column(db.String(64))
+    created = db.Column(db.DateTime, default=func.now())
+
+    game_data = db.relationship('GameData')
+    parts = db.relationship('GameDataUploadPart', backref='upload',
+                            order_by='GameDataUploadPart.number',
+                            cascade='all, delete-orphan')
+
+    PREFIX = 'game_data_uploads/'
+
+    @staticmethod
+    def _is_hash(value):
+        return isinstance(value, str) and len(value) == 64 and \
+            all(c in string.hexdigits for c in value)
+
+    @staticmethod
+    def from_json(game_data, user, json_upload):
+        size = json_upload.get('size')
+        content_hash = json_upload.get('hash')
+        chunk_hashes = json_upload.get('chunks')
+        chunk_size = json_upload.get('chunk_size')
+        min_chunk_size = current_app.config['GAME_DATA_UPLOAD_MIN_CHUNK_SIZE']
+        max_size = current_app.config['GAME_DATA_UPLOAD_MAX_SIZE']
+        if not isinstance(size, int) or not 0 < size <= max_size:
+            raise ValidationError('size must be between 1 and {} bytes'.format(max_size))
+        if not GameDataUpload._is_hash(content_hash):
+            raise ValidationError('hash must be the SHA-256 of the file in hex')
+        if not isinstance(chunk_size, int) or chunk_size < min(min_chunk_size, size):
+            raise ValidationError('chunk_size must be at least {} bytes'.format(
+                min_chunk_size))
+        if not isinstance(chunk_hashes, list) or \
+                not all(GameDataUpload._is_hash(h) for h in chunk_hashes):
+            raise ValidationError('chunks must list the SHA-256 of every chunk in hex')
+        if len(chunk_hashes) != -(-size // chunk_size):
+            raise ValidationError('a {} byte file has {} chunks of {} bytes'.format(
+                size, -(-size // chunk_size), chunk_size))
+        upload = GameDataUpload(game_data=game_data, user_id=user.id, size=size,
+                                content_hash=content_hash.lower(),
+                                chunk_size=chunk_size,
+                                chunk_hashes=','.join(h.lower() for h in chunk_hashes))
+        upload.key = '{}{}/{}'.format(GameDataUpload.PREFIX, uuid.uuid4().hex,
+                                      game_data.file_name)
+        upload.storage_upload_id = storage.create_multipart(
+            upload.key, content_type='application/json')
+        return upload
+
+    @property
+    def chunk_count(self):
+        return len(self.chunk_hashes.split(','))
+
+    def received(self):
+        return [part.number for part in self.parts]
+
+    def missing(self):
+        received = set(self.received())
+        return [n for n in range(1, self.chunk_count + 1) if n not in received]
+
+    def add_chunk(self, number, body):
+        """Store chunk number (from 1) if it matches the hash declared for
+        it. Sending a chunk that is already stored is harmless."""
+        if self.state != 'uploading':
+            raise ValidationError('the upload is {}'.format(self.state))
+        if not 1 <= number <= self.chunk_count:
+            raise ValidationError('chunk must be between 1 and {}'.format(
+                self.chunk_count))
+        expected_size = min(self.chunk_size, self.size - (number - 1) * self.chunk_size)
+        if len(body) != expected_size:
+            raise ValidationError('chunk {} must be {} bytes'.format(number, expected_size))
+        if hashlib.sha256(body).hexdigest() != self.chunk_hashes.split(',')[number - 1]:
+            raise ValidationError('chunk {} does not match its hash'.format(number))
+        etag = storage.upload_part(self.key, self.storage_upload_id, number, body)
+        # Chunks of one upload may arrive in parallel.
+        db.session.execute(insert_ignoring_duplicates(GameDataUploadPart.__table__),
+                           {'upload_id': self.id, 'number': number, 'etag': etag})
+        db.session.expire(self, ['parts'])
+
+    def complete(self):
+        """Assemble the chunks into key. Raises ValidationError while any
+        is missing."""
+        if self.state != 'uploading':
+            raise ValidationError('the upload is {}'.format(self.state))
+        missing = self.missing()
+        if missing:
+            raise ValidationError('chunks {} are missing'.format(
+                ', '.join(str(n) for n in missing)))
+        storage.complete_multipart(self.key, self.storage_upload_id,
+                                   [(part.number, part.etag) for part in self.parts])
+        self.state = 'saving'
+        self.parts = []
+
+    def abort(self):
+        if self.state == 'uploading':
+            storage.abort_multipart(self.key, self.storage_upload_id)
+        else:
+            storage.delete(self.key)
+
+    def to_json(self):
+        json_upload = {
+            'id': self.id,
+            'url': url_for('api.get_game_data_upload', id=self.id, _external=True),
+            'file_name': self.game_data.file_name,
+            'size': self.size,
+            'hash': self.content_hash,
+            'chunk_size': self.chunk_size,
+            'chunks': self.chunk_count,
+            'missing': self.missing() if self.state == 'uploading' else [],
+            'state': self.state,
+            'error': self.error,
+            'job_id': self.job_id,
+        }
+        return json_upload
+
+
+class GameDataUploadPart(db.Model):
+    __tablename__ = 'game_data_upload_parts'
+    upload_id = db.Column(db.Integer, db.ForeignKey('game_data_uploads.id'),
+                          primary_key=True)
+    number = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    etag = db.Column(db.String(128))
 
 
 class LoginInfo(db.Model):
@@ -739,10 +1361,6 @@ class Screen(db.Model):
     duration = db.Column(db.Integer)
     created = db.Column(db.DateTime, default=func.now())
 
-    @property
-    def user(self):
-        return User.query.get(self.user_id)
-
     @staticmethod
     def from_json(data):
         user_id = data.get('user_id')
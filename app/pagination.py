@@ -0,0 +1,67 @@
+from flask import current_app
+from flask_sqlalchemy import Pagination
+from . import db
+
+
+class EstimatedPagination(Pagination):
+    """Pagination whose total may be a planner estimate.
+
+    ``approximate`` tells whether ``total`` is an estimate. ``has_next`` is
+    always exact, since it comes from fetching one row past the page.
+    """
+
+    def __init__(self, query, page, per_page, total, items, has_next,
+                 approximate):
+        super(EstimatedPagination, self).__init__(query, page, per_page,
+                                                  total, items)
+        self._has_next = has_next
+        self.approximate = approximate
+
+    @property
+    def has_next(self):
+        return self._has_next
+
+
+def estimate_count(query):
+    """Return the planner's row estimate for query, or None when the
+    database can't provide one."""
+    if db.engine.dialect.name != 'postgresql':
+        return None
+    compiled = query.order_by(None).statement.compile(dialect=db.engine.dialect)
+    plan = db.session.connection().execute(
+        'EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params).scalar()
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def paginate(query, page, per_page, total=None):
+    """Paginate query like Query.paginate(page, per_page, error_out=False)
+    without a COUNT(*) over large results.
+
+    The count is exact when the planner expects fewer than
+    BACKEND_EXACT_COUNT_THRESHOLD rows, or on databases without
+    estimates; otherwise the estimate is used. A total the caller already
+    knows, such as a maintained counter, skips counting altogether.
+    """
+    if page < 1:
+        page = 1
+    items = query.limit(per_page + 1).offset((page - 1) * per_page).all()
+    has_next = len(items) > per_page
+    items = items[:per_page]
+    seen = (page - 1) * per_page + len(items)
+
+    if total is not None:
+        return EstimatedPagination(query, page, per_page, total, items,
+                                   has_next, False)
+    if items and not has_next:
+        # On the last page every row has been seen.
+        return EstimatedPagination(query, page, per_page, seen, items,
+                                   has_next, False)
+    total = estimate_count(query)
+    approximate = total is not None and \
+        total >= current_app.config['BACKEND_EXACT_COUNT_THRESHOLD']
+    if approximate:
+        total = max(total, seen + (1 if has_next else 0))
+    else:
+        total = query.order_by(None).count()
+    return EstimatedPagination(query, page, per_page, total, items, has_next,
+                               approximate)
@@ -0,0 +1,22 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app
+from werkzeug.security import generate_password_hash
+
+
+def hash_passwords(passwords):
+    """Hash a list of passwords, keeping their order.
+
+    Large batches are spread over a process pool with one process per core
+    (or ``PASSWORD_HASH_WORKERS``). Batches smaller than
+    ``PASSWORD_HASH_POOL_MIN`` are hashed inline, where starting the pool
+    would cost more than it saves.
+    """
+    passwords = list(passwords)
+    if len(passwords) < current_app.config['PASSWORD_HASH_POOL_MIN']:
+        return [generate_password_hash(p) for p in passwords]
+    workers = current_app.config['PASSWORD_HASH_WORKERS'] or os.cpu_count() or 1
+    chunksize = max(1, len(passwords) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(generate_password_hash, passwords,
+                                 chunksize=chunksize))
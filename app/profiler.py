@@ -0,0 +1,195 @@
+import cProfile
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import current_app, g, has_app_context, request, request_started, \
+    request_tearing_down
+from redis.exceptions import RedisError
+
+from . import redis_store
+
+SETTINGS_KEY = 'profiler:settings'
+MODES = ('stacks', 'cprofile', 'both')
+
+
+class _Sampler(threading.Thread):
+    """Records the stacks of registered threads every ``interval``
+    seconds, and sleeps while there are none."""
+
+    def __init__(self, interval):
+        super(_Sampler, self).__init__(name='request-profiler')
+        self.daemon = True
+        self.interval = interval
+        self.pid = os.getpid()
+        self.threads = {}
+        self.lock = threading.Lock()
+        self.active = threading.Event()
+
+    def add(self, ident):
+        with self.lock:
+            self.threads[ident] = Counter()
+            self.active.set()
+
+    def remove(self, ident):
+        with self.lock:
+            stacks = self.threads.pop(ident)
+            if not self.threads:
+                self.active.clear()
+        return stacks
+
+    @staticmethod
+    def _stack(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append('{} ({}:{})'.format(code.co_name, code.co_filename,
+                                             code.co_firstlineno))
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def run(self):
+        while True:
+            self.active.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self.lock:
+                for ident, stacks in self.threads.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stacks[self._stack(frame)] += 1
+
+
+class _State(object):
+    def __init__(self, app):
+        self.directory = app.config['PROFILER_DIR']
+        self.interval = app.config['PROFILER_INTERVAL']
+        self.refresh_interval = app.config['PROFILER_REFRESH_INTERVAL']
+        self.defaults = {
+            'sample_rate': app.config['PROFILER_SAMPLE_RATE'],
+            'endpoints': list(app.config['PROFILER_ENDPOINTS']),
+            'mode': app.config['PROFILER_MODE'],
+        }
+        self.settings = self.defaults
+        self.checked = 0
+        self.sampler = None
+        self.lock = threading.Lock()
+
+
+class RequestProfiler(object):
+    """Profiles a sample of requests in the running workers.
+
+    A request is profiled when its endpoint is one of ``endpoints``, or
+    one time in ``sample_rate`` when no endpoints are given, or one in
+    ``sample_rate`` of the requests to them when both are. The
+    ``stacks`` mode samples the request thread's stack every
+    ``PROFILER_INTERVAL`` seconds from a background thread, which costs the
+    request almost nothing, and writes the counts in the collapsed format
+    flame graph tools read (``.folded``). ``cprofile`` traces every call
+    and writes a ``.prof`` dump for pstats or snakeviz; ``both`` does both.
+    Files go to ``PROFILER_DIR``.
+
+    The settings come from the ``PROFILER_*`` config unless ``enable``
+    has stored others in Redis, which workers check every
+    ``PROFILER_REFRESH_INTERVAL`` seconds, so profiling can be turned on
+    and off without a restart.
+    """
+
+    def init_app(self, app):
+        app.extensions['profiler'] = _State(app)
+        request_started.connect(self._request_started, app, weak=False)
+        request_tearing_down.connect(self._request_tearing_down, app, weak=False)
+
+    @property
+    def _state(self):
+        if not has_app_context():
+            return None
+        return current_app.extensions.get('profiler')
+
+    def enable(self, sample_rate=0, endpoints=(), mode='stacks', expires_in=600):
+        """Turn profiling on in every worker for expires_in seconds."""
+        if mode not in MODES:
+            raise ValueError('mode must be one of {}'.format(', '.join(MODES)))
+        if not sample_rate and not endpoints:
+            raise ValueError('give a sample rate, endpoints or both')
+        redis_store.setex(SETTINGS_KEY, expires_in, json.dumps({
+            'sample_rate': sample_rate, 'endpoints': list(endpoints), 'mode': mode}))
+
+    def disable(self):
+        """Go back to the settings in the config."""
+        redis_store.delete(SETTINGS_KEY)
+
+    def settings(self):
+        state = self._state
+        if time.time() - state.checked < state.refresh_interval:
+            return state.settings
+        state.checked = time.time()
+        try:
+            stored = redis_store.get(SETTINGS_KEY)
+        except RedisError:
+            current_app.logger.exception('Profiler settings unavailable')
+            stored = None
+        state.settings = json.loads(stored.decode('utf-8')) if stored else state.defaults
+        return state.settings
+
+    def _sampler(self, state):
+        if state.sampler is None or state.sampler.pid != os.getpid():
+            with state.lock:
+                if state.sampler is None or state.sampler.pid != os.getpid():
+                    state.sampler = _Sampler(state.interval)
+                    state.sampler.start()
+        return state.sampler
+
+    def _request_started(self, app, **extra):
+        g.profile = None
+        settings = self.settings()
+        sample_rate = settings['sample_rate']
+        endpoints = settings['endpoints']
+        if endpoints and request.endpoint not in endpoints:
+            return
+        if sample_rate and random.randrange(sample_rate) != 0:
+            return
+        if not sample_rate and not endpoints:
+            return
+        mode = settings['mode']
+        g.profile = {'start': time.time(), 'cprofile': None, 'thread': None}
+        if mode in ('stacks', 'both'):
+            g.profile['thread'] = threading.get_ident()
+            self._sampler(self._state).add(g.profile['thread'])
+        if mode in ('cprofile', 'both'):
+            g.profile['cprofile'] = cProfile.Profile()
+            g.profile['cprofile'].enable()
+
+    def _request_tearing_down(self, app, **extra):
+        profile = getattr(g, 'profile', None)
+        if profile is None:
+            return
+        g.profile = None
+        state = self._state
+        if profile['cprofile'] is not None:
+            profile['cprofile'].disable()
+        stacks = None
+        if profile['thread'] is not None:
+            stacks = state.sampler.remove(profile['thread'])
+
+        elapsed = time.time() - profile['start']
+        path = os.path.join(state.directory, '{}.{}.{:.0f}ms.{:.0f}.{}'.format(
+            request.endpoint or 'none', request.method, elapsed * 1000,
+            profile['start'] * 1000, os.getpid()))
+        try:
+            os.makedirs(state.directory, exist_ok=True)
+            if profile['cprofile'] is not None:
+                profile['cprofile'].dump_stats(path + '.prof')
+            if stacks:
+                with open(path + '.folded', 'w') as f:
+                    for stack, count in stacks.most_common():
+                        f.write('{} {}\n'.format(stack, count))
+        except OSError:
+            current_app.logger.exception('Profile not written')
+
+
+profiler = RequestProfiler()
@@ -0,0 +1,348 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from datetime import datetime
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from flask import current_app
+
+from .metrics import metrics
+
+# Cache-Control for objects whose key changes with their content.
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+class S3Backend(object):
+    """Objects in the ``S3_BUCKET`` bucket, through one shared client.
+
+    boto3 clients are thread-safe, so every thread of a process uses the
+    same one and its connection pool of ``STORAGE_MAX_POOL_CONNECTIONS``.
+    The client is built on first use and again after a fork, since pooled
+    connections can't be shared with a child process. ``STORAGE_ENDPOINT_URL``
+    points it at an S3-compatible server instead of AWS.
+    """
+
+    def __init__(self, app):
+        self.bucket = app.config['S3_BUCKET']
+        self.region = app.config['AWS_REGION']
+        self.endpoint_url = app.config['STORAGE_ENDPOINT_URL']
+        self.max_pool_connections = app.config['STORAGE_MAX_POOL_CONNECTIONS']
+        self.public_url = app.config['STORAGE_PUBLIC_URL'] or '{}/{}'.format(
+            self.endpoint_url or 'https://s3.amazonaws.com', self.bucket)
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._client = boto3.session.Session().client(
+                        's3', region_name=self.region,
+                        endpoint_url=self.endpoint_url,
+                        config=Config(max_pool_connections=self.max_pool_connections))
+                    self._pid = os.getpid()
+        return self._client
+
+    def put(self, key, body, content_type=None, content_encoding=None,
+            cache_control=None):
+        kwargs = {}
+        if content_type:
+            kwargs['ContentType'] = content_type
+        if content_encoding:
+            kwargs['ContentEncoding'] = content_encoding
+        if cache_control:
+            kwargs['CacheControl'] = cache_control
+        response = self.client.put_object(Bucket=self.bucket, Key=key,
+                                          Body=body, **kwargs)
+        return response['ETag']
+
+    def get(self, key, etag=None):
+        kwargs = {'IfNoneMatch': etag} if etag else {}
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=key,
+                                              **kwargs)
+        except ClientError as e:
+            if e.response['ResponseMetadata']['HTTPStatusCode'] == 304:
+                return None
+            raise
+        return response['ETag'], response['Body'].read()
+
+    def open(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=key)['Body']
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response['ResponseMetadata']['HTTPStatusCode'] == 404:
+                return False
+            raise
+        return True
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def list(self, prefix):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix,
+                                       PaginationConfig={'PageSize': 1000}):
+            for obj in page.get('Contents', []):
+                yield obj['Key'], obj['Size'], obj['LastModified']
+
+    # The most keys S3 takes in one DeleteObjects request.
+    DELETE_BATCH_SIZE = 1000
+
+    def delete_many(self, keys):
+        failed = []
+        for i in range(0, len(keys), self.DELETE_BATCH_SIZE):
+            batch = keys[i:i + self.DELETE_BATCH_SIZE]
+            response = self.client.delete_objects(
+                Bucket=self.bucket,
+                Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True})
+            failed.extend(error['Key'] for error in response.get('Errors', []))
+        return failed
+
+    def create_multipart(self, key, content_type=None):
+        kwargs = {'ContentType': content_type} if content_type else {}
+        response = self.client.create_multipart_upload(Bucket=self.bucket,
+                                                       Key=key, **kwargs)
+        return response['UploadId']
+
+    def upload_part(self, key, upload_id, number, body):
+        response = self.client.upload_part(Bucket=self.bucket, Key=key,
+                                           UploadId=upload_id,
+                                           PartNumber=number, Body=body)
+        return response['ETag']
+
+    def complete_multipart(self, key, upload_id, parts):
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=key, UploadId=upload_id,
+            MultipartUpload={'Parts': [{'PartNumber': number, 'ETag': etag}
+                                       for number, etag in parts]})
+
+    def abort_multipart(self, key, upload_id):
+        self.client.abort_multipart_upload(Bucket=self.bucket, Key=key,
+                                           UploadId=upload_id)
+
+    def presigned_post(self, key, fields, conditions, expires_in=3600):
+        return self.client.generate_presigned_post(
+            Bucket=self.bucket, Key=key, Fields=fields,
+            Conditions=conditions, ExpiresIn=expires_in)
+
+    def url(self, key):
+        return '{}/{}'.format(self.public_url, key)
+
+
+class LocalBackend(object):
+    """Objects as files under ``STORAGE_LOCAL_PATH``, for development and
+    tests. Each object's ETag and headers are kept in a ``.meta`` file
+    next to it, and the parts of unfinished multipart uploads under
+    ``.uploads``."""
+
+    def __init__(self, app):
+        self.root = app.config['STORAGE_LOCAL_PATH']
+        self.public_url = app.config['STORAGE_PUBLIC_URL'] or \
+            'file://' + os.path.abspath(self.root)
+
+    def _path(self, key):
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError('Invalid key {}'.format(key))
+        return path
+
+    @staticmethod
+    def _write(path, data):
+        fd, tmp = tempfile.mkstemp(prefix='.tmp', dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+    def put(self, key, body, content_type=None, content_encoding=None,
+            cache_control=None):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        path = self._path(key)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+        meta = {'etag': etag, 'content_type': content_type,
+                'content_encoding': content_encoding,
+                'cache_control': cache_control}
+        self._write(path, body)
+        self._write(path + '.meta', json.dumps(meta).encode('utf-8'))
+        return etag
+
+    def head(self, key):
+        """Return the ETag and headers an object was stored with."""
+        with open(self._path(key) + '.meta') as f:
+            return json.load(f)
+
+    def get(self, key, etag=None):
+        path = self._path(key)
+        stored_etag = self.head(key)['etag']
+        if etag == stored_etag:
+            return None
+        with open(path, 'rb') as f:
+            return stored_etag, f.read()
+
+    def open(self, key):
+        return open(self._path(key), 'rb')
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def delete(self, key):
+        path = self._path(key)
+        for p in (path, path + '.meta'):
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+
+    def list(self, prefix):
+        root = os.path.normpath(self.root)
+        for directory, directories, files in os.walk(root):
+            directories[:] = sorted(d for d in directories if not d.startswith('.'))
+            for name in sorted(files):
+                if name.startswith('.') or name.endswith('.meta'):
+                    continue
+                path = os.path.join(directory, name)
+                key = os.path.relpath(path, root).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    yield key, os.path.getsize(path), \
+                        datetime.utcfromtimestamp(os.path.getmtime(path))
+
+    def delete_many(self, keys):
+        for key in keys:
+            self.delete(key)
+        return []
+
+    def _upload_path(self, upload_id):
+        return os.path.join(self.root, '.uploads', upload_id)
+
+    def create_multipart(self, key, content_type=None):
+        self._path(key)
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self._upload_path(upload_id))
+        with open(os.path.join(self._upload_path(upload_id), 'content_type'), 'w') as f:
+            f.write(content_type or '')
+        return upload_id
+
+    def upload_part(self, key, upload_id, number, body):
+        path = os.path.join(self._upload_path(upload_id), str(number))
+        self._write(path, body)
+        return '"{}"'.format(hashlib.md5(body).hexdigest())
+
+    def complete_multipart(self, key, upload_id, parts):
+        directory = self._upload_path(upload_id)
+        with open(os.path.join(directory, 'content_type')) as f:
+            content_type = f.read() or None
+        body = []
+        for number, _ in parts:
+            with open(os.path.join(directory, str(number)), 'rb') as f:
+                body.append(f.read())
+        self.put(key, b''.join(body), content_type=content_type)
+        shutil.rmtree(directory)
+
+    def abort_multipart(self, key, upload_id):
+        shutil.rmtree(self._upload_path(upload_id), ignore_errors=True)
+
+    def presigned_post(self, key, fields, conditions, expires_in=3600):
+        return {'url': self.public_url, 'fields': dict(fields, key=key)}
+
+    def url(self, key):
+        return '{}/{}'.format(self.public_url, key)
+
+
+BACKENDS = {'s3': S3Backend, 'local': LocalBackend}
+
+
+class Storage(object):
+    """The app's object storage, selected by ``STORAGE_BACKEND``.
+
+    All code reads and writes objects through the module's ``storage``
+    instance instead of building boto3 clients of its own.
+    """
+
+    def init_app(self, app):
+        app.extensions['storage'] = BACKENDS[app.config['STORAGE_BACKEND']](app)
+
+    @property
+    def backend(self):
+        return current_app.extensions['storage']
+
+    def _call(self, operation, *args, **kwargs):
+        with metrics.timer('storage', operation):
+            return getattr(self.backend, operation)(*args, **kwargs)
+
+    def put(self, key, body, content_type=None, content_encoding=None,
+            cache_control=None):
+        """Store body under key and return its ETag."""
+        return self._call('put', key, body, content_type=content_type,
+                          content_encoding=content_encoding,
+                          cache_control=cache_control)
+
+    def get(self, key, etag=None):
+        """Return (ETag, body) for key, or None when etag is given and the
+        object still has it."""
+        return self._call('get', key, etag)
+
+    def open(self, key):
+        """Return a file-like object to read key's body from in pieces."""
+        return self._call('open', key)
+
+    def exists(self, key):
+        return self._call('exists', key)
+
+    def delete(self, key):
+        self._call('delete', key)
+
+    def list(self, prefix):
+        """Yield (key, size, last modified) for every object under prefix,
+        a page at a time."""
+        return self.backend.list(prefix)
+
+    def delete_many(self, keys):
+        """Delete keys with as few requests as the backend allows and
+        return the keys that couldn't be deleted."""
+        return self._call('delete_many', list(keys))
+
+    def create_multipart(self, key, content_type=None):
+        """Start a multipart upload to key and return its id.
+
+        Parts can be uploaded in any order and again, and the object
+        appears only when the upload is completed. With S3, every part but
+        the last must be at least 5 MiB.
+        """
+        return self._call('create_multipart', key, content_type)
+
+    def upload_part(self, key, upload_id, number, body):
+        """Upload part number (from 1) and return its ETag."""
+        return self._call('upload_part', key, upload_id, number, body)
+
+    def complete_multipart(self, key, upload_id, parts):
+        """Assemble key from parts, a list of (number, ETag) in order."""
+        self._call('complete_multipart', key, upload_id, parts)
+
+    def abort_multipart(self, key, upload_id):
+        """Discard an unfinished upload and its parts."""
+        self._call('abort_multipart', key, upload_id)
+
+    def presigned_post(self, key, fields, conditions, expires_in=3600):
+        """Return the URL and form fields a browser posts to upload key."""
+        return self.backend.presigned_post(key, fields, conditions, expires_in)
+
+    def url(self, key):
+        """Public URL of key."""
+        return self.backend.url(key)
+
+
+storage = Storage()
@@ -0,0 +1,54 @@
+from flask import current_app
+from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
+
+
+class TokenSigners(object):
+    """Caches one signed-token serializer per purpose and expiration.
+
+    Building a ``TimedJSONWebSignatureSerializer`` derives its signing key,
+    so the common serializers are built once in ``init_app`` instead of on
+    every call. Each purpose gets its own salt, so a token issued for one
+    purpose is rejected by the others.
+    """
+
+    PURPOSES = ('confirm', 'reset', 'change_email', 'auth')
+    DEFAULT_EXPIRATION = 3600
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        signers = app.extensions['token_signers'] = {}
+        for purpose in self.PURPOSES:
+            signers[(purpose, self.DEFAULT_EXPIRATION)] = \
+                self._build(app, purpose, self.DEFAULT_EXPIRATION)
+
+    @staticmethod
+    def _build(app, purpose, expiration):
+        return Serializer(app.config['SECRET_KEY'], expires_in=expiration,
+                          salt='backend.{}'.format(purpose))
+
+    def signer(self, purpose, expiration=DEFAULT_EXPIRATION):
+        app = current_app._get_current_object()
+        signers = app.extensions['token_signers']
+        s = signers.get((purpose, expiration))
+        if s is None:
+            s = signers[(purpose, expiration)] = \
+                self._build(app, purpose, expiration)
+        return s
+
+    def dumps(self, purpose, data, expiration=DEFAULT_EXPIRATION):
+        return self.signer(purpose, expiration).dumps(data)
+
+    def loads(self, purpose, token):
+        """Return the token payload, or None if it is invalid or expired.
+        The expiration is read from the token, so any cached signer for the
+        purpose can verify it."""
+        try:
+            return self.signer(purpose).loads(token)
+        except:
+            return None
+
+
+token_signers = TokenSigners()
@@ -7,7 +7,7 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'hard to guess string'
     SSL_DISABLE = False
     SQLALCHEMY_COMMIT_ON_TEARDOWN = True
-    SQLALCHEMY_RECORD_QUERIES = True
+    SQLALCHEMY_RECORD_QUERIES = False
     MAIL_SERVER = os.environ.get('MAIL_SERVER')
     MAIL_PORT = 587
     MAIL_USE_TLS = True
@@ -20,13 +20,54 @@ class Config:
     BACKEND_FOLLOWERS_PER_PAGE = 50
     BACKEND_COMMENTS_PER_PAGE = 30
     BACKEND_SLOW_DB_QUERY_TIME = 0.5
+    BACKEND_BACKGROUND_DELETE_THRESHOLD = 200
+    BACKEND_SEARCH_RESULTS = 20
+    BACKEND_BULK_MEMBERS_MAX = 10000
+    BACKEND_EXACT_COUNT_THRESHOLD = 10000
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     S3_BUCKET = os.environ.get('S3_BUCKET')
     AWS_REGION = 'us-east-1'
     AWS_ACCESS_KEY_ID = os.environ.get('AWS_ACCESS_KEY_ID')
     AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY')
     CORS_HEADERS = 'Content-Type'
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 's3')
+    STORAGE_ENDPOINT_URL = os.environ.get('STORAGE_ENDPOINT_URL')
+    STORAGE_LOCAL_PATH = os.environ.get('STORAGE_LOCAL_PATH',
+                                        os.path.join(basedir, 'storage'))
+    STORAGE_PUBLIC_URL = os.environ.get('STORAGE_PUBLIC_URL')
+    STORAGE_MAX_POOL_CONNECTIONS = 20
+    ASSET_THUMBNAIL_SIZE = 256
+    ASSET_WEBP_QUALITY = 80
     MAIL_RECEIVERS = os.environ.get('MAIL_RECEIVERS', '').split(",")
+    MAIL_SINK = os.environ.get('MAIL_SINK', 'smtp')
+    MAIL_SINK_PATH = os.environ.get('MAIL_SINK_PATH')
+    MAIL_WORKERS = 2
+    MAIL_QUEUE_SIZE = 100
+    MAIL_QUEUE_TIMEOUT = 5
+    MAIL_BATCH_SIZE = 20
+    PASSWORD_HASH_WORKERS = None
+    PASSWORD_HASH_POOL_MIN = 50
+    JOBS_SYNC = False
+    JOBS_RESULT_TTL = 24 * 3600
+    FRAGMENT_CACHE_ENABLED = True
+    FRAGMENT_CACHE_TIMEOUT = 24 * 3600
+    GAME_DATA_CACHE_MAX_BYTES = 32 * 1024 * 1024
+    GAME_DATA_CACHE_TTL = 60
+    GAME_DATA_CACHE_DIR = os.environ.get('GAME_DATA_CACHE_DIR')
+    GAME_DATA_BASE_URL = os.environ.get('GAME_DATA_BASE_URL')
+    GAME_DATA_MANIFEST_MAX_AGE = 60
+    GAME_DATA_UPLOAD_MIN_CHUNK_SIZE = 5 * 1024 * 1024
+    GAME_DATA_UPLOAD_MAX_SIZE = 256 * 1024 * 1024
+    METRICS_ENABLED = True
+    METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    METRICS_FLUSH_INTERVAL = 15
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    PROFILER_DIR = os.environ.get('PROFILER_DIR', os.path.join(basedir, 'tmp/profiles'))
+    PROFILER_INTERVAL = 0.005
+    PROFILER_REFRESH_INTERVAL = 10
+    PROFILER_SAMPLE_RATE = 0
+    PROFILER_ENDPOINTS = ()
+    PROFILER_MODE = 'stacks'
 
     @staticmethod
     def init_app(app):
@@ -50,6 +91,15 @@ class TestingConfig(Config):
     REDIS_URL = os.environ.get('REDISTOGO_URL', 'redis://localhost:6379')
     WTF_CSRF_ENABLED = False
     SERVER_NAME = 'localhost:5000'
+    MAIL_SINK = 'memory'
+    JOBS_SYNC = True
+    FRAGMENT_CACHE_ENABLED = False
+    STORAGE_BACKEND = 'local'
+    STORAGE_LOCAL_PATH = os.path.join(basedir, 'storage-test')
+    GAME_DATA_UPLOAD_MIN_CHUNK_SIZE = 16
+    SQLALCHEMY_RECORD_QUERIES = True
+    METRICS_FLUSH_INTERVAL = None
+    PROFILER_DIR = os.path.join(basedir, 'profiles-test')
 
 
 class ProductionConfig(Config):
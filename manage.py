@@ -15,7 +15,7 @@ if os.path.exists('.env'):
         if len(var) == 2:
             os.environ[var[0]] = var[1]
 
-from app import create_app, db, redis_store
+from app import create_app, db
 from app.models import User, Role, Permission, School, GameData
 from flask_script import Manager, Shell
 from flask_migrate import Migrate, MigrateCommand
@@ -57,12 +57,90 @@ def test(coverage=False):
 
 
 @manager.command
-def profile(length=25, profile_dir=None):
-    """Start the application under the code profiler."""
-    from werkzeug.contrib.profiler import ProfilerMiddleware
-    app.wsgi_app = ProfilerMiddleware(app.wsgi_app, restrictions=[length],
-                                      profile_dir=profile_dir)
-    app.run()
+def profile(sample_rate=0, endpoints=None, mode='stacks', minutes=10, off=False):
+    """Profile requests in the running workers for some minutes: every
+    request to the given endpoints (comma separated), one in sample_rate,
+    or both. Mode is stacks, cprofile or both; output goes to
+    PROFILER_DIR. --off stops profiling."""
+    from app.profiler import profiler
+    if off:
+        profiler.disable()
+        print('Profiling off')
+        return
+    endpoints = endpoints.split(',') if endpoints else []
+    profiler.enable(sample_rate=sample_rate, endpoints=endpoints, mode=mode,
+                    expires_in=minutes * 60)
+    print('Profiling on for {} minutes, writing to {}'.format(
+        minutes, app.config['PROFILER_DIR']))
+
+
+@manager.command
+def import_students(csv_file=None, delimiter=',', background=False):
+    """Import students from a CSV file, or from S3 when none is given.
+    With --background the S3 import runs on the worker instead."""
+    from app.importer import import_students as import_from_lines
+    if csv_file is None and background:
+        from app.jobs import enqueue, users as users_jobs
+        job = enqueue(users_jobs.import_students, timeout=30*60,
+                      description='Import students from S3')
+        if job is not None:
+            print('Enqueued job {}'.format(job.id))
+        return
+    if csv_file is None:
+        report = User.import_students()
+    else:
+        with open(csv_file) as f:
+            report = import_from_lines(f, delimiter)
+    print('Created {}, skipped {}, errors {}'.format(
+        len(report.created), len(report.skipped), len(report.errors)))
+    for line, message in report.errors:
+        print('line {}: {}'.format(line, message))
+
+
+@manager.command
+def benchmark_tokens(iterations=1000):
+    """Compare token verification with a fresh and a cached serializer."""
+    import timeit
+    from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
+    from app.tokens import token_signers
+
+    iterations = int(iterations)
+    secret_key = app.config['SECRET_KEY']
+    with app.app_context():
+        token = token_signers.dumps('auth', {'id': 1})
+
+        def fresh():
+            s = Serializer(secret_key, salt='backend.auth')
+            s.loads(token)
+
+        def cached():
+            token_signers.loads('auth', token)
+
+        for name, f in (('fresh serializer', fresh), ('cached serializer', cached)):
+            elapsed = timeit.timeit(f, number=iterations)
+            print('{:<20}{:>10.1f} us/call'.format(name, elapsed / iterations * 1e6))
+
+
+@manager.command
+def reconcile_school_counts():
+    """Recompute the teacher and student counts of every school."""
+    from app.models import School
+    print('Fixed the counts of {} schools'.format(School.reconcile_member_counts()))
+
+
+@manager.command
+def publish_game_data():
+    """Write content-addressed copies of game data files that lack them,
+    and the bundle of all of them."""
+    from app.models import GameData
+    for game_data in GameData.query.filter(GameData.content_hash.is_(None)):
+        game_data.publish()
+        db.session.commit()
+        print('Published {}'.format(game_data.file_name))
+    from app.jobs.game_data import build_bundle
+    bundle = build_bundle()
+    if bundle is not None:
+        print('Bundle {}'.format(bundle['hash']))
 
 
 @manager.command
@@ -81,13 +159,8 @@ def deploy():
 @manager.command
 def worker():
     """Execute background tasks"""
-    from rq import Worker, Queue, Connection
-
-    listen = ['high', 'default', 'low']
-
-    with Connection(redis_store):
-        worker = Worker(map(Queue, listen))
-        worker.work()
+    from app.jobs import work
+    work(app)
 
 
 if __name__ == '__main__':
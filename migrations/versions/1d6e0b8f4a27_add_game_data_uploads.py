@@ -0,0 +1,49 @@
+"""add game data uploads
+
+Revision ID: 1d6e0b8f4a27
+Revises: f7c3d1a90b52
+Create Date: 2026-10-19 15:12:07.530184
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1d6e0b8f4a27'
+down_revision = 'f7c3d1a90b52'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('game_data_uploads',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('game_data_id', sa.Integer(), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('key', sa.String(length=255), nullable=True),
+    sa.Column('storage_upload_id', sa.String(length=255), nullable=True),
+    sa.Column('size', sa.Integer(), nullable=True),
+    sa.Column('content_hash', sa.String(length=64), nullable=True),
+    sa.Column('chunk_size', sa.Integer(), nullable=True),
+    sa.Column('chunk_hashes', sa.Text(), nullable=True),
+    sa.Column('state', sa.String(length=16), nullable=True),
+    sa.Column('error', sa.String(length=255), nullable=True),
+    sa.Column('job_id', sa.String(length=64), nullable=True),
+    sa.Column('created', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['game_data_id'], ['game_data.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_game_data_uploads_game_data_id'), 'game_data_uploads', ['game_data_id'], unique=False)
+    op.create_table('game_data_upload_parts',
+    sa.Column('upload_id', sa.Integer(), nullable=False),
+    sa.Column('number', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('etag', sa.String(length=128), nullable=True),
+    sa.ForeignKeyConstraint(['upload_id'], ['game_data_uploads.id'], ),
+    sa.PrimaryKeyConstraint('upload_id', 'number')
+    )
+
+
+def downgrade():
+    op.drop_table('game_data_upload_parts')
+    op.drop_index(op.f('ix_game_data_uploads_game_data_id'), table_name='game_data_uploads')
+    op.drop_table('game_data_uploads')
@@ -0,0 +1,30 @@
+"""add trigram search indexes
+
+Revision ID: 4b1f0c2d9e7a
+Revises: 533437529fea
+Create Date: 2026-10-19 10:12:41.118203
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4b1f0c2d9e7a'
+down_revision = '533437529fea'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.create_index('ix_users_name_trgm', 'users', ['name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.create_index('ix_users_username_trgm', 'users', ['username'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'username': 'gin_trgm_ops'})
+    op.create_index('ix_schools_name_trgm', 'schools', ['name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+
+
+def downgrade():
+    op.drop_index('ix_schools_name_trgm', table_name='schools')
+    op.drop_index('ix_users_username_trgm', table_name='users')
+    op.drop_index('ix_users_name_trgm', table_name='users')
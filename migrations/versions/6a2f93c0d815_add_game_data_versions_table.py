@@ -0,0 +1,37 @@
+"""add game data versions table
+
+Revision ID: 6a2f93c0d815
+Revises: 1d6e0b8f4a27
+Create Date: 2026-10-19 16:03:41.118302
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '6a2f93c0d815'
+down_revision = '1d6e0b8f4a27'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('game_data_versions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('game_data_id', sa.Integer(), nullable=True),
+    sa.Column('content_hash', sa.String(length=64), nullable=True),
+    sa.Column('size', sa.Integer(), nullable=True),
+    sa.Column('created', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['game_data_id'], ['game_data.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('game_data_id', 'content_hash')
+    )
+    op.create_index(op.f('ix_game_data_versions_game_data_id'), 'game_data_versions', ['game_data_id'], unique=False)
+    # The current versions are already stored under their hash.
+    op.execute('INSERT INTO game_data_versions (game_data_id, content_hash, size, created) '
+               'SELECT id, content_hash, size, created FROM game_data '
+               'WHERE content_hash IS NOT NULL')
+
+
+def downgrade():
+    op.drop_index(op.f('ix_game_data_versions_game_data_id'), table_name='game_data_versions')
+    op.drop_table('game_data_versions')
@@ -0,0 +1,24 @@
+"""cover scores by user and game
+
+Revision ID: 8d3e5a71c2f4
+Revises: 4b1f0c2d9e7a
+Create Date: 2026-10-19 11:48:05.402117
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8d3e5a71c2f4'
+down_revision = '4b1f0c2d9e7a'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index('idx_user_game_score', 'scores', ['user_id', 'game', 'score'], unique=False)
+    op.drop_index('idx_user_game', table_name='scores')
+
+
+def downgrade():
+    op.create_index('idx_user_game', 'scores', ['user_id', 'game'], unique=False)
+    op.drop_index('idx_user_game_score', table_name='scores')
@@ -0,0 +1,36 @@
+"""add school member counts
+
+Revision ID: c51e8a2b7d90
+Revises: 8d3e5a71c2f4
+Create Date: 2026-10-19 12:20:37.551908
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'c51e8a2b7d90'
+down_revision = '8d3e5a71c2f4'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+COUNT_MEMBERS = """(SELECT count(*) FROM users_schools
+    JOIN users ON users.id = users_schools.user_id
+    JOIN roles ON roles.id = users.role_id
+    WHERE users_schools.school_id = schools.id AND roles.name = '{}')"""
+
+
+def upgrade():
+    op.add_column('schools', sa.Column('teacher_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('schools', sa.Column('student_count', sa.Integer(), server_default='0', nullable=False))
+    op.execute('UPDATE schools SET teacher_count = {}, student_count = {}'.format(
+        COUNT_MEMBERS.format('Teacher'), COUNT_MEMBERS.format('Student')))
+    op.create_index(op.f('ix_schools_teacher_count'), 'schools', ['teacher_count'], unique=False)
+    op.create_index(op.f('ix_schools_student_count'), 'schools', ['student_count'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_schools_student_count'), table_name='schools')
+    op.drop_index(op.f('ix_schools_teacher_count'), table_name='schools')
+    op.drop_column('schools', 'student_count')
+    op.drop_column('schools', 'teacher_count')
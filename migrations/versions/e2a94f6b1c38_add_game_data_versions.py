@@ -0,0 +1,26 @@
+"""add game data versions
+
+Revision ID: e2a94f6b1c38
+Revises: c51e8a2b7d90
+Create Date: 2026-10-19 13:05:12.730441
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e2a94f6b1c38'
+down_revision = 'c51e8a2b7d90'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('game_data', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.add_column('game_data', sa.Column('size', sa.Integer(), nullable=True))
+    op.add_column('game_data', sa.Column('encodings', sa.String(length=32), nullable=True))
+
+
+def downgrade():
+    op.drop_column('game_data', 'encodings')
+    op.drop_column('game_data', 'size')
+    op.drop_column('game_data', 'content_hash')
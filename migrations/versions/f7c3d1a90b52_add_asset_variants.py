@@ -0,0 +1,39 @@
+"""add asset variants
+
+Revision ID: f7c3d1a90b52
+Revises: e2a94f6b1c38
+Create Date: 2026-10-19 13:58:44.209315
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'f7c3d1a90b52'
+down_revision = 'e2a94f6b1c38'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('assets', sa.Column('size', sa.Integer(), nullable=True))
+    op.add_column('assets', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.create_table('asset_variants',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('asset_id', sa.Integer(), nullable=True),
+    sa.Column('kind', sa.String(length=32), nullable=True),
+    sa.Column('content_type', sa.String(length=64), nullable=True),
+    sa.Column('encoding', sa.String(length=16), nullable=True),
+    sa.Column('size', sa.Integer(), nullable=True),
+    sa.Column('content_hash', sa.String(length=64), nullable=True),
+    sa.Column('key', sa.String(length=255), nullable=True),
+    sa.ForeignKeyConstraint(['asset_id'], ['assets.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_asset_variants_asset_id'), 'asset_variants', ['asset_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_asset_variants_asset_id'), table_name='asset_variants')
+    op.drop_table('asset_variants')
+    op.drop_column('assets', 'content_hash')
+    op.drop_column('assets', 'size')
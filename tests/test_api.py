@@ -1,3 +1,5 @@
+import hashlib
+import shutil
 import unittest
 import json
 import re
@@ -6,7 +8,8 @@ from base64 import b64encode
 import datetime
 from flask import url_for
 from app import create_app, db
-from app.models import User, Role, School, Lesson, Score, Screen
+from app.models import User, Role, School, Lesson, Score, Screen, GameData, GameDataUpload
+from app.storage import storage
 
 
 class APITestCase(unittest.TestCase):
@@ -21,6 +24,7 @@ class APITestCase(unittest.TestCase):
     def tearDown(self):
         db.session.remove()
         db.drop_all()
+        shutil.rmtree(self.app.config['STORAGE_LOCAL_PATH'], ignore_errors=True)
         self.app_context.pop()
 
     def get_api_headers(self, username, password):
@@ -169,6 +173,234 @@ class APITestCase(unittest.TestCase):
         self.assertTrue(len(json_response['teachers']) == 1)
         self.assertTrue(json_response['teachers'][0]['username'] == 'teacher')
 
+    def test_add_students_to_school_in_bulk(self):
+        u = User(username='john', password='cat', confirmed=True,
+                 role=Role.get('Administrator'))
+        school = School(name='school')
+        students = [User(username='student{}'.format(i), role=Role.get('Student'))
+                    for i in range(4)]
+        teacher = User(username='teacher', role=Role.get('Teacher'))
+        school.add_student(students[0])
+        db.session.add_all([u, school, teacher] + students)
+        db.session.commit()
+
+        response = self.client.post(
+            url_for('api.add_students_to_school', id=school.id),
+            headers=self.get_api_headers('john', 'cat'),
+            data=json.dumps({
+                'ids': [students[0].id, students[1].id, teacher.id, 12345],
+                'usernames': ['student2', 'student3', 'student1', 'nobody']}))
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(sorted(json_response['added']),
+                         [students[1].id, students[2].id, students[3].id])
+        self.assertEqual(json_response['existing'], [students[0].id])
+        self.assertEqual(json_response['rejected'], [teacher.id, 12345, 'nobody'])
+        self.assertEqual(json_response['school']['student_count'], 4)
+        self.assertEqual(school.students.count(), 4)
+
+        response = self.client.post(
+            url_for('api.add_teachers_to_school', id=school.id),
+            headers=self.get_api_headers('john', 'cat'),
+            data=json.dumps({'ids': 'teacher'}))
+        self.assertEqual(response.status_code, 400)
+
+    def test_game_data_manifest(self):
+        self.app.config['GAME_DATA_BASE_URL'] = 'https://cdn.example.com'
+        db.session.add_all([
+            GameData(file_name='quiz.json', content_hash='abc', size=10,
+                     encodings='br,gzip'),
+            GameData(file_name='rooms.json')])
+        db.session.commit()
+
+        response = self.client.get(url_for('api.get_game_data_manifest'),
+                                   headers=self.get_api_headers('', ''))
+        self.assertEqual(response.status_code, 200)
+        json_response = json.loads(response.data.decode('utf-8'))
+        quiz, rooms = json_response['files']
+        self.assertEqual(quiz['url'], 'https://cdn.example.com/game_data/abc/quiz.json')
+        self.assertEqual(quiz['variants']['gzip'],
+                         'https://cdn.example.com/game_data/abc/quiz.json.gz')
+        self.assertIsNone(rooms['hash'])
+
+        headers = self.get_api_headers('', '')
+        headers['If-None-Match'] = response.headers['ETag']
+        response = self.client.get(url_for('api.get_game_data_manifest'),
+                                   headers=headers)
+        self.assertEqual(response.status_code, 304)
+
+    def test_game_data_compress(self):
+        import gzip
+        content = b'{"questions": []}' * 100
+        variants = GameData.compress(content)
+        self.assertEqual(gzip.decompress(variants['gzip']), content)
+        self.assertEqual(GameData.compress(b'{}'), {})
+
+    def test_game_data_chunked_upload(self):
+        u = User(username='john', password='cat', confirmed=True,
+                 role=Role.get('Administrator'))
+        db.session.add_all([u, GameData(file_name='quiz.json')])
+        db.session.commit()
+        headers = self.get_api_headers('john', 'cat')
+        content = json.dumps({'questions': ['q{}'.format(i) for i in range(10)]}).encode()
+        chunks = [content[i:i + 32] for i in range(0, len(content), 32)]
+
+        def sha256(data):
+            return hashlib.sha256(data).hexdigest()
+
+        response = self.client.post(
+            url_for('api.new_game_data_upload', file_name='quiz.json'),
+            headers=headers,
+            data=json.dumps({'size': len(content), 'hash': sha256(content),
+                             'chunk_size': 32, 'chunks': [sha256(c) for c in chunks]}))
+        self.assertEqual(response.status_code, 201)
+        upload_url = response.headers['Location']
+        upload = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(upload['missing'], list(range(1, len(chunks) + 1)))
+
+        # Chunks can come in any order, and a corrupted one is refused.
+        chunk_url = url_for('api.put_game_data_upload_chunk', id=upload['id'], number=2)
+        response = self.client.put(chunk_url, headers=headers, data=chunks[0])
+        self.assertEqual(response.status_code, 400)
+        for number in range(len(chunks), 1, -1):
+            response = self.client.put(
+                url_for('api.put_game_data_upload_chunk', id=upload['id'], number=number),
+                headers=headers, data=chunks[number - 1])
+            self.assertEqual(response.status_code, 200)
+
+        complete_url = url_for('api.complete_game_data_upload', id=upload['id'])
+        response = self.client.post(complete_url, headers=headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(upload_url, headers=headers)
+        self.assertEqual(json.loads(response.data.decode('utf-8'))['missing'], [1])
+
+        self.client.put(url_for('api.put_game_data_upload_chunk', id=upload['id'], number=1),
+                        headers=headers, data=chunks[0])
+        response = self.client.post(complete_url, headers=headers)
+        self.assertEqual(response.status_code, 202)
+        upload = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(upload['state'], 'saved')
+        self.assertEqual(GameData.get('quiz.json').content, content)
+        self.assertEqual(GameData.get('quiz.json').content_hash, sha256(content))
+
+    def test_game_data_upload_of_invalid_json_fails(self):
+        u = User(username='john', password='cat', confirmed=True,
+                 role=Role.get('Administrator'))
+        db.session.add_all([u, GameData(file_name='quiz.json')])
+        db.session.commit()
+        headers = self.get_api_headers('john', 'cat')
+        content = b'{"questions": [}'
+
+        response = self.client.post(
+            url_for('api.new_game_data_upload', file_name='quiz.json'),
+            headers=headers,
+            data=json.dumps({'size': len(content),
+                             'hash': hashlib.sha256(content).hexdigest(),
+                             'chunk_size': 16,
+                             'chunks': [hashlib.sha256(content).hexdigest()]}))
+        upload = json.loads(response.data.decode('utf-8'))
+        self.client.put(url_for('api.put_game_data_upload_chunk', id=upload['id'], number=1),
+                        headers=headers, data=content)
+        response = self.client.post(
+            url_for('api.complete_game_data_upload', id=upload['id']), headers=headers)
+        upload = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(upload['state'], 'failed')
+        self.assertTrue(upload['error'].startswith('Invalid upload'))
+        self.assertIsNone(GameData.get('quiz.json').content_hash)
+
+    def test_delete_game_data_upload(self):
+        u = User(username='john', password='cat', confirmed=True,
+                 role=Role.get('Administrator'))
+        game_data = GameData(file_name='quiz.json')
+        db.session.add_all([u, game_data])
+        db.session.commit()
+        headers = self.get_api_headers('john', 'cat')
+        content = b'{}'
+        response = self.client.post(
+            url_for('api.new_game_data_upload', file_name='quiz.json'),
+            headers=headers,
+            data=json.dumps({'size': len(content),
+                             'hash': hashlib.sha256(content).hexdigest(),
+                             'chunk_size': 16,
+                             'chunks': [hashlib.sha256(content).hexdigest()]}))
+        upload = GameDataUpload.query.get(json.loads(response.data.decode('utf-8'))['id'])
+        delete_url = url_for('api.delete_game_data_upload', id=upload.id)
+
+        # A save job is running on it.
+        upload.state = 'saving'
+        db.session.commit()
+        response = self.client.delete(delete_url, headers=headers)
+        self.assertEqual(response.status_code, 409)
+
+        upload.state = 'uploading'
+        db.session.commit()
+        response = self.client.delete(delete_url, headers=headers)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(GameDataUpload.query.count(), 0)
+
+    def test_game_data_patch(self):
+        from app import json_patch
+        game_data = GameData(file_name='localization.json')
+        old = {'strings': {'hello': 'Hola', 'bye': 'Adeu'},
+               'filler': ['x' * 100] * 20}
+        new = {'strings': {'hello': 'Hola!', 'bye': 'Adeu'},
+               'filler': ['x' * 100] * 20}
+        game_data.content = json.dumps(old)
+        old_hash = game_data.content_hash
+        db.session.add(game_data)
+        db.session.commit()
+        game_data.content = json.dumps(new)
+        db.session.commit()
+        self.assertEqual(game_data.versions.count(), 2)
+
+        url = url_for('api.get_game_data_patch', file_name='localization.json')
+        response = self.client.get(url + '?from=' + old_hash,
+                                   headers=self.get_api_headers('', ''))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['X-Content-Hash'], game_data.content_hash)
+        patch = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(patch, [{'op': 'replace', 'path': '/strings/hello',
+                                  'value': 'Hola!'}])
+        self.assertEqual(json_patch.apply(old, patch), new)
+        self.assertTrue(storage.exists(game_data.patch_key(old_hash)))
+
+        response = self.client.get(url + '?from=unknown',
+                                   headers=self.get_api_headers('', ''))
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.headers['Location'].endswith(game_data.version_key()))
+
+    def test_game_data_bundle(self):
+        import io
+        import tarfile
+        from app.jobs import game_data as game_data_jobs
+        response = self.client.get(url_for('api.get_game_data_bundle'),
+                                   headers=self.get_api_headers('', ''))
+        self.assertEqual(response.status_code, 404)
+
+        quiz = GameData(file_name='quiz.json')
+        rooms = GameData(file_name='rooms.json')
+        db.session.add_all([quiz, rooms])
+        db.session.commit()
+        rooms.content = '{"rooms": []}'
+        game_data_jobs.save_content(quiz.id, '{"questions": []}')
+
+        response = self.client.get(url_for('api.get_game_data_bundle'),
+                                   headers=self.get_api_headers('', ''))
+        self.assertEqual(response.status_code, 302)
+        bundle = GameData.bundle_manifest()
+        self.assertEqual(response.headers['X-Content-Hash'], bundle['hash'])
+        self.assertEqual(bundle['hash'], GameData.bundle_hash([quiz, rooms]))
+        with tarfile.open(fileobj=io.BytesIO(storage.get(
+                GameData.bundle_key(bundle['hash']))[1])) as tar:
+            self.assertEqual(tar.getnames(), ['manifest.json', 'quiz.json', 'rooms.json'])
+            self.assertEqual(tar.extractfile('rooms.json').read(), b'{"rooms": []}')
+            manifest = json.loads(tar.extractfile('manifest.json').read().decode('utf-8'))
+        self.assertEqual([f['hash'] for f in manifest['files']],
+                         [quiz.content_hash, rooms.content_hash])
+
+        # Nothing changed, so the bundle is reused.
+        self.assertEqual(game_data_jobs.build_bundle(), bundle)
+
     def test_users(self):
         # add two users
         r = Role.get('Student')
@@ -0,0 +1,119 @@
+import gzip
+import io
+import json
+import shutil
+import unittest
+
+from PIL import Image
+from werkzeug.datastructures import Accept, MIMEAccept
+
+from app import create_app, db
+from app.jobs import assets as assets_jobs
+from app.models import Role, Asset, AssetVariant
+from app.storage import storage
+
+
+class AssetsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.app.config['STORAGE_LOCAL_PATH'], ignore_errors=True)
+
+    def file_names(self):
+        return sorted(file_name for file_name, in db.session.query(Asset.file_name))
+
+    def test_sync_assets(self):
+        for file_name in ('a.png', 'b.png', 'c.mp3'):
+            storage.put('assets/' + file_name, b'data')
+        storage.put('game_data/quiz.json', b'{}')
+        db.session.add_all([Asset(file_name='a.png'), Asset(file_name='a.png'),
+                            Asset(file_name='gone.png')])
+        db.session.commit()
+
+        result = assets_jobs.sync_assets(batch_size=1)
+        self.assertEqual(result, {'listed': 3, 'added': 2, 'removed': 2})
+        self.assertEqual(self.file_names(), ['a.png', 'b.png', 'c.mp3'])
+        self.assertEqual(Asset.query.filter_by(file_name='c.mp3').one().file_type,
+                         'audio/mpeg')
+        # Added assets are processed, which JOBS_SYNC does inline.
+        for asset in Asset.query.filter(Asset.file_name.in_(['b.png', 'c.mp3'])):
+            self.assertEqual(asset.size, 4)
+            self.assertIsNotNone(asset.content_hash)
+
+    def test_delete_assets(self):
+        assets = [Asset(file_name=file_name) for file_name in ('a.png', 'b.png', 'c.png')]
+        for asset in assets:
+            storage.put(asset.key, b'data')
+        db.session.add_all(assets)
+        db.session.commit()
+
+        result = assets_jobs.delete_assets([assets[0].id, assets[2].id], batch_size=1)
+        self.assertEqual(result, {'deleted': 2, 'failed': []})
+        self.assertEqual(self.file_names(), ['b.png'])
+        self.assertEqual([key for key, _, _ in storage.list('assets/')],
+                         ['assets/b.png'])
+
+    def test_process_json_asset(self):
+        content = json.dumps({'rooms': [{'name': 'lab', 'items': []}] * 50},
+                             indent=4).encode('utf-8')
+        asset = Asset(file_name='rooms.json', file_type='application/json')
+        storage.put(asset.key, content)
+        db.session.add(asset)
+        db.session.commit()
+
+        result = assets_jobs.process_asset(asset.id)
+        self.assertEqual(result, {'size': len(content),
+                                  'variants': ['minified', 'gzip']})
+        minified, gzipped = asset.variants
+        self.assertEqual(json.loads(storage.get(minified.key)[1].decode('utf-8')),
+                         json.loads(content.decode('utf-8')))
+        self.assertEqual(gzip.decompress(storage.get(gzipped.key)[1]),
+                         storage.get(minified.key)[1])
+
+        json_only = MIMEAccept([('application/json', 1)])
+        self.assertEqual(asset.best_variant(json_only, Accept([('gzip', 1)])), gzipped)
+        self.assertEqual(asset.best_variant(json_only, Accept()), minified)
+        self.assertIsNone(asset.best_variant(json_only, Accept(), thumbnail=True))
+
+        assets_jobs.delete_assets([asset.id])
+        self.assertEqual(list(storage.list('')), [])
+        self.assertEqual(AssetVariant.query.count(), 0)
+
+    def test_process_image_asset(self):
+        out = io.BytesIO()
+        Image.new('RGB', (600, 400), (200, 30, 30)).save(out, 'PNG')
+        content = out.getvalue()
+        asset = Asset(file_name='lab.png', file_type='image/png')
+        storage.put(asset.key, content)
+        db.session.add(asset)
+        db.session.commit()
+
+        result = assets_jobs.process_asset(asset.id)
+        self.assertEqual(result, {'size': len(content),
+                                  'variants': ['webp', 'thumbnail']})
+        webp, thumbnail = asset.variants
+        self.assertEqual(Image.open(io.BytesIO(storage.get(webp.key)[1])).size,
+                         (600, 400))
+        self.assertEqual(max(Image.open(io.BytesIO(storage.get(thumbnail.key)[1])).size),
+                         self.app.config['ASSET_THUMBNAIL_SIZE'])
+
+        accept = MIMEAccept([('image/webp', 1), ('image/png', 1)])
+        self.assertEqual(asset.best_variant(accept, Accept()), webp)
+        self.assertEqual(asset.best_variant(accept, Accept(), thumbnail=True), thumbnail)
+        self.assertIsNone(asset.best_variant(MIMEAccept([('image/png', 1)]), Accept()))
+
+    def test_process_unreadable_image(self):
+        asset = Asset(file_name='broken.png', file_type='image/png')
+        storage.put(asset.key, b'data')
+        db.session.add(asset)
+        db.session.commit()
+        self.assertEqual(assets_jobs.process_asset(asset.id),
+                         {'size': 4, 'variants': []})
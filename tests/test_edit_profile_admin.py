@@ -1,3 +1,4 @@
+import json
 import re
 import unittest
 
@@ -70,3 +71,61 @@ class EditProfileAdminTestCase(unittest.TestCase):
         self.assertTrue(re.search(b'user2', response.data))
         self.assertTrue(re.search(b'Edit Profile', response.data))
 
+
+    def test_search_teachers(self):
+        self.client.post(url_for('auth.login'), data={
+            'username': 'foo',
+            'password': 'bar'
+        })
+        t1 = User(username='maria', name='Maria Garcia', password='bar')
+        t1.role = Role.get('Teacher')
+        t2 = User(username='john', name='John Smith', password='bar')
+        t2.role = Role.get('Teacher')
+        student = User(username='garcia', name='Pedro Garcia', password='bar')
+        db.session.add_all([t1, t2, student])
+        db.session.commit()
+
+        response = self.client.get(url_for('main.search_teachers', q='garc'))
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.data.decode('utf-8'))['results']
+        self.assertEqual(results, [{'id': t1.id, 'text': 'Maria Garcia'}])
+
+        response = self.client.get(url_for('main.search_teachers', q='%'))
+        results = json.loads(response.data.decode('utf-8'))['results']
+        self.assertEqual(results, [])
+
+    def test_edit_student_teacher(self):
+        self.client.post(url_for('auth.login'), data={
+            'username': 'foo',
+            'password': 'bar'
+        })
+        teacher = User(username='maria', password='bar', role=Role.get('Teacher'))
+        student = User(username='pedro', password='bar', role=Role.get('Student'))
+        db.session.add_all([teacher, student])
+        db.session.commit()
+        data = {
+            'username': student.username,
+            'confirmed': True,
+            'enabled': True,
+            'role': student.role_id,
+        }
+
+        response = self.client.post(url_for('main.edit_profile_admin', id=student.id),
+                                    data=data)
+        self.assertEqual(response.status_code, 302)
+        self.assertIsNone(student.teacher)
+
+        response = self.client.post(url_for('main.edit_profile_admin', id=student.id),
+                                    data=dict(data, teacher=teacher.id))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(student.teacher, teacher)
+
+        response = self.client.post(url_for('main.edit_profile_admin', id=student.id),
+                                    data=dict(data, teacher=''))
+        self.assertEqual(response.status_code, 302)
+        self.assertIsNone(student.teacher)
+
+        response = self.client.post(url_for('main.edit_profile_admin', id=student.id),
+                                    data=dict(data, teacher=student.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Unknown teacher.', response.data)
@@ -0,0 +1,118 @@
+import smtplib
+import tempfile
+import unittest
+from unittest import mock
+
+from flask_mail import Message
+
+from app import create_app, mail
+from app.email import send_email, mail_dispatcher
+
+
+class EmailTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        self.app_context.pop()
+
+    def test_memory_sink(self):
+        self.assertTrue(send_email('admin@example.com', 'New iOS user created',
+                                   'mail/new_ios_user', username='abc123'))
+        self.assertEqual(len(mail_dispatcher.outbox), 1)
+        msg = mail_dispatcher.outbox[0]
+        self.assertEqual(msg.recipients, ['admin@example.com'])
+        self.assertIn('abc123', msg.body)
+        self.assertFalse(mail_dispatcher.workers)
+
+
+class FakeConnection(object):
+    def __init__(self, sent, refused):
+        self.sent = sent
+        self.refused = refused
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def send(self, msg):
+        if msg.recipients[0] in self.refused:
+            raise smtplib.SMTPRecipientsRefused({msg.recipients[0]: (550, b'No such user')})
+        self.sent.append(msg)
+
+
+class MailDispatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app.config['MAIL_SINK'] = 'smtp'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.sent = []
+        self.connections = 0
+
+    def tearDown(self):
+        self.app_context.pop()
+
+    def connect(self, refused=()):
+        def connect():
+            self.connections += 1
+            return FakeConnection(self.sent, refused)
+        return mock.patch.object(mail, 'connect', side_effect=connect)
+
+    def message(self, to):
+        return Message('Hello', sender='admin@example.com', recipients=[to])
+
+    def test_worker_pool(self):
+        with self.connect():
+            for i in range(5):
+                self.assertTrue(send_email('user{}@example.com'.format(i), 'Hello',
+                                           'mail/new_ios_user', username='abc123'))
+            mail_dispatcher.flush()
+        self.assertEqual(len(mail_dispatcher.workers), self.app.config['MAIL_WORKERS'])
+        self.assertEqual(sorted(msg.recipients[0] for msg in self.sent),
+                         ['user{}@example.com'.format(i) for i in range(5)])
+
+    def test_batches(self):
+        self.app.config['MAIL_BATCH_SIZE'] = 2
+        for i in range(3):
+            mail_dispatcher.queue.put(self.message('user{}@example.com'.format(i)))
+        self.assertEqual(len(mail_dispatcher._next_batch(mail_dispatcher.queue)), 2)
+        self.assertEqual(len(mail_dispatcher._next_batch(mail_dispatcher.queue)), 1)
+
+        with self.connect():
+            mail_dispatcher._send_batch([self.message('a@example.com'),
+                                         self.message('b@example.com')])
+        self.assertEqual(len(self.sent), 2)
+        self.assertEqual(self.connections, 1)
+
+    def test_failed_message_keeps_rest_of_batch(self):
+        with self.connect(refused=('bad@example.com',)):
+            mail_dispatcher._send_batch([self.message('a@example.com'),
+                                         self.message('bad@example.com'),
+                                         self.message('b@example.com')])
+        self.assertEqual([msg.recipients[0] for msg in self.sent],
+                         ['a@example.com', 'b@example.com'])
+        self.assertEqual(self.connections, 2)
+
+    def test_queue_full(self):
+        self.app.config['MAIL_QUEUE_SIZE'] = 1
+        self.app.config['MAIL_QUEUE_TIMEOUT'] = 0.01
+        mail_dispatcher.init_app(self.app)
+        with mock.patch.object(mail_dispatcher, '_start_workers'):
+            self.assertTrue(mail_dispatcher.submit(self.message('a@example.com')))
+            self.assertFalse(mail_dispatcher.submit(self.message('b@example.com')))
+
+    def test_file_sink(self):
+        self.app.config['MAIL_SINK'] = 'file'
+        self.app.config['MAIL_SINK_PATH'] = None
+        with self.assertRaises(ValueError):
+            mail_dispatcher.init_app(self.app)
+        with tempfile.NamedTemporaryFile('r') as f:
+            self.app.config['MAIL_SINK_PATH'] = f.name
+            mail_dispatcher.init_app(self.app)
+            self.assertTrue(mail_dispatcher.submit(self.message('a@example.com')))
+            self.assertIn('a@example.com', f.read())
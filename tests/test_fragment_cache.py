@@ -0,0 +1,49 @@
+import unittest
+
+from app import create_app, db
+from app.models import User, Role, School, Score
+
+
+class FragmentCacheVersionsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def flush_versions(self):
+        db.session.flush()
+        return db.session.info.pop('fragment_versions', set())
+
+    def test_writes_collect_versions(self):
+        u = User(username='john', password='cat', role=Role.get('Student'))
+        s = School(name='school')
+        s.add_student(u)
+        db.session.add_all([u, s])
+        self.assertEqual(self.flush_versions(), {
+            'users:{}'.format(u.id), 'schools:{}'.format(s.id), 'schools'})
+
+        db.session.add(Score(user_id=u.id, game='game', state='finished', score=1))
+        self.assertEqual(self.flush_versions(), {'users:{}'.format(u.id)})
+
+        u.name = 'John'
+        self.assertEqual(self.flush_versions(), {
+            'users:{}'.format(u.id), 'schools:{}'.format(s.id)})
+
+        # A role change moves the user to another member count.
+        u.role = Role.get('Teacher')
+        self.assertEqual(self.flush_versions(), {
+            'users:{}'.format(u.id), 'schools:{}'.format(s.id), 'schools'})
+
+    def test_ping_does_not_collect_versions(self):
+        u = User(username='john', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        u.ping()
+        self.assertEqual(self.flush_versions(), set())
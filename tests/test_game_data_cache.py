@@ -0,0 +1,68 @@
+import shutil
+import tempfile
+import unittest
+
+from app import create_app
+from app.game_data_cache import game_data_cache
+
+
+class GameDataCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.app = create_app('testing')
+        self.app.config['GAME_DATA_CACHE_DIR'] = self.directory
+        self.app.config['GAME_DATA_CACHE_MAX_BYTES'] = 10
+        game_data_cache.init_app(self.app)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.loads = []
+
+    def tearDown(self):
+        self.app_context.pop()
+        shutil.rmtree(self.directory)
+
+    def loader(self, etag, body):
+        def load(cached_etag):
+            self.loads.append(cached_etag)
+            if cached_etag == etag:
+                return None
+            return etag, body
+        return load
+
+    def test_reads_are_served_from_memory(self):
+        load = self.loader('"1"', b'abc')
+        self.assertEqual(game_data_cache.get('quiz.json', load), b'abc')
+        self.assertEqual(game_data_cache.get('quiz.json', load), b'abc')
+        self.assertEqual(self.loads, [None])
+
+    def test_stale_entries_are_revalidated(self):
+        game_data_cache.get('quiz.json', self.loader('"1"', b'abc'))
+        self.app.extensions['game_data_cache'].ttl = 0
+        self.assertEqual(
+            game_data_cache.get('quiz.json', self.loader('"1"', b'xyz')), b'abc')
+        self.assertEqual(
+            game_data_cache.get('quiz.json', self.loader('"2"', b'xyz')), b'xyz')
+        self.assertEqual(self.loads, [None, '"1"', '"1"'])
+
+    def test_disk_copy_is_revalidated(self):
+        game_data_cache.get('quiz.json', self.loader('"1"', b'abc'))
+        game_data_cache.clear()
+        self.assertEqual(
+            game_data_cache.get('quiz.json', self.loader('"1"', b'xyz')), b'abc')
+        self.assertEqual(self.loads, [None, '"1"'])
+
+    def test_memory_is_bounded_by_bytes(self):
+        game_data_cache.get('a.json', self.loader('"a"', b'aaaaaa'))
+        game_data_cache.get('b.json', self.loader('"b"', b'bbbbbb'))
+        state = self.app.extensions['game_data_cache']
+        self.assertEqual(list(state.entries), ['b.json'])
+        self.assertEqual(state.size, 6)
+
+    def test_put_and_invalidate(self):
+        game_data_cache.put('quiz.json', '"2"', b'new')
+        self.assertEqual(
+            game_data_cache.get('quiz.json', self.loader('"1"', b'old')), b'new')
+        game_data_cache.invalidate('quiz.json')
+        self.assertEqual(
+            game_data_cache.get('quiz.json', self.loader('"1"', b'old')), b'old')
+        self.assertEqual(self.loads, [None])
@@ -0,0 +1,130 @@
+import json
+import re
+import shutil
+import unittest
+from unittest import mock
+
+from flask import url_for
+from rq.job import Job
+
+from app import db, create_app, redis_store
+from app.jobs import job_to_json
+from app.models import User, Role
+from app.storage import storage
+
+
+def game_stats():
+    pass
+
+
+class JobViewsTestCase(unittest.TestCase):
+    """Job pages and their status must only be shown to the user who
+    started the job, or to an administrator."""
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client(use_cookies=True)
+        for username, role in (('owner', 'Teacher'), ('other', 'Teacher'),
+                               ('admin', 'Administrator')):
+            u = User(username=username, password='cat', role=Role.get(role))
+            u.confirmed = True
+            db.session.add(u)
+        db.session.commit()
+        self.owner = User.query.filter_by(username='owner').first()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.app.config['STORAGE_LOCAL_PATH'], ignore_errors=True)
+
+    def login(self, username):
+        self.client.post(url_for('auth.login'), data={
+            'username': username,
+            'password': 'cat'
+        })
+
+    def make_job(self, status, progress=None, result=None, exc_info=None):
+        # Built in memory: nothing here reads from or writes to Redis.
+        job = Job.create(game_stats, connection=redis_store,
+                         description='Game stats')
+        job.meta = {'user_id': self.owner.id, 'progress': progress}
+        job._status = status
+        job._result = result
+        job.exc_info = exc_info
+        return job
+
+    def get(self, job, endpoint):
+        with mock.patch('app.jobs.fetch', return_value=job), \
+                mock.patch.object(Job, 'get_status', return_value=job._status):
+            return self.client.get(url_for(endpoint, id=job.id))
+
+    def test_job_to_json(self):
+        job = self.make_job('started', progress=[3, 10])
+        with mock.patch.object(Job, 'get_status', return_value='started'):
+            json_job = job_to_json(job)
+        self.assertEqual(json_job['id'], job.id)
+        self.assertEqual(json_job['description'], 'Game stats')
+        self.assertEqual(json_job['status'], 'started')
+        self.assertEqual(json_job['progress'], [3, 10])
+        self.assertNotIn('result', json_job)
+        self.assertNotIn('error', json_job)
+
+        job = self.make_job('finished', result={'games': ['memory']})
+        with mock.patch.object(Job, 'get_status', return_value='finished'):
+            self.assertEqual(job_to_json(job)['result'], {'games': ['memory']})
+
+        job = self.make_job('failed', exc_info='Traceback:\n  ...\nValueError: bad\n')
+        with mock.patch.object(Job, 'get_status', return_value='failed'):
+            self.assertEqual(job_to_json(job)['error'], 'ValueError: bad')
+
+    def test_owner(self):
+        self.login('owner')
+        job = self.make_job('started', progress=[3, 10])
+        response = self.get(job, 'main.job')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'width: 30%;', response.data)
+
+        response = self.get(job, 'main.job_status')
+        self.assertEqual(response.status_code, 200)
+        json_job = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(json_job['status'], 'started')
+        self.assertEqual(json_job['progress'], [3, 10])
+
+    def test_other_teacher(self):
+        self.login('other')
+        job = self.make_job('started')
+        self.assertEqual(self.get(job, 'main.job').status_code, 403)
+        self.assertEqual(self.get(job, 'main.job_status').status_code, 403)
+
+    def test_admin(self):
+        self.login('admin')
+        job = self.make_job('finished', result={'games': ['memory']})
+        response = self.get(job, 'main.job')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'memory', response.data)
+        self.assertEqual(self.get(job, 'main.job_status').status_code, 200)
+
+    def test_unknown_job(self):
+        self.login('owner')
+        with mock.patch('app.jobs.fetch', return_value=None):
+            self.assertEqual(self.client.get(
+                url_for('main.job', id='unknown')).status_code, 404)
+            self.assertEqual(self.client.get(
+                url_for('main.job_status', id='unknown')).status_code, 404)
+
+    def test_user_stats(self):
+        student = User(username='student', password='cat', role=Role.get('Student'),
+                       teacher=self.owner)
+        db.session.add(student)
+        db.session.commit()
+        self.login('owner')
+        response = self.client.get(url_for('main.user_stats'))
+        self.assertEqual(response.status_code, 200)
+        key = re.search(r'/(jobs/\w+\.csv)"', response.data.decode('utf-8')).group(1)
+        with storage.open(key) as f:
+            self.assertIn(b'student', f.read())
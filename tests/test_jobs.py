@@ -0,0 +1,25 @@
+import unittest
+from unittest import mock
+
+from flask import current_app, has_app_context
+from rq import Worker
+
+from app import create_app
+from app.jobs import work
+
+
+class WorkerTestCase(unittest.TestCase):
+    def test_jobs_run_in_app_context(self):
+        app = create_app('testing')
+        seen = []
+
+        def perform_job(worker, job, queue):
+            seen.append(current_app._get_current_object())
+
+        with mock.patch.object(Worker, 'perform_job', perform_job), \
+                mock.patch.object(Worker, 'work',
+                                  lambda worker: worker.perform_job(None, None)):
+            self.assertFalse(has_app_context())
+            work(app)
+        self.assertEqual(seen, [app])
+        self.assertFalse(has_app_context())
@@ -0,0 +1,35 @@
+import unittest
+
+from app import json_patch
+
+
+class JSONPatchTestCase(unittest.TestCase):
+    def test_diff_and_apply(self):
+        old = {'greeting': {'en': 'Hi', 'es': 'Hola'}, 'lessons': [1, 2, 3],
+               'a/b': 1}
+        new = {'greeting': {'en': 'Hello', 'ca': 'Hola'}, 'lessons': [1, 4],
+               'a/b': 1.0}
+        patch = json_patch.diff(old, new)
+        self.assertIn({'op': 'replace', 'path': '/greeting/en', 'value': 'Hello'},
+                      patch)
+        self.assertIn({'op': 'remove', 'path': '/greeting/es'}, patch)
+        self.assertIn({'op': 'replace', 'path': '/a~1b', 'value': 1.0}, patch)
+        patched = json_patch.apply(old, patch)
+        self.assertEqual(patched, new)
+        self.assertIsInstance(patched['a/b'], float)
+        self.assertEqual(old['lessons'], [1, 2, 3])
+
+    def test_appended_items(self):
+        patch = json_patch.diff([1], [1, 2, 3])
+        self.assertEqual(patch, [{'op': 'add', 'path': '/-', 'value': 2},
+                                 {'op': 'add', 'path': '/-', 'value': 3}])
+        self.assertEqual(json_patch.diff({'a': []}, {'a': []}), [])
+        self.assertEqual(json_patch.apply({'a': 1}, json_patch.diff({'a': 1}, [2])), [2])
+
+    def test_nested_type_changes(self):
+        self.assertEqual(json_patch.diff({'a': {'b': 1}}, {'a': {'b': 1.0}}),
+                         [{'op': 'replace', 'path': '/a/b', 'value': 1.0}])
+        self.assertEqual(json_patch.diff([[True]], [[1]]),
+                         [{'op': 'replace', 'path': '/0/0', 'value': 1}])
+        patched = json_patch.apply([[True]], json_patch.diff([[True]], [[1]]))
+        self.assertIs(type(patched[0][0]), int)
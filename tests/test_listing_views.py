@@ -0,0 +1,71 @@
+import unittest
+
+from flask import url_for
+from flask_sqlalchemy import get_debug_queries
+
+from app import db, create_app
+from app.models import User, Role, School, Score
+
+
+class ListingViewsTestCase(unittest.TestCase):
+    """Listing pages must issue the same number of queries whatever the
+    number of rows they render."""
+
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client(use_cookies=True)
+        u = User(username='foo', password='bar')
+        u.confirmed = True
+        u.role = Role.get('Administrator')
+        db.session.add(u)
+        db.session.commit()
+        self.client.post(url_for('auth.login'), data={
+            'username': 'foo',
+            'password': 'bar'
+        })
+        self.rows = 0
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def add_rows(self, count):
+        teacher = Role.get('Teacher')
+        for i in range(self.rows, self.rows + count):
+            u = User(username='user{}'.format(i), password='cat')
+            if i % 2:
+                u.role = teacher
+            db.session.add(u)
+            db.session.add(School(name='school{}'.format(i)))
+            db.session.flush()
+            db.session.add(Score(user_id=u.id, game='game', state='finished', score=i))
+        db.session.commit()
+        db.session.expire_all()
+        self.rows += count
+
+    def count_queries(self, url):
+        before = len(get_debug_queries())
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(get_debug_queries()) - before
+
+    def assertConstantQueries(self, endpoint):
+        self.add_rows(2)
+        few = self.count_queries(url_for(endpoint))
+        self.add_rows(20)
+        many = self.count_queries(url_for(endpoint))
+        self.assertEqual(few, many)
+
+    def test_scores(self):
+        self.assertConstantQueries('main.scores')
+
+    def test_users(self):
+        self.assertConstantQueries('main.users')
+
+    def test_schools(self):
+        self.assertConstantQueries('main.schools')
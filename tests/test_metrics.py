@@ -0,0 +1,87 @@
+import shutil
+import threading
+import unittest
+from unittest import mock
+
+from flask import url_for
+from app import create_app, db
+from app.metrics import metrics
+from app.models import Role, School
+from app.storage import storage
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.app.config['STORAGE_LOCAL_PATH'], ignore_errors=True)
+
+    def get_metrics(self):
+        response = self.client.get(url_for('metrics'))
+        self.assertEqual(response.status_code, 200)
+        return response.get_data(as_text=True)
+
+    def test_request_metrics(self):
+        db.session.add(School(name='school'))
+        db.session.commit()
+        self.client.get(url_for('api.get_schools'))
+        self.client.get(url_for('api.get_schools'))
+        self.client.get('/no-such-page')
+
+        metrics = self.get_metrics()
+        self.assertIn('backend_http_request_duration_seconds_count'
+                      '{endpoint="api.get_schools",method="GET",status="200"} 2',
+                      metrics)
+        self.assertIn('backend_http_request_duration_seconds_bucket'
+                      '{endpoint="api.get_schools",method="GET",status="200",le="+Inf"} 2',
+                      metrics)
+        self.assertIn('backend_http_request_duration_seconds_count'
+                      '{endpoint="none",method="GET",status="404"} 1', metrics)
+        queries = [line for line in metrics.splitlines()
+                   if line.startswith('backend_db_queries_total{endpoint="api.get_schools"}')]
+        self.assertEqual(len(queries), 1)
+        self.assertGreater(int(queries[0].split()[1]), 0)
+
+    def test_storage_metrics(self):
+        storage.put('assets/a.png', b'png')
+        storage.get('assets/a.png')
+        self.assertIn('backend_external_call_duration_seconds_count'
+                      '{service="storage",operation="put"} 1', self.get_metrics())
+
+    def test_token(self):
+        self.app.extensions['metrics'].token = 'secret'
+        response = self.client.get(url_for('metrics'))
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(url_for('metrics'),
+                                   headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_idle_worker_keeps_flushing(self):
+        state = self.app.extensions['metrics']
+        state.flush_interval = 0.01
+        flushes = []
+        two_flushes = threading.Event()
+
+        def flush():
+            flushes.append(1)
+            if len(flushes) == 2:
+                two_flushes.set()
+
+        with mock.patch.object(metrics, 'flush', side_effect=flush):
+            self.client.get(url_for('api.get_schools'))
+            flusher = state.flusher
+            # No more requests come, but the worker's numbers are still
+            # copied to Redis.
+            self.assertTrue(two_flushes.wait(5))
+            state.flusher = None
+            flusher.join(5)
+        self.assertFalse(flusher.is_alive())
@@ -0,0 +1,54 @@
+import unittest
+from unittest import mock
+
+from app import create_app, db
+from app.models import School
+from app.pagination import paginate
+
+
+class PaginationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        for i in range(5):
+            db.session.add(School(name='school{}'.format(i)))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_first_page(self):
+        pagination = paginate(School.query.order_by(School.name), 1, 2)
+        self.assertEqual([s.name for s in pagination.items], ['school0', 'school1'])
+        self.assertTrue(pagination.has_next)
+        self.assertFalse(pagination.has_prev)
+        self.assertEqual(pagination.total, 5)
+        self.assertFalse(pagination.approximate)
+
+    def test_last_page(self):
+        pagination = paginate(School.query.order_by(School.name), 3, 2)
+        self.assertEqual([s.name for s in pagination.items], ['school4'])
+        self.assertFalse(pagination.has_next)
+        self.assertEqual(pagination.total, 5)
+        self.assertEqual(pagination.pages, 3)
+
+    def test_page_past_the_end(self):
+        pagination = paginate(School.query, 10, 2)
+        self.assertEqual(pagination.items, [])
+        self.assertFalse(pagination.has_next)
+        self.assertEqual(pagination.total, 5)
+
+    def test_estimated_total(self):
+        self.app.config['BACKEND_EXACT_COUNT_THRESHOLD'] = 3
+        with mock.patch('app.pagination.estimate_count', return_value=1000):
+            pagination = paginate(School.query.order_by(School.name), 1, 2)
+            self.assertEqual(pagination.total, 1000)
+            self.assertTrue(pagination.approximate)
+
+            pagination = paginate(School.query.order_by(School.name), 3, 2)
+            self.assertEqual(pagination.total, 5)
+            self.assertFalse(pagination.approximate)
@@ -0,0 +1,60 @@
+import os
+import pstats
+import shutil
+import threading
+import time
+import unittest
+
+from flask import url_for
+from app import create_app, db
+from app.models import Role
+from app.profiler import _Sampler
+
+
+class ProfilerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+        self.client = self.app.test_client()
+        self.state = self.app.extensions['profiler']
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.app.config['PROFILER_DIR'], ignore_errors=True)
+
+    def profile(self, **settings):
+        self.state.defaults = dict(self.state.defaults, **settings)
+        self.state.checked = 0
+
+    def test_profile_endpoint(self):
+        self.profile(endpoints=['main.index'], mode='cprofile')
+        self.client.get(url_for('api.get_schools'))
+        self.assertFalse(os.path.isdir(self.state.directory))
+
+        self.client.get(url_for('main.index'))
+        files = os.listdir(self.state.directory)
+        self.assertEqual(len(files), 1)
+        self.assertTrue(files[0].startswith('main.index.GET.'))
+        self.assertTrue(files[0].endswith('.prof'))
+        pstats.Stats(os.path.join(self.state.directory, files[0]))
+
+    def test_profiling_off(self):
+        self.profile(sample_rate=0, endpoints=[])
+        self.client.get(url_for('main.index'))
+        self.assertFalse(os.path.isdir(self.state.directory))
+
+    def test_sampler(self):
+        sampler = _Sampler(0.001)
+        sampler.start()
+        sampler.add(threading.get_ident())
+        deadline = time.time() + 0.1
+        while time.time() < deadline:
+            pass
+        stacks = sampler.remove(threading.get_ident())
+        self.assertGreater(sum(stacks.values()), 0)
+        self.assertTrue(any('test_sampler' in stack for stack in stacks))
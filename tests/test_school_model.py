@@ -1,7 +1,9 @@
 import unittest
+from unittest import mock
 
 from app import create_app, db
 from app.exceptions import ValidationError
+from app.fragment_cache import fragment_cache
 from app.models import School, User, Role
 
 
@@ -72,3 +74,49 @@ class SchoolModelTestCase(unittest.TestCase):
         db.session.add(s)
         db.session.commit()
         self.assertListEqual([u1, u2], s.students.all())
+
+    def test_member_counts(self):
+        s1 = School(name='s1')
+        s2 = School(name='s2')
+        teacher = User(username='teacher', role=Role.get('Teacher'))
+        student = User(username='student', role=Role.get('Student'))
+        s1.add_teacher(teacher)
+        s1.add_student(student)
+        db.session.add_all([s1, s2])
+        db.session.commit()
+        self.assertEqual((s1.teacher_count, s1.student_count), (1, 1))
+
+        s2.add_student(User(username='other', role=Role.get('Student')))
+        s2.add_student(User(username='another', role=Role.get('Student')))
+        db.session.commit()
+        self.assertEqual((s2.teacher_count, s2.student_count), (0, 2))
+
+        student.add_to_schools([s2.id])
+        db.session.commit()
+        self.assertEqual(s1.student_count, 0)
+        self.assertEqual(s2.student_count, 3)
+
+        student.role = Role.get('Teacher')
+        db.session.commit()
+        self.assertEqual((s2.teacher_count, s2.student_count), (1, 2))
+
+        student.remove_from_school(s2)
+        db.session.commit()
+        self.assertEqual(s2.teacher_count, 0)
+
+        User.delete_users([teacher.id])
+        self.assertEqual(s1.teacher_count, 0)
+        self.assertEqual(School.reconcile_member_counts(), 0)
+
+    def test_reconcile_member_counts(self):
+        s = School(name='s')
+        s.add_student(User(username='student', role=Role.get('Student')))
+        db.session.add(s)
+        db.session.commit()
+        s.student_count = 5
+        s.teacher_count = 2
+        db.session.commit()
+        with mock.patch.object(fragment_cache, 'bump') as bump:
+            self.assertEqual(School.reconcile_member_counts(), 1)
+        self.assertEqual((s.teacher_count, s.student_count), (0, 1))
+        bump.assert_called_once_with('schools:{}'.format(s.id), 'schools')
@@ -21,3 +21,58 @@ class ScoreModelTestCase(unittest.TestCase):
         u = User(email='john@example.com', password='cat')
         s = Score(user_id=u.id, game="test", score=10, max_score=20, duration=2, state="state", is_exam=True)
         self.assertIn('is_exam', s.to_json().keys())
+
+    def test_score_user(self):
+        u = User(email='john@example.com', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        s = Score(user_id=u.id, game="test", score=10, max_score=20, duration=2, state="state")
+        db.session.add(s)
+        db.session.commit()
+        self.assertEqual(s.user, u)
+
+    def add_scores(self):
+        john = User(username='john', password='cat')
+        susan = User(username='susan', password='dog')
+        db.session.add_all([john, susan])
+        db.session.commit()
+        db.session.add_all([
+            Score(user_id=john.id, game='a', score=10, state='finished'),
+            Score(user_id=john.id, game='a', score=30, state='finished'),
+            Score(user_id=john.id, game='b', score=20, state='finished'),
+            Score(user_id=susan.id, game='c', score=50, state='finished')])
+        db.session.commit()
+        return john, susan
+
+    def test_user_score_aggregates(self):
+        john, susan = self.add_scores()
+        mary = User(username='mary', password='cat')
+        db.session.add(mary)
+        db.session.commit()
+        self.assertEqual([tuple(r) for r in john.max_score_by_game],
+                         [('a', 30), ('b', 20)])
+        self.assertEqual([tuple(r) for r in susan.max_score_by_game], [('c', 50)])
+        self.assertEqual(mary.max_score_by_game.all(), [])
+        self.assertTrue(john.have_scores())
+        self.assertFalse(mary.have_scores())
+        self.assertEqual(john.max_score('a'), 30)
+        self.assertIsNone(john.max_score('c'))
+
+    def explain(self, query):
+        compiled = query.statement.compile(dialect=db.engine.dialect)
+        rows = db.session.connection().execute(
+            'EXPLAIN ' + str(compiled), compiled.params)
+        return '\n'.join(row[0] for row in rows)
+
+    def test_user_score_aggregates_use_indexes(self):
+        if db.engine.dialect.name != 'postgresql':
+            self.skipTest('query plans are only checked on PostgreSQL')
+        john, _ = self.add_scores()
+        # The tables are tiny; make sure an index is usable at all.
+        db.session.execute('SET LOCAL enable_seqscan = off')
+        plan = self.explain(john.max_score_by_game)
+        self.assertIn('Index Only Scan using idx_user_game_score', plan)
+        plan = self.explain(db.session.query(
+            Score.query.filter(Score.user_id == john.id).exists()))
+        self.assertIn('Index', plan)
+        self.assertNotIn('Seq Scan', plan)
@@ -0,0 +1,47 @@
+import gzip
+import shutil
+import unittest
+
+from app import create_app, db
+from app.models import Role, GameData
+from app.storage import storage, IMMUTABLE_CACHE_CONTROL
+
+
+class StorageTestCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+        Role.insert_roles()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        shutil.rmtree(self.app.config['STORAGE_LOCAL_PATH'], ignore_errors=True)
+
+    def test_put_get_delete(self):
+        etag = storage.put('assets/a.png', b'png', content_type='image/png')
+        self.assertEqual(storage.get('assets/a.png'), (etag, b'png'))
+        self.assertIsNone(storage.get('assets/a.png', etag))
+        self.assertTrue(storage.url('assets/a.png').endswith('/assets/a.png'))
+        storage.delete('assets/a.png')
+        with self.assertRaises(IOError):
+            storage.get('assets/a.png')
+
+    def test_keys_stay_inside_the_root(self):
+        with self.assertRaises(ValueError):
+            storage.put('../outside', b'')
+
+    def test_game_data_content(self):
+        game_data = GameData(file_name='quiz.json')
+        content = b'{"questions": []}' * 100
+        game_data.content = content
+        self.assertEqual(game_data.content, content)
+        self.assertEqual(storage.get(game_data.version_key())[1], content)
+        _, body = storage.get(game_data.version_key('gzip'))
+        self.assertEqual(gzip.decompress(body), content)
+        self.assertEqual(
+            storage.backend.head(game_data.version_key())['cache_control'],
+            IMMUTABLE_CACHE_CONTROL)
@@ -2,7 +2,8 @@ import unittest
 import time
 from datetime import datetime
 from app import create_app, db
-from app.models import User, AnonymousUser, Role, Permission, UserSchool
+from app.models import User, AnonymousUser, Role, Permission, UserSchool, \
+    IosDeviceInfo, School, Score, GameData, GameDataUpload
 
 
 class UserModelTestCase(unittest.TestCase):
@@ -241,3 +242,154 @@ class UserModelTestCase(unittest.TestCase):
         self.assertEquals(u.gender, 'undefined')
         u.update({'gender': 'female'})
         self.assertEquals(u.gender, 'female')
+
+    def test_teacher_relationship(self):
+        teacher = User(username='teacher', password='cat')
+        teacher.role = Role.get('Teacher')
+        student = User(username='student', password='cat', teacher=teacher)
+        db.session.add_all([teacher, student])
+        db.session.commit()
+        self.assertEqual(student.teacher_id, teacher.id)
+        self.assertEqual(student.teacher, teacher)
+        self.assertIn(student, teacher.assigned_students.all())
+        student.teacher = None
+        db.session.commit()
+        self.assertIsNone(student.teacher_id)
+
+    def test_get_cached(self):
+        u = User(username='felix', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        self.assertIs(User.get_cached(u.id), u)
+        self.assertIs(User.get_cached(str(u.id)), User.get_cached(u.id))
+        self.assertIsNone(User.get_cached(None))
+
+    def test_username_for_sequence(self):
+        usernames = set(IosDeviceInfo.username_for_sequence(n) for n in range(1, 5001))
+        self.assertEqual(len(usernames), 5000)
+        for username in usernames:
+            self.assertRegex(username, '^[a-z]{3}[0-9]{3}$')
+
+    def test_create_or_retrieve_device_user(self):
+        data = {
+            'duid': 'device',
+            'deviceModel': 'a',
+            'deviceType': 'b',
+            'deviceName': 'c',
+            'platform': 'd',
+            'operatingSystem': 'e',
+            'systemMemorySize': 'f',
+            'graphics': 'g',
+        }
+        user, password = IosDeviceInfo.create_or_retrieve(data)
+        self.assertTrue(user.verify_password(password))
+        self.assertTrue(user.is_student())
+        self.assertEqual(user.username, IosDeviceInfo.username_for_sequence(user.id))
+        self.assertEqual(IosDeviceInfo.query.get('device').user_id, user.id)
+
+        user2, password2 = IosDeviceInfo.create_or_retrieve(dict(data, duid='device2'))
+        self.assertNotEqual(user.id, user2.id)
+
+        same_user, new_password = IosDeviceInfo.create_or_retrieve(data)
+        self.assertEqual(same_user.id, user.id)
+        self.assertTrue(same_user.verify_password(new_password))
+
+    def test_tokens_are_purpose_separated(self):
+        u = User(email='john@example.com', password='cat')
+        db.session.add(u)
+        db.session.commit()
+        token = u.generate_reset_token()
+        self.assertFalse(u.confirm(token))
+        self.assertIsNone(User.verify_auth_token(token))
+        self.assertEqual(User.verify_auth_token(u.generate_auth_token(3600)), u)
+
+    def test_import_students_from_data(self):
+        teacher = User(username='teacher', password='cat')
+        teacher.role = Role.get('Teacher')
+        db.session.add(teacher)
+        db.session.commit()
+        db.session.add(User(username='existing', password='cat'))
+        db.session.commit()
+        csv_data = 'student1\tcat\tteacher\n' \
+                   'student2\tdog\tteacher\n' \
+                   'student1\tcow\tteacher\n' \
+                   'existing\tcat\tteacher\n' \
+                   'student3\tcat\tnobody\n' \
+                   'student4\tcat\n'
+        report = User.import_students_from_data(csv_data, '\t')
+        self.assertEqual(report.created, ['student1', 'student2'])
+        self.assertEqual(report.skipped, ['student1', 'existing'])
+        self.assertEqual([line for line, _ in report.errors], [5, 6])
+        student = User.query.filter_by(username='student1').first()
+        self.assertTrue(student.verify_password('cat'))
+        self.assertTrue(student.is_student())
+        self.assertEqual(student.teacher, teacher)
+
+    def test_import_students_reports_progress(self):
+        from app.importer import import_students
+        progress = []
+        lines = ['student{}\tcat\t\n'.format(i) for i in range(5)]
+        report = import_students(lines, '\t', batch_size=2,
+                                 progress=progress.append)
+        self.assertEqual(len(report.created), 5)
+        self.assertEqual(progress, [2, 4, 5])
+
+    def test_hash_passwords_on_pool(self):
+        from app.passwords import hash_passwords
+        self.app.config['PASSWORD_HASH_POOL_MIN'] = 2
+        self.app.config['PASSWORD_HASH_WORKERS'] = 2
+        passwords = ['cat', 'dog', 'cow']
+        for password, password_hash in zip(passwords, hash_passwords(passwords)):
+            u = User(password_hash=password_hash)
+            self.assertTrue(u.verify_password(password))
+
+    def test_delete_students(self):
+        teacher = User(username='teacher', password='cat')
+        teacher.role = Role.get('Teacher')
+        s1 = User(username='s1', password='cat', teacher=teacher,
+                  role=Role.get('Student'))
+        s2 = User(username='s2', password='cat', teacher=teacher,
+                  role=Role.get('Student'))
+        school = School(name='school')
+        school.add_student(s1)
+        db.session.add_all([teacher, s1, s2, school])
+        db.session.commit()
+        db.session.add(Score(user_id=s1.id, game='game', state='finished', score=1))
+        db.session.commit()
+        school_id, teacher_id = school.id, teacher.id
+
+        User.delete_users(teacher.student_ids())
+
+        self.assertEqual(User.query.filter_by(teacher_id=teacher_id).count(), 0)
+        self.assertEqual(Score.query.count(), 0)
+        self.assertEqual(UserSchool.query.count(), 0)
+        self.assertIsNotNone(School.query.get(school_id))
+        self.assertIsNotNone(User.query.get(teacher_id))
+
+    def test_delete_teacher_detaches_students(self):
+        teacher = User(username='teacher', password='cat')
+        teacher.role = Role.get('Teacher')
+        student = User(username='student', password='cat', teacher=teacher)
+        db.session.add_all([teacher, student])
+        db.session.commit()
+        student_id = student.id
+
+        User.delete_users([teacher.id])
+
+        db.session.expire_all()
+        self.assertIsNone(User.query.get(student_id).teacher_id)
+
+    def test_delete_admin_keeps_uploads(self):
+        admin = User(username='admin', password='cat', role=Role.get('Administrator'))
+        game_data = GameData(file_name='quiz.json')
+        db.session.add_all([admin, game_data])
+        db.session.commit()
+        upload = GameDataUpload(game_data=game_data, user_id=admin.id, state='saved')
+        db.session.add(upload)
+        db.session.commit()
+        upload_id = upload.id
+
+        User.delete_users([admin.id])
+
+        db.session.expire_all()
+        self.assertIsNone(GameDataUpload.query.get(upload_id).user_id)